@@ -1,51 +1,19 @@
+import argparse
+import json
 import sqlite3
-from datetime import datetime
-import hashlib
 import tkinter as tk
-from tkinter import messagebox, simpledialog, ttk
-
-# Connect to the SQLite database
-conn = sqlite3.connect('OmDayalLibrary1.db')
-cursor = conn.cursor()
-
-# Create necessary tables if they don't exist
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL
-)
-''')
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS book (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    title TEXT,
-    author TEXT,
-    price REAL,
-    available_copies INTEGER,
-    category TEXT,
-    publisher TEXT
-)
-''')
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS borrowed_books (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    book_id INTEGER,
-    borrow_return TEXT,
-    date_time TEXT,
-    FOREIGN KEY (user_id) REFERENCES users(id),
-    FOREIGN KEY (book_id) REFERENCES book(id)
-)
-''')
-conn.commit()
-
+from tkinter import messagebox, simpledialog
 
-def hash_password(password):
-    """Hashes a password using SHA-256."""
-    return hashlib.sha256(password.encode()).hexdigest()
+import book_search
+import catalog_cache
+import circulation
+import credentials
+import holds
+import library_store
+import session_cache
+import write_queue
+from catalog_view import CatalogView
+from task_runner import TaskRunner
 
 
 class LibraryApp:
@@ -55,7 +23,51 @@ class LibraryApp:
         self.root.geometry("800x600")
         self.root.configure(bg="#2E6F40")  # Set background color
         self.user_id = None
+        # Database work runs on worker threads so the window never freezes
+        self.tasks = TaskRunner(root, on_busy=self.show_busy)
+        self.screens = {}  # screen name -> frame, built on first use and raised after that
+        self.add_book_dialog = None  # the add-book form, hidden rather than destroyed when closed
+        self.database_ready = False
+        self.database_error = None  # set when opening the database failed
         self.main_screen()
+        # Draw the window first; the database is opened and checked on a worker
+        self.root.after_idle(self.open_database)
+
+    def show_busy(self, busy):
+        """Shows a busy cursor while database work is running."""
+        self.root.config(cursor="watch" if busy else "")
+
+    def open_database(self):
+        """Opens the database, applying any pending migrations, without holding up the window."""
+        def opened(version):
+            self.database_ready = True
+
+        def failed(e):
+            self.database_error = e
+            messagebox.showerror("Database Error", f"Could not open the library database:\n{e}")
+
+        self.tasks.submit("open_database", library_store.open_database, on_done=opened, on_error=failed)
+
+    def database_usable(self):
+        """Returns True once the database is open, telling the user why not otherwise."""
+        if self.database_ready:
+            return True
+        if self.database_error is not None:
+            messagebox.showerror("Database Error", f"The library database could not be opened:\n{self.database_error}")
+        else:
+            messagebox.showinfo("Please Wait", "The library database is still being opened. Try again in a moment.")
+        return False
+
+    def show_screen(self, name, build):
+        """Raises the named screen, building it with build(frame) the first time it is shown."""
+        frame = self.screens.get(name)
+        if frame is None:
+            frame = tk.Frame(self.root, bg="#2E6F40")
+            frame.place(relx=0, rely=0, relwidth=1, relheight=1)
+            build(frame)
+            self.screens[name] = frame
+        frame.tkraise()
+        return frame
 
     def force_focus(self, dialog):
         """Ensure the dialog grabs focus."""
@@ -64,11 +76,11 @@ class LibraryApp:
 
     def main_screen(self):
         """Displays the main login/register screen."""
-        for widget in self.root.winfo_children():
-            widget.destroy()
+        self.show_screen("main", self._build_main_screen)
 
+    def _build_main_screen(self, frame):
         tk.Label(
-            self.root,
+            frame,
             text="Welcome to OmDayal Group of Institutions Library Management System",
             font=("Arial", 20, "bold"),
             bg="#f0f8ff",
@@ -76,7 +88,7 @@ class LibraryApp:
         ).pack(pady=30)
 
         tk.Button(
-            self.root,
+            frame,
             text="Register",
             command=self.register_screen,
             width=20,
@@ -88,7 +100,7 @@ class LibraryApp:
         ).pack(pady=10)
 
         tk.Button(
-            self.root,
+            frame,
             text="Login",
             command=self.login_screen,
             width=20,
@@ -101,7 +113,7 @@ class LibraryApp:
 
         # Add About button
         tk.Button(
-            self.root,
+            frame,
             text="Help & Support",
             command=self.about_screen,
             width=20,
@@ -115,7 +127,7 @@ class LibraryApp:
 
 
         tk.Button(
-            self.root,
+            frame,
             text="Exit",
             command=self.root.quit,
             width=20,
@@ -166,6 +178,8 @@ class LibraryApp:
 
     def register_screen(self):
         """Displays the registration screen."""
+        if not self.database_usable():
+            return
         dialog = tk.Toplevel(self.root)
         dialog.title("Register")
         dialog.geometry("400x300")
@@ -180,15 +194,22 @@ class LibraryApp:
                 messagebox.showerror("Error", "Passwords do not match!", parent=dialog)
                 return
 
-            hashed_password = hash_password(password)
+            # Hashing is deliberately slow, so it runs on a worker with the insert
+            def insert_user():
+                try:
+                    credentials.register(username, password)
+                except sqlite3.IntegrityError:
+                    return False
+                return True
 
-            try:
-                cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_password))
-                conn.commit()
-                messagebox.showinfo("Success", "Registration successful!", parent=dialog)
-                dialog.destroy()
-            except sqlite3.IntegrityError:
-                messagebox.showerror("Error", "Username already exists.", parent=dialog)
+            def registered(success):
+                if success:
+                    messagebox.showinfo("Success", "Registration successful!", parent=dialog)
+                    dialog.destroy()
+                else:
+                    messagebox.showerror("Error", "Username already exists.", parent=dialog)
+
+            self.tasks.submit("register", insert_user, on_done=registered)
 
         tk.Label(dialog, text="Register", font=("Arial", 18, "bold"), bg="#f0f8ff", fg="#FF2B00").pack(pady=10)
         tk.Label(dialog, text="Username:", bg="#f0f8ff").pack(pady=5)
@@ -206,6 +227,8 @@ class LibraryApp:
 
     def login_screen(self):
         """Displays the login screen."""
+        if not self.database_usable():
+            return
         dialog = tk.Toplevel(self.root)
         dialog.title("Login")
         dialog.geometry("400x300")
@@ -214,17 +237,19 @@ class LibraryApp:
         def login_user():
             username = username_entry.get()
             password = password_entry.get()
-            hashed_password = hash_password(password)
-
-            cursor.execute("SELECT id FROM users WHERE username = ? AND password = ?", (username, hashed_password))
-            user = cursor.fetchone()
-            if user:
-                self.user_id = user[0]
-                messagebox.showinfo("Success", "Login successful!", parent=dialog)
-                dialog.destroy()
-                self.library_screen()
-            else:
-                messagebox.showerror("Error", "Invalid username or password.", parent=dialog)
+
+            def logged_in(user_id):
+                if user_id:
+                    self.user_id = user_id
+                    messagebox.showinfo("Success", "Login successful!", parent=dialog)
+                    dialog.destroy()
+                    self.library_screen()
+                    self.show_notices(user_id)
+                else:
+                    messagebox.showerror("Error", "Invalid username or password.", parent=dialog)
+
+            # Password verification is deliberately slow, so it runs on a worker
+            self.tasks.submit("login", credentials.authenticate, username, password, on_done=logged_in)
 
         tk.Label(dialog, text="Login", font=("Arial", 18, "bold"), bg="#f0f8ff", fg="#FF2B00").pack(pady=10)
         tk.Label(dialog, text="Username:", bg="#f0f8ff").pack(pady=5)
@@ -237,13 +262,20 @@ class LibraryApp:
 
         self.force_focus(dialog)
 
+    def logout(self):
+        """Forgets the logged-in user and returns to the main screen."""
+        if self.user_id is not None:
+            session_cache.sessions.invalidate(self.user_id)
+            self.user_id = None
+        self.main_screen()
+
     def library_screen(self):
         """Displays the main library management screen."""
-        for widget in self.root.winfo_children():
-            widget.destroy()
+        self.show_screen("library", self._build_library_screen)
 
+    def _build_library_screen(self, frame):
         tk.Label(
-            self.root,
+            frame,
             text="OmDayal Group of Institutions Library Management System",
             font=("Arial", 20, "bold"),
             bg="#f0f8ff",
@@ -256,13 +288,16 @@ class LibraryApp:
             ("Return a Book", self.return_book_screen),
             ("Add a Book", self.add_book_screen),
             ("Delete a Book", self.delete_book_screen),
+            ("Borrow Several Books", lambda: self.basket_screen("borrow")),
+            ("Return Several Books", lambda: self.basket_screen("return")),
+            ("Cancel a Hold", self.cancel_hold_screen),
             ("Help & Support", self.about_screen),
-            ("Logout", self.main_screen)
+            ("Logout", self.logout)
         ]
 
         for text, command in buttons:
             tk.Button(
-                self.root,
+                frame,
                 text=text,
                 command=command,
                 width=30,
@@ -306,26 +341,12 @@ class LibraryApp:
 
     def display_books(self):
         """Displays all available books."""
-        cursor.execute("SELECT * FROM book")
-        books = cursor.fetchall()
-
         book_window = tk.Toplevel(self.root)
         book_window.title("Available Books")
         book_window.configure(bg="#f0f8ff")
 
-        tree = ttk.Treeview(book_window, columns=("ID", "Title", "Author", "Price", "Available Copies", "Category", "Publisher"), show="headings")
-        tree.heading("ID", text="ID")
-        tree.heading("Title", text="Title")
-        tree.heading("Author", text="Author")
-        tree.heading("Price", text="Price")
-        tree.heading("Available Copies", text="Available Copies")
-        tree.heading("Category", text="Category")
-        tree.heading("Publisher", text="Publisher")
-
-        for book in books:
-            tree.insert("", "end", values=book)
-
-        tree.pack(fill="both", expand=True)
+        # Rows are paged in by id as the user scrolls, so the window opens instantly
+        CatalogView(book_window, tasks=self.tasks).pack(fill="both", expand=True)
 
 
 
@@ -340,22 +361,159 @@ class LibraryApp:
             return
         self.borrow_book(self.user_id, identifier)
 
+    def suggest_book(self, action, books, retry):
+        """Offers the closest catalogue matches when a lookup finds nothing, and retries with the chosen id."""
+        book = books[0]
+        message = f"No exact match. Did you mean '{book[1]}' by {book[2]}?"
+        if len(books) > 1:
+            message += "\n\nOther matches:\n" + "\n".join(f"  {other[1]} by {other[2]}" for other in books[1:])
+        if messagebox.askyesno(action, message):
+            retry(str(book[0]))
+
     def borrow_book(self, user_id, identifier):
         """Processes the borrowing of a book."""
-        cursor.execute("SELECT id, title, available_copies, category, publisher FROM book WHERE id = ? OR title = ? OR category = ? OR publisher = ?",
-                       (identifier, identifier, identifier, identifier))
-        result = cursor.fetchone()
-
-        if result and result[2] > 0:
-            book_id, title, available_copies, category, publisher = result
-            cursor.execute("UPDATE book SET available_copies = available_copies - 1 WHERE id = ?", (book_id,))
-            borrow_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cursor.execute("INSERT INTO borrowed_books (user_id, book_id, borrow_return, date_time) VALUES (?, ?, ?, ?)",
-                           (user_id, book_id, 'B', borrow_date))
-            conn.commit()
-            messagebox.showinfo("Success", f"You borrowed '{title}' (Category: {category}, Publisher: {publisher}).")
-        else:
-            messagebox.showerror("Error", "Book is not available or does not exist.")
+        def borrow():
+            session_cache.check_loan_limit(user_id)
+            cursor = catalog_cache.execute("borrow_lookup", (identifier, identifier, identifier, identifier))
+            result = cursor.fetchone()
+            if result is None:
+                return None, book_search.search_books(identifier), None
+            # The command checks the shelf itself, since a copy may be kept for this user's hold
+            if write_queue.run(circulation.borrow_command(user_id, result[0])):
+                return result, [], None
+            return None, [], result
+
+        def borrowed(outcome):
+            result, suggestions, unavailable = outcome
+            if result:
+                book_id, title, available_copies, category, publisher = result
+                messagebox.showinfo("Success", f"You borrowed '{title}' (Category: {category}, Publisher: {publisher}).")
+            elif suggestions:
+                self.suggest_book("Borrow a Book", suggestions, lambda book_id: self.borrow_book(user_id, book_id))
+            elif unavailable:
+                if messagebox.askyesno("Borrow a Book", f"No copy of '{unavailable[1]}' is on the shelf.\n\n"
+                                                        "Place a hold and have the next returned copy kept for you?"):
+                    self.place_hold(user_id, unavailable[0])
+            else:
+                messagebox.showerror("Error", "Book is not available or does not exist.")
+
+        self.tasks.submit("borrow", borrow, on_done=borrowed)
+
+    def place_hold(self, user_id, book_id):
+        """Puts the user in the book's hold queue and tells them their place in it."""
+        def hold():
+            if write_queue.run(holds.place_hold_command(user_id, book_id)) is None:
+                return None
+            return holds.position(user_id, book_id)
+
+        def held(place):
+            if place is None:
+                messagebox.showinfo("Place a Hold", "A copy is back on the shelf, so you can borrow it now.")
+            elif place[0] == 0:
+                messagebox.showinfo("Place a Hold", "A copy is already being kept for you.")
+            else:
+                messagebox.showinfo("Place a Hold", f"You are number {place[0]} of {place[1]} in the queue.")
+
+        self.tasks.submit("hold", hold, on_done=held)
+
+    def show_notices(self, user_id):
+        """Tells the user about copies that came in for their holds while they were away."""
+        def shown(notices):
+            if notices:
+                messagebox.showinfo("Holds", "\n".join(holds.notice_text(title, ready_until)
+                                                        for _, title, ready_until in notices))
+
+        self.tasks.submit("notices", write_queue.run, holds.take_notices_command(user_id), on_done=shown)
+
+    def cancel_hold_screen(self):
+        """Handles leaving a book's hold queue."""
+        identifier = simpledialog.askstring("Cancel a Hold", "Enter the book ID or Title:")
+        if not identifier:
+            return
+        self.cancel_hold(self.user_id, identifier)
+
+    def cancel_hold(self, user_id, identifier):
+        """Takes the user out of a book's hold queue."""
+        def cancel():
+            books = circulation.lookup_books(library_store.connection(), [identifier])
+            if not books:
+                return None, False
+            book_id, title = books[identifier]
+            return title, write_queue.run(holds.cancel_hold_command(user_id, book_id))
+
+        def cancelled(outcome):
+            title, done = outcome
+            if title is None:
+                messagebox.showerror("Error", "Book not found.")
+            elif done:
+                messagebox.showinfo("Cancel a Hold", f"Your hold on '{title}' is cancelled.")
+            else:
+                messagebox.showinfo("Cancel a Hold", f"You have no hold on '{title}'.")
+
+        self.tasks.submit("cancel_hold", cancel, on_done=cancelled)
+
+    def basket_screen(self, action):
+        """Collects several book IDs or titles and borrows or returns them together."""
+        window = tk.Toplevel(self.root)
+        window.title("Borrow Several Books" if action == "borrow" else "Return Several Books")
+        window.configure(bg="#f0f8ff")
+
+        tk.Label(window, text="Scan or type a book ID or Title and press Enter:", bg="#f0f8ff").pack(pady=5)
+        entry = tk.Entry(window, font=("Arial", 12))
+        entry.pack(pady=5)
+        basket = tk.Listbox(window, font=("Arial", 12), width=40, height=10, selectmode="extended")
+        basket.pack(padx=10, pady=5)
+
+        def scan(event=None):
+            identifier = entry.get().strip()
+            if identifier:
+                basket.insert("end", identifier)
+            entry.delete(0, "end")
+
+        def remove():
+            for index in reversed(basket.curselection()):
+                basket.delete(index)
+
+        def commit():
+            identifiers = list(basket.get(0, "end"))
+            if identifiers:
+                self.checkout_basket(self.user_id, action, identifiers, window)
+
+        entry.bind("<Return>", scan)
+        tk.Button(window, text="Remove Selected", command=remove).pack(pady=5)
+        tk.Button(window, text="Borrow All" if action == "borrow" else "Return All", command=commit,
+                  bg="#942e2e", fg="white", font=("Arial", 12, "bold")).pack(pady=10)
+        entry.focus_set()
+
+    def checkout_basket(self, user_id, action, identifiers, window):
+        """Borrows or returns every book in a basket in one transaction, or none of them."""
+        def work():
+            conn = library_store.connection()
+            books = circulation.lookup_books(conn, identifiers)
+            missing = [identifier for identifier in identifiers if identifier not in books]
+            if missing:
+                return books, missing, []
+            book_ids = [books[identifier][0] for identifier in identifiers]
+            if action == "borrow":
+                session_cache.check_loan_limit(user_id, len(book_ids))
+                return books, [], write_queue.run(circulation.borrow_books_command(user_id, book_ids))
+            return books, [], write_queue.run(circulation.return_books_command(user_id, book_ids))
+
+        def done(outcome):
+            books, missing, refused = outcome
+            titles = {book_id: title for book_id, title in books.values()}
+            verb = "borrowed" if action == "borrow" else "returned"
+            if missing:
+                messagebox.showerror("Error", f"Not found: {', '.join(missing)}.\nNothing was {verb}.")
+            elif refused:
+                names = ", ".join(f"'{titles[book_id]}'" for book_id in refused)
+                reason = "Not enough copies available of" if action == "borrow" else "No record of you borrowing"
+                messagebox.showerror("Error", f"{reason} {names}.\nNothing was {verb}.")
+            else:
+                messagebox.showinfo("Success", f"{len(identifiers)} books {verb}.")
+                window.destroy()
+
+        self.tasks.submit(action + "_basket", work, on_done=done)
 
     def return_book_screen(self):
         """Handles returning a book."""
@@ -366,31 +524,38 @@ class LibraryApp:
 
     def return_book(self, user_id, identifier):
         """Processes the return of a book."""
-        cursor.execute("SELECT id, title, category, publisher FROM book WHERE id = ? OR title = ? OR category = ? OR publisher = ?",
-                       (identifier, identifier, identifier, identifier))
-        result = cursor.fetchone()
-
-        if result:
+        def give_back():
+            cursor = catalog_cache.execute("return_lookup", (identifier, identifier, identifier, identifier))
+            result = cursor.fetchone()
+            if result is None:
+                return None, False, book_search.search_books(identifier)
+            return result, write_queue.run(circulation.return_command(user_id, result[0])), []
+
+        def given_back(outcome):
+            result, returned, suggestions = outcome
+            if result is None:
+                if suggestions:
+                    self.suggest_book("Return a Book", suggestions, lambda book_id: self.return_book(user_id, book_id))
+                else:
+                    messagebox.showerror("Error", "Book does not exist.")
+                return
             book_id, title, category, publisher = result
-            cursor.execute("SELECT id FROM borrowed_books WHERE user_id = ? AND book_id = ? AND borrow_return = 'B'",
-                           (user_id, book_id))
-            borrow_record = cursor.fetchone()
-
-            if borrow_record:
-                cursor.execute("UPDATE book SET available_copies = available_copies + 1 WHERE id = ?", (book_id,))
-                return_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                cursor.execute("INSERT INTO borrowed_books (user_id, book_id, borrow_return, date_time) VALUES (?, ?, ?, ?)",
-                               (user_id, book_id, 'R', return_date))
-                conn.commit()
+            if returned:
                 messagebox.showinfo("Success", f"You returned '{title}' (Category: {category}, Publisher: {publisher}).")
             else:
                 messagebox.showerror("Error", "You have not borrowed this book.")
-        else:
-            messagebox.showerror("Error", "Book does not exist.")
+
+        self.tasks.submit("return", give_back, on_done=given_back)
 
     def add_book_screen(self):
         """Handles adding a new book to the library."""
+        if self.add_book_dialog is not None:
+            self.add_book_dialog.deiconify()
+            self.force_focus(self.add_book_dialog)
+            return
+
         dialog = tk.Toplevel(self.root)
+        self.add_book_dialog = dialog
         dialog.title("Add Book")
         dialog.geometry("500x800")
         dialog.configure(bg="#a9c6e7")
@@ -412,36 +577,47 @@ class LibraryApp:
             tk.Label(dialog, text=f"{label}:", bg="#f0f8ff", font=("Arial", 12)).pack(pady=5)
             tk.Entry(dialog, textvariable=var, font=("Arial", 12)).pack(pady=5)
 
+        def close():
+            # Keep the form for next time instead of building it again
+            dialog.grab_release()
+            dialog.withdraw()
+
         def submit_book():
             try:
-                # Retrieve input values
-                title = fields["Title"].get()
-                author = fields["Author"].get()
-                price = float(fields["Price"].get())
-                available_copies = int(fields["Available Copies"].get())
-                category = fields["Category"].get()
-                publisher = fields["Publisher"].get()
-
-                if not title or not author or not category or not publisher:
-                    raise ValueError("All fields except Price and Available Copies must be filled!")
-
-                # Insert the book into the database
-                cursor.execute(
-                    "INSERT INTO book (title, author, price, available_copies, category, publisher) VALUES (?, ?, ?, ?, ?, ?)",
-                    (title, author, price, available_copies, category, publisher)
+                # Retrieve and check input values
+                book = library_store.validate_book(
+                    fields["Title"].get(),
+                    fields["Author"].get(),
+                    fields["Price"].get(),
+                    fields["Available Copies"].get(),
+                    fields["Category"].get(),
+                    fields["Publisher"].get()
                 )
-                conn.commit()
-                messagebox.showinfo("Success", f"Book '{title}' added successfully!", parent=dialog)
-                dialog.destroy()
+                title = book[0]
             except ValueError as e:
                 messagebox.showerror("Error", str(e), parent=dialog)
-            except Exception as e:
+                return
+
+            def insert_book():
+                write_queue.execute("add_book", book)
+
+            def added(_):
+                messagebox.showinfo("Success", f"Book '{title}' added successfully!", parent=dialog)
+                for var in fields.values():
+                    var.set("")
+                close()
+
+            def failed(e):
                 messagebox.showerror("Error", f"Unexpected error: {str(e)}", parent=dialog)
 
+            # Insert the book into the database
+            self.tasks.submit("add", insert_book, on_done=added, on_error=failed)
+
         # Submit button
         tk.Button(dialog, text="Add Book", command=submit_book, bg="#FF2B00", fg="white", font=("Arial", 12, "bold")).pack(pady=20)
 
         # Focus on the dialog and prevent interaction with the main window
+        dialog.protocol("WM_DELETE_WINDOW", close)
         dialog.transient(self.root)
         dialog.grab_set()
         dialog.focus()
@@ -455,14 +631,40 @@ class LibraryApp:
 
     def delete_book(self, identifier):
         """Deletes the specified book from the database."""
-        cursor.execute("DELETE FROM book WHERE id = ? OR title = ?", (identifier, identifier))
-        conn.commit()
-        messagebox.showinfo("Success", f"Book '{identifier}' has been deleted.")
+        def delete():
+            deleted, _ = write_queue.execute("delete_book_by_id_or_title", (identifier, identifier))
+            if deleted == 0:
+                # Still in the catalogue means it was refused for copies that are out
+                book = catalog_cache.execute("delete_lookup", (identifier, identifier)).fetchone()
+                if book is not None:
+                    return 0, [], book
+                return 0, book_search.search_books(identifier), None
+            return deleted, [], None
+
+        def deleted(outcome):
+            deleted_count, suggestions, copies_out = outcome
+            if deleted_count:
+                messagebox.showinfo("Success", f"Book '{identifier}' has been deleted.")
+            elif copies_out:
+                messagebox.showerror("Error", f"Book '{copies_out[1]}' has copies out on loan or kept for a hold, "
+                                              "so it cannot be deleted yet.")
+            elif suggestions:
+                self.suggest_book("Delete Book", suggestions, self.delete_book)
+            else:
+                messagebox.showerror("Error", "Book not found.")
+
+        self.tasks.submit("delete", delete, on_done=deleted)
 
 
 # Main tkinter loop
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OmDayal Library Management System")
+    parser.add_argument("--latency-report", action="store_true",
+                        help="print per-operation latency and event-loop lag on exit")
+    args = parser.parse_args()
     root = tk.Tk()
     app = LibraryApp(root)
-    root.mainloop() 
+    root.mainloop()
+    if args.latency_report:
+        print(json.dumps(app.tasks.latency_report(), indent=2))
 
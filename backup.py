@@ -0,0 +1,291 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import time
+from datetime import datetime
+
+import library_store
+
+BACKUP_DIR = "backups"
+STEP_PAGES = 1024  # pages copied per backup step, 4 MB at the default page size
+STEP_PAUSE = 0.005  # seconds between steps, so desks can commit while a copy runs
+MAX_RESTARTS = 3  # restarts caused by other connections' commits before the rest is copied in one step
+FULL_EVERY = 7  # incremental snapshots taken between two full ones
+CHUNK_PAGES = 256  # pages compared at a time when a delta is worked out
+
+# The files of one library: the database and its archived ledger, by schema name
+PARTS = {"main": "", "archive": "_archive"}
+MANIFEST = "manifest.jsonl"
+
+# A delta holds the pages of an image that differ from the one before it:
+# a header with the page size and the new image's page count, then each
+# changed page as its number followed by its bytes.
+DELTA_MAGIC = b"OMDELTA1"
+DELTA_HEADER = struct.Struct("<8sII")
+DELTA_PAGE = struct.Struct("<I")
+
+
+class _Restarted(Exception):
+    pass
+
+
+def copy_database(dest, name="main", pages=STEP_PAGES, pause=STEP_PAUSE, max_restarts=MAX_RESTARTS):
+    """Copies one database of the calling thread's connection to the file dest with the online backup API.
+
+    The copy runs `pages` pages at a time with `pause` seconds between steps,
+    so the library stays usable throughout. A commit from another connection
+    makes the copy start over at its next step; after max_restarts of those
+    the rest is copied in one step, which under WAL is a single read
+    transaction and still does not block writers. Returns (pages, restarts).
+    """
+    source = library_store.connection()
+    restarts = 0
+    last = None
+
+    def progress(status, remaining, total):
+        nonlocal last, restarts
+        if last is not None and remaining >= last:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _Restarted
+        last = remaining
+        if remaining:
+            time.sleep(pause)
+
+    _remove(dest)
+    target = sqlite3.connect(dest)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress, name=name)
+        except _Restarted:
+            source.backup(target, pages=-1, name=name)
+        (copied,) = target.execute("PRAGMA page_count").fetchone()
+    finally:
+        target.close()
+    return copied, restarts
+
+
+def verify(path):
+    """Runs integrity_check on a backup file without changing it. Returns its problems, or [] if there are none."""
+    conn = sqlite3.connect(f"file:{path}?immutable=1", uri=True)
+    try:
+        problems = [message for (message,) in conn.execute("PRAGMA integrity_check")]
+    finally:
+        conn.close()
+    return [] if problems == ["ok"] else problems
+
+
+def _remove(path):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _page_size(path):
+    with open(path, "rb") as f:
+        header = f.read(100)
+    size = int.from_bytes(header[16:18], "big")
+    return 65536 if size == 1 else size
+
+
+def write_delta(old, new, out):
+    """Writes the pages of image `new` that differ from image `old` to out. Returns how many there were."""
+    page_size = _page_size(new)
+    chunk = page_size * CHUNK_PAGES
+    changed = 0
+    with open(old, "rb") as before, open(new, "rb") as after, open(out, "wb") as delta:
+        pages = os.fstat(after.fileno()).st_size // page_size
+        delta.write(DELTA_HEADER.pack(DELTA_MAGIC, page_size, pages))
+        first = 1
+        while True:
+            data = after.read(chunk)
+            if not data:
+                break
+            previous = before.read(chunk)
+            # Most chunks are unchanged and compare as a whole
+            if data != previous:
+                for offset in range(0, len(data), page_size):
+                    page = data[offset:offset + page_size]
+                    if page != previous[offset:offset + page_size]:
+                        delta.write(DELTA_PAGE.pack(first + offset // page_size))
+                        delta.write(page)
+                        changed += 1
+            first += len(data) // page_size
+    return changed
+
+
+def apply_delta(image, delta_path):
+    """Brings the image file up to the snapshot the delta was taken at."""
+    with open(delta_path, "rb") as delta, open(image, "r+b") as f:
+        magic, page_size, pages = DELTA_HEADER.unpack(delta.read(DELTA_HEADER.size))
+        if magic != DELTA_MAGIC:
+            raise ValueError(f"{delta_path} is not a snapshot delta")
+        while True:
+            number = delta.read(DELTA_PAGE.size)
+            if not number:
+                break
+            (page,) = DELTA_PAGE.unpack(number)
+            f.seek((page - 1) * page_size)
+            f.write(delta.read(page_size))
+        f.truncate(pages * page_size)
+
+
+def read_manifest(directory=BACKUP_DIR):
+    """Returns the snapshots in directory, oldest first."""
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def _file(directory, stamp, part, kind):
+    return os.path.join(directory, f"{stamp}{PARTS[part]}.{kind}")
+
+
+def snapshot(directory=BACKUP_DIR, full=False, pages=STEP_PAGES, pause=STEP_PAUSE):
+    """Takes a snapshot of the open library into directory and returns its manifest entry.
+
+    Each file is copied online to a staging file and checked with
+    integrity_check. A full snapshot keeps the copy; an incremental one keeps
+    only the pages that changed since the previous snapshot, found by
+    comparing the copy with the previous image (latest.db, latest_archive.db).
+    Every FULL_EVERY incremental snapshots the next one is full, which bounds
+    how many deltas a restore applies. The database is copied before the
+    archive, so ledger entries archived in between appear in both copies and
+    are never missing from either; restore removes the duplicates.
+    """
+    os.makedirs(directory, exist_ok=True)
+    entries = read_manifest(directory)
+    since_full = next((i for i, entry in enumerate(reversed(entries)) if entry["full"]), len(entries))
+    full = full or since_full >= FULL_EVERY or not os.path.exists(os.path.join(directory, "latest.db"))
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")[:-3]
+    entry = {"stamp": stamp, "full": full, "parts": {}}
+    started = time.perf_counter()
+    for part, suffix in PARTS.items():
+        staging = os.path.join(directory, f"staging{suffix}.db")
+        latest = os.path.join(directory, f"latest{suffix}.db")
+        copy_started = time.perf_counter()
+        copied, restarts = copy_database(staging, part, pages, pause)
+        verify_started = time.perf_counter()
+        problems = verify(staging)
+        verified = time.perf_counter()
+        if problems:
+            raise sqlite3.DatabaseError(f"The snapshot of {part} failed its integrity check: {problems[0]}")
+        if full:
+            shutil.copyfile(staging, _file(directory, stamp, part, "db"))
+            changed = copied
+        else:
+            changed = write_delta(latest, staging, _file(directory, stamp, part, "delta"))
+        os.replace(staging, latest)
+        entry["parts"][part] = {"pages": copied, "changed": changed, "restarts": restarts,
+                                "copy_seconds": round(verify_started - copy_started, 3),
+                                "verify_seconds": round(verified - verify_started, 3)}
+    entry["seconds"] = round(time.perf_counter() - started, 3)
+    with open(os.path.join(directory, MANIFEST), "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+    return entry
+
+
+def _chain(entries, stamp=None):
+    """Returns the snapshots to apply, from the last full one up to `stamp` (the newest if None)."""
+    stamps = [entry["stamp"] for entry in entries]
+    if stamp is None:
+        end = len(entries) - 1
+    elif stamp in stamps:
+        end = stamps.index(stamp)
+    else:
+        raise ValueError(f"No snapshot {stamp}.")
+    if end < 0:
+        raise ValueError("There are no snapshots.")
+    start = end
+    while not entries[start]["full"]:
+        start -= 1
+    return entries[start:end + 1]
+
+
+def restore(directory=BACKUP_DIR, stamp=None, db=library_store.DB_PATH):
+    """Writes snapshot `stamp` (the newest if None) back into the library at db. Returns the stamp restored.
+
+    The image is rebuilt from the last full snapshot and the deltas after it
+    in scratch files, and checked with integrity_check before anything is
+    written. It is then copied into db and its archive with the backup API,
+    which takes the database's own locks, so no process ever reads a
+    half-replaced file. Desks keep in-memory indexes of the old data and
+    should be restarted afterwards.
+    """
+    chain = _chain(read_manifest(directory), stamp)
+    images = {}
+    for part, suffix in PARTS.items():
+        image = os.path.join(directory, f"restore{suffix}.db")
+        _remove(image)
+        shutil.copyfile(_file(directory, chain[0]["stamp"], part, "db"), image)
+        for entry in chain[1:]:
+            apply_delta(image, _file(directory, entry["stamp"], part, "delta"))
+        problems = verify(image)
+        if problems:
+            raise sqlite3.DatabaseError(f"The restored {part} failed its integrity check: {problems[0]}")
+        images[part] = image
+
+    for part, path in (("main", db), ("archive", library_store.archive_path(db))):
+        source = sqlite3.connect(images[part])
+        target = sqlite3.connect(path, timeout=library_store.BUSY_TIMEOUT)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        _remove(images[part])
+
+    library_store.configure(db)
+    conn = library_store.connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM main.borrowed_books WHERE id IN (SELECT id FROM archive.borrowed_books)")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return chain[-1]["stamp"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up the library while it is open, and restore it.")
+    parser.add_argument("action", choices=("snapshot", "list", "restore"))
+    parser.add_argument("--db", default=library_store.DB_PATH, help="database file")
+    parser.add_argument("--dir", default=BACKUP_DIR, help="snapshot directory")
+    parser.add_argument("--full", action="store_true", help="take a full snapshot rather than an incremental one")
+    parser.add_argument("--at", help="snapshot to restore, as shown by list (default: the newest)")
+    parser.add_argument("--step-pages", type=int, default=STEP_PAGES, help="pages copied per backup step")
+    parser.add_argument("--pause", type=float, default=STEP_PAUSE, help="seconds between backup steps")
+    args = parser.parse_args()
+
+    if args.action == "list":
+        for entry in read_manifest(args.dir):
+            pages = sum(part["changed"] for part in entry["parts"].values())
+            print(f"{entry['stamp']}  {'full' if entry['full'] else 'incremental':<11}  {pages} pages  "
+                  f"{entry['seconds']}s")
+        return
+    library_store.configure(args.db)
+    started = time.perf_counter()
+    if args.action == "snapshot":
+        entry = snapshot(args.dir, args.full, args.step_pages, args.pause)
+        for part, info in entry["parts"].items():
+            print(f"  {part}: {info['pages']} pages, {info['changed']} kept, {info['restarts']} restarts, "
+                  f"copied in {info['copy_seconds']:.2f}s, verified in {info['verify_seconds']:.2f}s")
+        print(f"{'Full' if entry['full'] else 'Incremental'} snapshot {entry['stamp']} taken and verified "
+              f"in {entry['seconds']:.2f}s.")
+    else:
+        try:
+            stamp = restore(args.dir, args.at, args.db)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Restored snapshot {stamp} into {args.db} in {time.perf_counter() - started:.2f}s.")
+    library_store.close()
+
+
+if __name__ == "__main__":
+    main()
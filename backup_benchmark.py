@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import threading
+import time
+
+import backup
+import benchmark
+import library_store
+
+WRITE_PAUSE = 0.01  # seconds between the foreground writer's commits
+BASELINE_SECONDS = 2.0
+CHANGED_BOOKS = 5_000  # books updated between the full and the incremental snapshot
+
+
+class Writer:
+    """Commits small updates on its own connection, as a desk would, and records each commit's latency."""
+
+    def __init__(self, path, seed):
+        self.path = path
+        self.rng = random.Random(seed)
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        conn = sqlite3.connect(self.path, timeout=library_store.BUSY_TIMEOUT)
+        (books,) = conn.execute("SELECT MAX(id) FROM book").fetchone()
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            conn.execute("UPDATE book SET price = price + 0.01 WHERE id = ?", (self.rng.randint(1, books),))
+            conn.commit()
+            self.samples.append(time.perf_counter() - started)
+            time.sleep(WRITE_PAUSE)
+        conn.close()
+
+    def __enter__(self):
+        self.samples = []
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self):
+        return {
+            "commits": len(self.samples),
+            "p50_ms": round(benchmark._percentile(self.samples, 0.50) * 1000, 3),
+            "p99_ms": round(benchmark._percentile(self.samples, 0.99) * 1000, 3),
+            "max_ms": round(max(self.samples) * 1000, 3),
+        }
+
+
+def _database_mb(conn):
+    (pages,) = conn.execute("PRAGMA page_count").fetchone()
+    (page_size,) = conn.execute("PRAGMA page_size").fetchone()
+    return round(pages * page_size / (1024 * 1024), 1)
+
+
+def _snapshot(directory, full, writer, pages, pause):
+    with writer:
+        entry = backup.snapshot(directory, full, pages, pause)
+    files = [os.path.join(directory, name) for name in os.listdir(directory) if name.startswith(entry["stamp"])]
+    return {
+        "seconds": entry["seconds"],
+        "pages": {part: info["changed"] for part, info in entry["parts"].items()},
+        "restarts": {part: info["restarts"] for part, info in entry["parts"].items()},
+        "copy_seconds": round(sum(info["copy_seconds"] for info in entry["parts"].values()), 3),
+        "verify_seconds": round(sum(info["verify_seconds"] for info in entry["parts"].values()), 3),
+        "stored_mb": round(sum(os.path.getsize(path) for path in files) / (1024 * 1024), 1),
+        "writer": writer.report(),
+    }
+
+
+def run(size="1m", seed=42, pages=backup.STEP_PAGES, pause=backup.STEP_PAUSE):
+    """Times full and incremental snapshots, verification and restore of a synthetic database under write load."""
+    template = benchmark.template_path(size, seed)
+    work = os.path.join(benchmark.DATA_DIR, f"backup-{size}.db")
+    restored = os.path.join(benchmark.DATA_DIR, f"restored-{size}.db")
+    snapshots = os.path.join(benchmark.DATA_DIR, f"snapshots-{size}")
+    for path in (work, restored):
+        backup._remove(path)
+        backup._remove(library_store.archive_path(path))
+    shutil.rmtree(snapshots, ignore_errors=True)
+    shutil.copyfile(template, work)
+    library_store.configure(work)
+    conn = library_store.connection()
+
+    writer = Writer(work, seed)
+    results = {"database_mb": _database_mb(conn)}
+    with writer:
+        time.sleep(BASELINE_SECONDS)
+    results["idle_writer"] = writer.report()
+    results["full_snapshot"] = _snapshot(snapshots, True, writer, pages, pause)
+
+    conn.execute("UPDATE book SET price = price + 1 WHERE id IN (SELECT id FROM book ORDER BY random() LIMIT ?)",
+                 (CHANGED_BOOKS,))
+    conn.commit()
+    results["incremental_snapshot"] = _snapshot(snapshots, False, writer, pages, pause)
+
+    started = time.perf_counter()
+    backup.verify(os.path.join(snapshots, "latest.db"))
+    results["integrity_check_seconds"] = round(time.perf_counter() - started, 3)
+    library_store.close()
+
+    started = time.perf_counter()
+    backup.restore(snapshots, None, restored)
+    results["restore_seconds"] = round(time.perf_counter() - started, 3)
+    library_store.close()
+    for part in ("full_snapshot", "incremental_snapshot"):
+        results[part]["mb_per_second"] = round(results["database_mb"] / results[part]["seconds"], 1)
+    return {
+        "commit": benchmark._commit(),
+        "size": size,
+        "seed": seed,
+        "step_pages": pages,
+        "pause": pause,
+        "sqlite": sqlite3.sqlite_version,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark online snapshots and restore on synthetic data.")
+    parser.add_argument("--size", default="1m", help="10k, 1m, 10m or a ledger row count")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--step-pages", type=int, default=backup.STEP_PAGES, help="pages copied per backup step")
+    parser.add_argument("--pause", type=float, default=backup.STEP_PAUSE, help="seconds between backup steps")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run(args.size, args.seed, args.step_pages, args.pause)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import builtins
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import time
+
+import catalog_cache
+import circulation
+import library_store
+import session_cache
+import synthetic_data
+import test3
+import write_queue
+
+DATA_DIR = "bench_data"
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _latency(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": round(_percentile(samples, 0.50) * 1000, 3),
+        "p99_ms": round(_percentile(samples, 0.99) * 1000, 3),
+    }
+
+
+def timed(name, calls, results, successes=None):
+    """Runs each zero-argument callable in calls, recording latency and throughput under name.
+
+    successes, if given, returns a running count of successful operations;
+    a call that does not raise it counts as rejected, and the two kinds are
+    also reported apart, since a refusal takes a shorter path.
+    """
+    samples = []
+    succeeded, rejected = [], []
+    started = time.perf_counter()
+    for call in calls:
+        before = successes() if successes else None
+        t = time.perf_counter()
+        call()
+        elapsed_call = time.perf_counter() - t
+        samples.append(elapsed_call)
+        if successes:
+            (succeeded if successes() > before else rejected).append(elapsed_call)
+    elapsed = time.perf_counter() - started
+    if samples:
+        results[name] = {
+            **_latency(samples),
+            "ops_per_second": round(len(samples) / elapsed, 1) if elapsed else None,
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+        if successes:
+            results[name]["succeeded"] = _latency(succeeded) if succeeded else {"count": 0}
+            results[name]["rejected"] = _latency(rejected) if rejected else {"count": 0}
+
+
+def _plan_borrows(conn, rng, count, book_weights, by_title=False, state=None):
+    """Picks up to `count` (user, book id, title) loans that can all be made in order.
+
+    Books are drawn by popularity, skipping those with no copy left, and users
+    at random among those under the loan limit, against a running tally of
+    copies and loans so the timed borrows are lends rather than refusals.
+    Fewer are returned once the library runs out of copies. With by_title the
+    book is the one its title resolves to, since titles repeat.
+    """
+    available, loans, users = state
+    books = len(book_weights)
+    planned = []
+    for _ in range(count * 20):
+        if len(planned) == count:
+            break
+        book_id = rng.choices(range(1, books + 1), cum_weights=book_weights)[0]
+        title = None
+        if by_title:
+            (title,) = conn.execute("SELECT title FROM book WHERE id = ?", (book_id,)).fetchone()
+            book_id = conn.execute(library_store.QUERIES["borrow_by_title"], (title,)).fetchone()[0]
+        if available.get(book_id, 0) <= 0:
+            continue
+        user_id = rng.randint(1, users)
+        if session_cache.LOAN_LIMIT is not None and loans.get(user_id, 0) >= session_cache.LOAN_LIMIT:
+            continue
+        available[book_id] -= 1
+        loans[user_id] = loans.get(user_id, 0) + 1
+        planned.append((user_id, book_id, title))
+    return planned
+
+
+def template_path(size, seed):
+    """Returns the cached synthetic database for size and seed, generating it on first use."""
+    path = os.path.join(DATA_DIR, f"library-{size}-seed{seed}.db")
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        synthetic_data.generate(path, size, seed)
+    return path
+
+
+def run(size="10k", ops=1000, display_runs=3, seed=42):
+    """Benchmarks the test3.py operations on a fresh copy of a synthetic database."""
+    template = template_path(size, seed)
+    work = os.path.join(DATA_DIR, f"work-{size}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    shutil.copyfile(template, work)
+    library_store.configure(work)
+    circulation.reset_stats()
+    session_cache.sessions.clear()
+
+    conn = library_store.connection()
+    books = conn.execute("SELECT MAX(id) FROM book").fetchone()[0]
+    users = conn.execute("SELECT MAX(id) FROM users").fetchone()[0]
+    rng = random.Random(seed)
+    book_weights = synthetic_data.zipf_weights(books, 1.05)
+    state = (dict(conn.execute(f"SELECT id, available_copies FROM book WHERE {library_store.LIVE}")),
+             dict(conn.execute("SELECT user_id, SUM(copies) FROM open_loans GROUP BY user_id")), users)
+    # Both phases draw on the same copies; the smaller one is planned first so it is not starved
+    by_title = _plan_borrows(conn, rng, ops // 4, book_weights, by_title=True, state=state)
+    borrowed = _plan_borrows(conn, rng, ops, book_weights, state=state)
+    # Give back exactly the copies lent above, in another order
+    returned = [(user_id, book_id) for user_id, book_id, _ in borrowed + by_title]
+    rng.shuffle(returned)
+    # Books with every copy on the shelf, which can be deleted
+    deletable = [book_id for (book_id,) in conn.execute(
+        f"SELECT id FROM book WHERE {library_store.LIVE} AND {library_store.ALL_COPIES_IN}")]
+    deleted = rng.sample(deletable, min(ops // 10, len(deletable)))
+
+    def deleted_so_far():
+        return conn.execute("SELECT COUNT(*) FROM book WHERE deleted_at IS NOT NULL").fetchone()[0]
+
+    results = {}
+    # The operations print and, when a lookup misses, prompt; run them silently and answer prompts with Enter
+    real_input = builtins.input
+    builtins.input = lambda prompt="": ""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            def discard():
+                out.seek(0)
+                out.truncate()
+
+            def lent():
+                return circulation.stats()["borrowed"]
+
+            timed("borrow_book", [lambda u=u, b=b: test3.borrow_book(u, str(b), "id") for u, b, _ in borrowed],
+                  results, lent)
+            discard()
+            timed("borrow_book_by_title", [lambda u=u, t=t: test3.borrow_book(u, t, "title") for u, _, t in by_title],
+                  results, lent)
+            discard()
+            timed("return_book", [lambda u=u, b=b: test3.return_book(u, str(b), "id") for u, b in returned],
+                  results, lambda: circulation.stats()["returned"])
+            discard()
+            timed("display_books", [lambda: (test3.display_books(), discard()) for _ in range(display_runs)], results)
+            timed("delete_book", [lambda b=b: test3.delete_book(str(b), "id") for b in deleted], results,
+                  deleted_so_far)
+            discard()
+    finally:
+        builtins.input = real_input
+        library_store.close()
+
+    return {
+        "commit": _commit(),
+        "size": size,
+        "seed": seed,
+        "ops": ops,
+        "rows": dict(zip(("books", "users", "ledger_rows"), synthetic_data.scale(size))),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "operations": results,
+        "circulation": circulation.stats(),
+        "sessions": session_cache.sessions.stats(),
+        "catalogue_cache": catalog_cache.catalogue.stats(),
+        "writes": write_queue.stats(),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the library operations on synthetic data.")
+    parser.add_argument("--size", default="10k", help="10k, 1m, 10m or a ledger row count")
+    parser.add_argument("--ops", type=int, default=1000, help="borrows (and returns) to time")
+    parser.add_argument("--display-runs", type=int, default=3, help="full catalogue listings to time")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run(args.size, args.ops, args.display_runs, args.seed)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import re
+
+import library_store
+
+TOP_K = 5
+MIN_FUZZY_LENGTH = 4  # shorter words are only matched by prefix
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def _words(text):
+    return [word.lower() for word in _WORD.findall(text or "")]
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def edit_distance(a, b, limit):
+    """Damerau-Levenshtein distance between a and b, or limit + 1 once it is exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _term_query(word):
+    """Builds the FTS5 expression for one query word: a prefix match, or its near spellings."""
+    if library_store.execute("search_vocab_prefix", (word, word + "\uffff")).fetchone():
+        return _quote(word) + "*"
+    if len(word) < MIN_FUZZY_LENGTH:
+        return None
+    # Only look at indexed words sharing the first letter and of similar length
+    limit = 1 if len(word) <= 6 else 2
+    cursor = library_store.execute("search_vocab_near",
+                                   (word[0], word[0] + "\uffff", len(word) - limit, len(word) + limit))
+    near = [term for (term,) in cursor if edit_distance(word, term, limit) <= limit]
+    if not near:
+        return None
+    return "(" + " OR ".join(_quote(term) for term in near) + ")"
+
+
+def build_query(text):
+    """Turns free text into an FTS5 MATCH expression, or None when nothing can match."""
+    parts = []
+    for word in _words(text):
+        part = _term_query(word)
+        if part is None:
+            return None
+        parts.append(part)
+    return " AND ".join(parts) or None
+
+
+def search_books(text, limit=TOP_K):
+    """Returns up to `limit` book rows ranked by relevance to text.
+
+    Words match by prefix ("harr pot") and, when a word is not in the index at
+    all, by spellings within one or two edits ("hary pottr"). Title matches rank
+    above author matches, which rank above category and publisher.
+    """
+    query = build_query(text)
+    if query is None:
+        return []
+    return library_store.execute("search_books", (query, limit)).fetchall()
+
+
+def rebuild_index():
+    """Rebuilds the search index from the book table."""
+    conn = library_store.connection()
+    conn.execute("INSERT INTO book_fts (book_fts) VALUES ('rebuild')")
+    conn.commit()
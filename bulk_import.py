@@ -0,0 +1,131 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+import library_store
+
+BATCH_SIZE = 10000  # rows per executemany call
+FIELDS = ("title", "author", "price", "available_copies", "category", "publisher")
+BOOK_INDEXES = ("idx_title", "idx_category", "idx_publisher")
+SEARCH_TRIGGERS = ("book_fts_insert", "book_fts_delete", "book_fts_update")
+
+
+def read_csv(path):
+    """Yields one dict per CSV row; the header names the columns."""
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def read_jsonl(path):
+    """Yields one dict per non-blank JSON Lines row."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_rows(path, fmt=None):
+    """Picks the reader from fmt, or from the file extension when fmt is None."""
+    fmt = fmt or ("jsonl" if os.path.splitext(path)[1].lower() in (".jsonl", ".json", ".ndjson") else "csv")
+    return read_jsonl(path) if fmt == "jsonl" else read_csv(path)
+
+
+def validated(rows, rejects):
+    """Yields book tuples that pass validate_book; appends (row number, reason) to rejects otherwise."""
+    for number, row in enumerate(rows, 1):
+        try:
+            yield library_store.validate_book(*(row.get(field) for field in FIELDS))
+        except (ValueError, TypeError) as e:
+            rejects.append((number, str(e)))
+
+
+def chunked(rows, size):
+    """Groups an iterable into lists of at most size items."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _drop(conn, kind, names):
+    """Drops the named indexes or triggers that exist and returns their CREATE statements."""
+    saved = []
+    for name in names:
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = ? AND name = ?", (kind, name)).fetchone()
+        if row:
+            saved.append(row[0])
+            conn.execute(f"DROP {kind.upper()} {name}")
+    return saved
+
+
+def import_books(path, fmt=None, batch_size=BATCH_SIZE, rebuild_indexes=False):
+    """Streams a CSV or JSONL file into the book table in one transaction.
+
+    With rebuild_indexes the book indexes and search triggers are dropped for
+    the load and recreated afterwards, which is much faster for large files.
+    Returns a summary with inserted/rejected counts and rows per second.
+    """
+    conn = library_store.connection()
+    rejects = []
+    inserted = 0
+    started = time.perf_counter()
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        saved_indexes = saved_triggers = []
+        if rebuild_indexes:
+            saved_indexes = _drop(conn, "index", BOOK_INDEXES)
+            saved_triggers = _drop(conn, "trigger", SEARCH_TRIGGERS)
+
+        for chunk in chunked(validated(read_rows(path, fmt), rejects), batch_size):
+            conn.executemany(library_store.QUERIES["add_book"], chunk)
+            inserted += len(chunk)
+
+        for sql in saved_indexes + saved_triggers:
+            conn.execute(sql)
+        if saved_triggers:
+            # The triggers were off during the load, so re-read the catalogue into the search index
+            conn.execute("INSERT INTO book_fts (book_fts) VALUES ('rebuild')")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+    elapsed = time.perf_counter() - started
+    return {
+        "inserted": inserted,
+        "rejected": len(rejects),
+        "rejects": rejects,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(inserted / elapsed) if elapsed else inserted,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import books from CSV or JSON Lines.")
+    parser.add_argument("path", help="file with title, author, price, available_copies, category, publisher")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="defaults to the file extension")
+    parser.add_argument("--db", default=library_store.DB_PATH, help="database file")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per executemany call")
+    parser.add_argument("--rebuild-indexes", action="store_true",
+                        help="drop the book indexes during the load and rebuild them afterwards")
+    args = parser.parse_args()
+
+    library_store.configure(args.db)
+    result = import_books(args.path, args.format, args.batch_size, args.rebuild_indexes)
+    print(f"Imported {result['inserted']} books in {result['seconds']}s "
+          f"({result['rows_per_second']} rows/second), rejected {result['rejected']}.")
+    for number, reason in result["rejects"][:20]:
+        print(f"  row {number}: {reason}")
+    if result["rejected"] > 20:
+        print(f"  ... and {result['rejected'] - 20} more")
+
+
+if __name__ == "__main__":
+    main()
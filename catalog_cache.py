@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict
+
+import library_store
+
+MAX_ENTRIES = 4096
+MAX_ROWS = 50_000  # rows held across all entries; a bigger result is never cached
+TTL = 60  # seconds; a backstop for changes made elsewhere that data_version could not tell apart
+
+# Catalogue reads that are served from the cache. Every one returns book rows
+# with the book id first, which is what entries are tagged with.
+CACHED = {
+    "borrow_lookup", "return_lookup", "delete_lookup",
+    "borrow_by_id", "borrow_by_title", "borrow_by_category", "borrow_by_publisher",
+    "book_by_id", "book_by_title", "book_by_category", "book_by_publisher",
+    "books_page_after", "books_page_before",
+}
+# Writes that add or remove books, and so can change any lookup or page
+CATALOGUE_WRITES = {"add_book", "delete_book", "delete_book_by_id_or_title"}
+
+
+class Rows:
+    """Cached rows with the cursor methods the front ends use."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __iter__(self):
+        return self._rows
+
+
+class CatalogCache:
+    """Results of catalogue reads keyed by query and parameters, with LRU eviction by entries and rows.
+
+    Each entry is tagged with the books it returned. A borrow or return drops
+    only the entries holding that book; adding or deleting a book drops them
+    all, since it can change any lookup. Changes committed by other
+    connections are caught with PRAGMA data_version: when it moves without
+    this process having recorded a write in between, the change came from
+    elsewhere and the cache is cleared.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_rows=MAX_ROWS, ttl=TTL):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (name, params) -> (rows, book ids, expires)
+        self._by_book = {}  # book id -> keys of the entries holding it
+        self._rows = 0
+        self._writes = 0  # writes this process has invalidated for
+        self._seen = {}  # connection id -> (data_version, writes) at its last check
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.external = 0
+
+    def _drop(self, key):
+        rows, book_ids, _ = self._entries.pop(key)
+        self._rows -= len(rows)
+        for book_id in book_ids:
+            keys = self._by_book.get(book_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_book[book_id]
+
+    def _clear(self):
+        self._entries.clear()
+        self._by_book.clear()
+        self._rows = 0
+
+    def _check_version(self, conn):
+        (version,) = conn.execute("PRAGMA data_version").fetchone()
+        last = self._seen.get(id(conn))
+        if last is not None and last[0] != version and last[1] == self._writes:
+            self._clear()
+            self.external += 1
+        self._seen[id(conn)] = (version, self._writes)
+
+    def execute(self, name, params=()):
+        """Runs a catalogue read, from the cache when possible, and returns its rows."""
+        if name not in CACHED:
+            return library_store.execute(name, params)
+        key = (name, tuple(params))
+        conn = library_store.connection()
+        with self._lock:
+            self._check_version(conn)
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return Rows(entry[0])
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            writes = self._writes
+
+        rows = conn.execute(library_store.QUERIES[name], params).fetchall()
+        with self._lock:
+            # A write recorded while the query ran may not be in these rows
+            if writes == self._writes and len(rows) <= self.max_rows and key not in self._entries:
+                book_ids = {row[0] for row in rows}
+                self._entries[key] = (rows, book_ids, time.monotonic() + self.ttl)
+                self._rows += len(rows)
+                for book_id in book_ids:
+                    self._by_book.setdefault(book_id, set()).add(key)
+                while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                    self._drop(next(iter(self._entries)))
+                    self.evictions += 1
+        return Rows(rows)
+
+    def book_changed(self, book_id):
+        """Drops the entries holding a book whose row has just changed."""
+        with self._lock:
+            self._writes += 1
+            for key in list(self._by_book.get(book_id, ())):
+                self._drop(key)
+                self.invalidations += 1
+
+    def catalogue_changed(self):
+        """Drops every entry, after books were added or deleted."""
+        with self._lock:
+            self._writes += 1
+            self.invalidations += len(self._entries)
+            self._clear()
+
+    def stats(self):
+        """Returns hit/miss/eviction counters and the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "rows": self._rows,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "miss_ratio": round(self.misses / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "external_changes": self.external,
+            }
+
+
+catalogue = CatalogCache()
+
+
+def execute(name, params=()):
+    """Runs a named catalogue read through the process-wide cache."""
+    return catalogue.execute(name, params)
@@ -0,0 +1,162 @@
+import tkinter as tk
+from collections import deque
+from tkinter import ttk
+
+import catalog_cache
+
+COLUMNS = ("ID", "Title", "Author", "Price", "Available Copies", "Category", "Publisher")
+PAGE_SIZE = 100  # rows fetched per keyset query
+WINDOW_SIZE = 500  # rows kept in the Treeview at once
+EDGE = 0.1  # fetch another page when the view is this close to either end
+
+
+def fetch_after(last_id, limit):
+    """Returns the next `limit` books with an id greater than last_id."""
+    return catalog_cache.execute("books_page_after", (last_id, limit)).fetchall()
+
+
+def fetch_before(first_id, limit):
+    """Returns the `limit` books just before first_id, in ascending id order."""
+    rows = catalog_cache.execute("books_page_before", (first_id, limit)).fetchall()
+    rows.reverse()
+    return rows
+
+
+class KeysetPager:
+    """Keeps a sliding window of book rows, paging by id in either direction."""
+
+    def __init__(self, page_size=PAGE_SIZE, window_size=WINDOW_SIZE,
+                 fetch_after=fetch_after, fetch_before=fetch_before):
+        self.page_size = page_size
+        self.window_size = max(window_size, 2 * page_size)
+        self._fetch_after = fetch_after
+        self._fetch_before = fetch_before
+        self.rows = deque()
+        self.at_start = True
+        self.at_end = False
+
+    def reset(self):
+        """Drops the window and loads the first page."""
+        self.rows.clear()
+        self.at_start = True
+        self.at_end = False
+        return self.next_page()
+
+    def next_page(self):
+        """Appends the next page. Returns (added rows, ids evicted from the top)."""
+        if self.at_end:
+            return [], []
+        last_id = self.rows[-1][0] if self.rows else 0
+        added = self._fetch_after(last_id, self.page_size)
+        if len(added) < self.page_size:
+            self.at_end = True
+        self.rows.extend(added)
+        evicted = []
+        while len(self.rows) > self.window_size:
+            evicted.append(self.rows.popleft()[0])
+            self.at_start = False
+        return added, evicted
+
+    def prev_page(self):
+        """Prepends the previous page. Returns (added rows, ids evicted from the bottom)."""
+        if self.at_start or not self.rows:
+            return [], []
+        added = self._fetch_before(self.rows[0][0], self.page_size)
+        if len(added) < self.page_size:
+            self.at_start = True
+        self.rows.extendleft(reversed(added))
+        evicted = []
+        while len(self.rows) > self.window_size:
+            evicted.append(self.rows.pop()[0])
+            self.at_end = False
+        return added, evicted
+
+
+class CatalogView(tk.Frame):
+    """A book Treeview that only ever holds a window of rows, paged in as the user scrolls.
+
+    When a TaskRunner is given, pages are fetched on its worker threads and
+    applied to the tree on the Tk thread.
+    """
+
+    def __init__(self, master, page_size=PAGE_SIZE, window_size=WINDOW_SIZE, tasks=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.pager = KeysetPager(page_size, window_size)
+        self.tasks = tasks
+        self._loading = False
+
+        self.tree = ttk.Treeview(self, columns=COLUMNS, show="headings")
+        for column in COLUMNS:
+            self.tree.heading(column, text=column)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_scroll)
+
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+
+        self.refresh()
+
+    def refresh(self):
+        """Reloads the view from the first book."""
+        self.tree.delete(*self.tree.get_children())
+        self._loading = True
+        self._load(self.pager.reset, self._apply_next)
+
+    def _load(self, fetch, apply):
+        if self.tasks is None:
+            try:
+                page = fetch()
+            except Exception:
+                self._loading = False
+                raise
+            apply(page)
+            return
+
+        def applied(page):
+            # The window may have been closed while the page was loading
+            if self.winfo_exists():
+                apply(page)
+
+        def failed(error):
+            self._loading = False
+            self.tasks.report_error(error)
+
+        self.tasks.submit("display", fetch, on_done=applied, on_error=failed)
+
+    def _append(self, rows):
+        for row in rows:
+            self.tree.insert("", "end", iid=str(row[0]), values=row)
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self._loading:
+            return
+        if float(last) > 1 - EDGE and not self.pager.at_end:
+            self._loading = True
+            self.after_idle(self._load, self.pager.next_page, self._apply_next)
+        elif float(first) < EDGE and not self.pager.at_start:
+            self._loading = True
+            self.after_idle(self._load, self.pager.prev_page, self._apply_prev)
+
+    def _apply_next(self, page):
+        try:
+            added, evicted = page
+            self._append(added)
+            if evicted:
+                self.tree.delete(*map(str, evicted))
+                # Keep the rows under the cursor still after dropping rows above them
+                self.tree.yview_scroll(-len(evicted), "units")
+        finally:
+            self._loading = False
+
+    def _apply_prev(self, page):
+        try:
+            added, evicted = page
+            for index, row in enumerate(added):
+                self.tree.insert("", index, iid=str(row[0]), values=row)
+            if evicted:
+                self.tree.delete(*map(str, evicted))
+            if added:
+                self.tree.yview_scroll(len(added), "units")
+        finally:
+            self._loading = False
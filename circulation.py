@@ -0,0 +1,373 @@
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import catalog_cache
+import due_dates
+import holds
+import inventory
+import session_cache
+
+# Retry policy for "database is locked" / "database is busy"
+MAX_RETRIES = 8
+BASE_DELAY = 0.005  # seconds
+MAX_DELAY = 0.25  # seconds
+
+_stats_lock = threading.Lock()
+_stats = {
+    "borrowed": 0,   # loans taken out
+    "returned": 0,   # loans closed
+    "rejected": 0,   # guarded statement refused (no copy left / not on loan)
+    "conflicts": 0,  # times the write lock was held by someone else
+    "retries": 0,    # transactions re-run after a conflict
+    "failed": 0,     # transactions abandoned after MAX_RETRIES
+}
+
+
+class DatabaseBusyError(Exception):
+    """Raised when the write lock could not be taken after MAX_RETRIES attempts."""
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def stats():
+    """Returns a snapshot of the circulation counters."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    """Resets all circulation counters to zero."""
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def run_immediate(conn, work):
+    """Runs work(cursor) inside BEGIN IMMEDIATE, retrying with back-off while the database is locked."""
+    for attempt in range(MAX_RETRIES + 1):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            result = work(cursor)
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if not _is_busy(e):
+                raise
+            _count("conflicts")
+            if attempt == MAX_RETRIES:
+                _count("failed")
+                raise DatabaseBusyError("Database is busy, please try again.") from e
+            _count("retries")
+            delay = min(MAX_DELAY, BASE_DELAY * (2 ** attempt))
+            time.sleep(random.uniform(delay / 2, delay))
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def run_command(conn, command):
+    """Runs a (work, after) command in a transaction of its own and returns its result."""
+    work, after = command
+    result = run_immediate(conn, work)
+    after(result)
+    return result
+
+
+def _check_loan_limit(cursor, user_id, copies):
+    """Raises LoanLimitReached if the user cannot take out `copies` more copies.
+
+    Counted from open_loans under the write lock, so two desks lending to the
+    same user at once cannot both pass it.
+    """
+    if session_cache.LOAN_LIMIT is None:
+        return
+    cursor.execute("SELECT IFNULL(SUM(copies), 0) FROM open_loans WHERE user_id = ?", (user_id,))
+    (held,) = cursor.fetchone()
+    if held + copies > session_cache.LOAN_LIMIT:
+        raise session_cache.LoanLimitReached(
+            f"You already have {held} books on loan (limit {session_cache.LOAN_LIMIT}).")
+
+
+def borrow_command(user_id, book_id):
+    """Lending one copy of a book, as a (work, after) command.
+
+    work(cursor) runs inside a write transaction and returns False if no copy
+    is left, or raises LoanLimitReached; after(result) does the bookkeeping
+    once that transaction has committed. borrow_book runs it alone,
+    write_queue commits it with others.
+    """
+    due = []
+    claimed = {}
+    taken = []
+
+    def work(cursor):
+        due.clear()  # a retried transaction starts over
+        taken.clear()
+        _check_loan_limit(cursor, user_id, 1)
+        # A copy kept for the user's hold is already off the shelf
+        ready = holds.ready_holds(cursor, user_id, [book_id])
+        if not ready:
+            # Check and decrement in one statement so two desks can never take the last copy
+            cursor.execute("UPDATE book SET available_copies = available_copies - 1 "
+                           "WHERE id = ? AND available_copies > 0 AND deleted_at IS NULL", (book_id,))
+            if cursor.rowcount == 0:
+                return False
+        claimed.clear()
+        claimed.update(holds.claim(cursor, user_id, [book_id]))
+        if ready:
+            inventory.take_held_copy(cursor, book_id, user_id)
+        else:
+            taken.append(inventory.take_copy(cursor, book_id, user_id))
+        cursor.execute("INSERT INTO borrowed_books (user_id, book_id, borrow_return, date_time) VALUES (?, ?, ?, ?)",
+                       (user_id, book_id, 'B', _now()))
+        cursor.execute("INSERT INTO open_loans (user_id, book_id, copies) VALUES (?, ?, 1) "
+                       "ON CONFLICT (user_id, book_id) DO UPDATE SET copies = copies + 1", (user_id, book_id))
+        due.append(due_dates.open_loan(cursor, user_id, book_id))
+        return True
+
+    def after(done):
+        _count("borrowed" if done else "rejected")
+        if done:
+            session_cache.sessions.loan_changed(user_id, book_id, 1)
+            catalog_cache.catalogue.book_changed(book_id)
+            due_dates.reminders.add(*due[0])
+            for ticket, _ in claimed.values():
+                holds.queues.removed(book_id, ticket)
+            for slot in taken:
+                if slot is not None:
+                    inventory.availability.taken(book_id, slot)
+
+    return work, after
+
+
+def borrow_book(conn, user_id, book_id):
+    """Lends one copy of a book to a user. Returns False if no copy is left."""
+    return run_command(conn, borrow_command(user_id, book_id))
+
+
+def return_command(user_id, book_id):
+    """Taking back one copy of a book, as a (work, after) command; work returns False if it is not on loan."""
+    closed = []
+    served = []
+    shelved = []
+
+    def work(cursor):
+        closed.clear()
+        served.clear()
+        shelved.clear()
+        # Close one copy of the loan; the row goes away with the last copy
+        cursor.execute("DELETE FROM open_loans WHERE user_id = ? AND book_id = ? AND copies = 1", (user_id, book_id))
+        if cursor.rowcount == 0:
+            cursor.execute("UPDATE open_loans SET copies = copies - 1 WHERE user_id = ? AND book_id = ? AND copies > 1",
+                           (user_id, book_id))
+            if cursor.rowcount == 0:
+                return False
+        # The copy goes to the first hold in the queue, and only to the shelf if there is none
+        served.extend(holds.assign_copies(cursor, book_id, 1))
+        if served:
+            inventory.return_copy(cursor, book_id, user_id, holder=served[0][0])
+        else:
+            cursor.execute("UPDATE book SET available_copies = available_copies + 1 WHERE id = ?", (book_id,))
+            shelved.append(inventory.return_copy(cursor, book_id, user_id))
+        cursor.execute("INSERT INTO borrowed_books (user_id, book_id, borrow_return, date_time) VALUES (?, ?, ?, ?)",
+                       (user_id, book_id, 'R', _now()))
+        closed.append(due_dates.close_loan(cursor, user_id, book_id))
+        return True
+
+    def after(done):
+        _count("returned" if done else "rejected")
+        if done:
+            session_cache.sessions.loan_changed(user_id, book_id, -1)
+            catalog_cache.catalogue.book_changed(book_id)
+            due_dates.reminders.cancel(closed[0])
+            holds.served(book_id, served)
+            for slot in shelved:
+                if slot is not None:
+                    inventory.availability.shelved(book_id, slot)
+
+    return work, after
+
+
+def return_book(conn, user_id, book_id):
+    """Takes back one copy of a book from a user. Returns False if the user does not hold it."""
+    return run_command(conn, return_command(user_id, book_id))
+
+
+def lookup_books(conn, identifiers):
+    """Resolves book ids or exact titles with one query. Returns {identifier: (id, title)} for those found."""
+    marks = ",".join("?" * len(identifiers))
+    # Two probes rather than one OR, so each side is answered from its own index
+    rows = conn.execute(f"SELECT id, title FROM book WHERE id IN ({marks}) AND deleted_at IS NULL "
+                        f"UNION ALL SELECT id, title FROM book WHERE title IN ({marks}) AND deleted_at IS NULL",
+                        list(identifiers) * 2).fetchall()
+    by_id = {str(book_id): (book_id, title) for book_id, title in rows}
+    by_title = {}
+    for book_id, title in rows:
+        by_title.setdefault(title, (book_id, title))
+    found = {}
+    for identifier in identifiers:
+        book = by_id.get(str(identifier).strip()) or by_title.get(identifier)
+        if book:
+            found[identifier] = book
+    return found
+
+
+def borrow_books_command(user_id, book_ids):
+    """Lending a basket of books, as a (work, after) command; work returns the ids it could not lend."""
+    wanted = Counter(book_ids)
+    due = []
+    claimed = {}
+    taken = []
+
+    def work(cursor):
+        due.clear()
+        taken.clear()
+        if not wanted:
+            return []
+        _check_loan_limit(cursor, user_id, len(book_ids))
+        marks = ",".join("?" * len(wanted))
+        cursor.execute(f"SELECT id, available_copies FROM book WHERE id IN ({marks}) AND deleted_at IS NULL", list(wanted))
+        available = dict(cursor.fetchall())
+        # One copy of each book with a ready hold is already set aside for the user
+        ready = holds.ready_holds(cursor, user_id, list(wanted))
+        needed = {book_id: count - (book_id in ready) for book_id, count in wanted.items()}
+        refused = [book_id for book_id, count in needed.items() if available.get(book_id, 0) < count]
+        if refused:
+            return refused
+        # The write lock is held from BEGIN IMMEDIATE, so the counts just read cannot change underneath us
+        cursor.executemany("UPDATE book SET available_copies = available_copies - ? WHERE id = ?",
+                           [(count, book_id) for book_id, count in needed.items() if count])
+        claimed.clear()
+        claimed.update(holds.claim(cursor, user_id, list(wanted)))
+        for book_id, count in wanted.items():
+            if book_id in ready:
+                inventory.take_held_copy(cursor, book_id, user_id)
+            taken.extend((book_id, inventory.take_copy(cursor, book_id, user_id)) for _ in range(needed[book_id]))
+        now = _now()
+        cursor.executemany("INSERT INTO borrowed_books (user_id, book_id, borrow_return, date_time) VALUES (?, ?, ?, ?)",
+                           [(user_id, book_id, 'B', now) for book_id in book_ids])
+        cursor.executemany("INSERT INTO open_loans (user_id, book_id, copies) VALUES (?, ?, ?) "
+                           "ON CONFLICT (user_id, book_id) DO UPDATE SET copies = copies + excluded.copies",
+                           [(user_id, book_id, count) for book_id, count in wanted.items()])
+        due.extend(due_dates.open_loan(cursor, user_id, book_id) for book_id in book_ids)
+        return []
+
+    def after(refused):
+        if refused:
+            _count("rejected", len(refused))
+        else:
+            _count("borrowed", len(book_ids))
+            for book_id, count in wanted.items():
+                session_cache.sessions.loan_changed(user_id, book_id, count)
+                catalog_cache.catalogue.book_changed(book_id)
+            for loan in due:
+                due_dates.reminders.add(*loan)
+            for book_id, (ticket, _) in claimed.items():
+                holds.queues.removed(book_id, ticket)
+            for book_id, slot in taken:
+                if slot is not None:
+                    inventory.availability.taken(book_id, slot)
+
+    return work, after
+
+
+def borrow_books(conn, user_id, book_ids):
+    """Lends one copy of each book in a basket in a single transaction.
+
+    A book may appear more than once to take several copies. Returns the ids
+    that could not be lent; if any are returned, nothing was lent at all.
+    """
+    return run_command(conn, borrow_books_command(user_id, book_ids))
+
+
+def return_books_command(user_id, book_ids):
+    """Taking back a basket of books, as a (work, after) command; work returns the ids not on loan."""
+    wanted = Counter(book_ids)
+    closed = []
+    served = {}
+    shelved = []
+
+    def work(cursor):
+        closed.clear()
+        served.clear()
+        shelved.clear()
+        if not wanted:
+            return []
+        marks = ",".join("?" * len(wanted))
+        cursor.execute(f"SELECT book_id, copies FROM open_loans WHERE user_id = ? AND book_id IN ({marks})",
+                       [user_id, *wanted])
+        held = dict(cursor.fetchall())
+        refused = [book_id for book_id, count in wanted.items() if held.get(book_id, 0) < count]
+        if refused:
+            return refused
+        cursor.executemany("DELETE FROM open_loans WHERE user_id = ? AND book_id = ?",
+                           [(user_id, book_id) for book_id, count in wanted.items() if held[book_id] == count])
+        cursor.executemany("UPDATE open_loans SET copies = copies - ? WHERE user_id = ? AND book_id = ?",
+                           [(count, user_id, book_id) for book_id, count in wanted.items() if held[book_id] > count])
+        # Returned copies go to the books' hold queues first and the shelf gets the rest
+        for book_id, count in wanted.items():
+            served[book_id] = holds.assign_copies(cursor, book_id, count)
+        cursor.executemany("UPDATE book SET available_copies = available_copies + ? WHERE id = ?",
+                           [(count - len(served[book_id]), book_id) for book_id, count in wanted.items()
+                            if count > len(served[book_id])])
+        for book_id, count in wanted.items():
+            holders = [user for user, _, _ in served[book_id]]
+            for copy in range(count):
+                holder = holders[copy] if copy < len(holders) else None
+                slot = inventory.return_copy(cursor, book_id, user_id, holder)
+                if holder is None:
+                    shelved.append((book_id, slot))
+        now = _now()
+        cursor.executemany("INSERT INTO borrowed_books (user_id, book_id, borrow_return, date_time) VALUES (?, ?, ?, ?)",
+                           [(user_id, book_id, 'R', now) for book_id in book_ids])
+        closed.extend(due_dates.close_loan(cursor, user_id, book_id) for book_id in book_ids)
+        return []
+
+    def after(refused):
+        if refused:
+            _count("rejected", len(refused))
+        else:
+            _count("returned", len(book_ids))
+            for book_id, count in wanted.items():
+                session_cache.sessions.loan_changed(user_id, book_id, -count)
+                catalog_cache.catalogue.book_changed(book_id)
+            for loan_id in closed:
+                due_dates.reminders.cancel(loan_id)
+            for book_id, assigned in served.items():
+                holds.served(book_id, assigned)
+            for book_id, slot in shelved:
+                if slot is not None:
+                    inventory.availability.shelved(book_id, slot)
+
+    return work, after
+
+
+def return_books(conn, user_id, book_ids):
+    """Takes back one copy of each book in a basket in a single transaction.
+
+    Returns the ids the user does not hold (enough copies of); if any are
+    returned, nothing was taken back at all.
+    """
+    return run_command(conn, return_books_command(user_id, book_ids))
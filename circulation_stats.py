@@ -0,0 +1,127 @@
+import argparse
+from datetime import date, datetime, timedelta
+
+import library_store
+import migrations
+
+TOP_K = 10
+ROLLING_DAYS = 7
+
+
+def most_borrowed(limit=TOP_K):
+    """Returns (book id, title, author, borrow count) for the most borrowed books."""
+    return library_store.execute("most_borrowed", (limit,)).fetchall()
+
+
+def category_demand(limit=TOP_K):
+    """Returns (category, borrow count) for the most borrowed categories."""
+    return library_store.execute("category_demand", (limit,)).fetchall()
+
+
+def publisher_demand(limit=TOP_K):
+    """Returns (publisher, borrow count) for the most borrowed publishers."""
+    return library_store.execute("publisher_demand", (limit,)).fetchall()
+
+
+def user_history(user_id, limit=TOP_K):
+    """Returns (book id, 'B' or 'R', date and time) for a user's latest ledger entries."""
+    return library_store.execute("user_history", (user_id, limit)).fetchall()
+
+
+def book_history(book_id, limit=TOP_K):
+    """Returns (user id, 'B' or 'R', date and time) for a book's latest ledger entries."""
+    return library_store.execute("book_history", (book_id, limit)).fetchall()
+
+
+def recent_activity(days=ROLLING_DAYS, limit=TOP_K, now=None):
+    """Returns (user id, book id, 'B' or 'R', date and time) for the latest ledger entries of the last `days` days.
+
+    Every entry after the archive horizon is still in the hot ledger, so a
+    window that starts after it reads only that; a longer one reads the
+    archive as well.
+    """
+    since = ((now or datetime.now()) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    (horizon,) = library_store.execute("ledger_horizon").fetchone()
+    name = "recent_activity" if horizon is None or since >= horizon else "ledger_since"
+    return library_store.execute(name, (since, limit)).fetchall()
+
+
+def daily_totals(days=30, window=ROLLING_DAYS, today=None):
+    """Returns (day, borrows, returns, rolling borrows) for the last `days` days.
+
+    The rolling column is the sum of borrows over the `window` days ending on
+    that day. Days without any activity are included with zero counts.
+    """
+    today = today or date.today()
+    first = today - timedelta(days=days + window - 2)
+    counts = {day: (borrows, returns) for day, borrows, returns in
+              library_store.execute("daily_circulation", (first.isoformat(),))}
+
+    totals = []
+    recent = []
+    for offset in range(days + window - 1):
+        day = (first + timedelta(days=offset)).isoformat()
+        borrows, returns = counts.get(day, (0, 0))
+        recent.append(borrows)
+        if len(recent) > window:
+            recent.pop(0)
+        if offset >= window - 1:
+            totals.append((day, borrows, returns, sum(recent)))
+    return totals
+
+
+def rebuild():
+    """Recomputes every counter from the whole ledger, hot and archived."""
+    conn = library_store.connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in migrations.LEDGER_STATS_REBUILD:
+            conn.execute(statement)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Circulation reports from the precomputed borrow counters.")
+    parser.add_argument("report", choices=("most-borrowed", "category-demand", "publisher-demand", "daily", "history",
+                                           "recent", "rebuild"))
+    parser.add_argument("--db", default=library_store.DB_PATH, help="database file")
+    parser.add_argument("--limit", type=int, default=TOP_K, help="rows to show")
+    parser.add_argument("--days", type=int, default=30, help="days to show in the daily and recent reports")
+    parser.add_argument("--user", type=int, help="user id for the history report")
+    parser.add_argument("--book", type=int, help="book id for the history report")
+    args = parser.parse_args()
+    if args.report == "history" and (args.user is None) == (args.book is None):
+        parser.error("history needs exactly one of --user or --book")
+
+    library_store.configure(args.db)
+    if args.report == "rebuild":
+        rebuild()
+        print("Circulation statistics rebuilt from the ledger.")
+    elif args.report == "most-borrowed":
+        print("| ID | Title                               | Author                 | Borrows |")
+        for book_id, title, author, count in most_borrowed(args.limit):
+            print(f"| {book_id:<2} | {title:<35} | {author:<22} | {count:<7} |")
+    elif args.report == "history":
+        rows = user_history(args.user, args.limit) if args.user is not None else book_history(args.book, args.limit)
+        print(f"| {'Book' if args.user is not None else 'User'} | B/R | Date and time       |")
+        for other_id, borrow_return, date_time in rows:
+            print(f"| {other_id:<4} | {borrow_return:<3} | {date_time:<19} |")
+    elif args.report == "recent":
+        print("| User | Book | B/R | Date and time       |")
+        for user_id, book_id, borrow_return, date_time in recent_activity(args.days, args.limit):
+            print(f"| {user_id:<4} | {book_id:<4} | {borrow_return:<3} | {date_time:<19} |")
+    elif args.report == "daily":
+        print(f"| Day        | Borrows | Returns | Last {ROLLING_DAYS} days |")
+        for day, borrows, returns, rolling in daily_totals(args.days):
+            print(f"| {day} | {borrows:<7} | {returns:<7} | {rolling:<11} |")
+    else:
+        rows = category_demand(args.limit) if args.report == "category-demand" else publisher_demand(args.limit)
+        for name, count in rows:
+            print(f"| {name:<25} | {count:<7} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import base64
+import hashlib
+import hmac
+import os
+
+import library_store
+import write_queue
+
+# Cost settings for new hashes. Raising them only affects hashes written from
+# then on; older ones are upgraded the next time their owner logs in.
+ALGORITHM = "scrypt" if hasattr(hashlib, "scrypt") else "pbkdf2_sha256"
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600_000
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _derive(password, algorithm, params, salt):
+    if algorithm == "scrypt":
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + (1 << 20),
+                              dklen=KEY_BYTES)
+    if algorithm == "pbkdf2_sha256":
+        (iterations,) = params
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations, dklen=KEY_BYTES)
+    raise ValueError(f"Unknown password algorithm: {algorithm}")
+
+
+def _current_params(algorithm):
+    return (SCRYPT_N, SCRYPT_R, SCRYPT_P) if algorithm == "scrypt" else (PBKDF2_ITERATIONS,)
+
+
+def hash_password(password, algorithm=None):
+    """Hashes a password with a random salt.
+
+    The result records the algorithm and its cost parameters, e.g.
+    "scrypt$16384,8,1$<salt>$<hash>", so they can change without breaking
+    existing rows.
+    """
+    algorithm = algorithm or ALGORITHM
+    params = _current_params(algorithm)
+    salt = os.urandom(SALT_BYTES)
+    key = _derive(password, algorithm, params, salt)
+    return "$".join((algorithm, ",".join(map(str, params)), _b64(salt), _b64(key)))
+
+
+def verify_password(password, stored):
+    """Returns (matches, needs_upgrade) for a password against a stored hash.
+
+    Rows written before salted hashing hold a bare SHA-256 hex digest; they
+    still verify, and are reported as needing an upgrade.
+    """
+    if "$" not in stored:
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored), True
+    try:
+        algorithm, params, salt, key = stored.split("$")
+        params = tuple(int(value) for value in params.split(","))
+        matches = hmac.compare_digest(_derive(password, algorithm, params, _unb64(salt)), _unb64(key))
+    except ValueError:
+        return False, False
+    return matches, algorithm != ALGORITHM or params != _current_params(algorithm)
+
+
+def register(username, password):
+    """Creates a user. Raises sqlite3.IntegrityError if the username is taken."""
+    write_queue.execute("register_user", (username, hash_password(password)))
+
+
+def authenticate(username, password):
+    """Returns the user's id if the password is right, otherwise None.
+
+    The user is found by username alone and the password checked here. An
+    outdated hash is replaced with one at the current cost, through the
+    writer and without waiting for its commit.
+    """
+    user = library_store.execute("user_by_name", (username,)).fetchone()
+    if user is None:
+        # Spend the same time as a real check so unknown names can't be told apart
+        verify_password(password, _dummy_hash())
+        return None
+    user_id, stored = user
+    matches, needs_upgrade = verify_password(password, stored)
+    if not matches:
+        return None
+    if needs_upgrade:
+        write_queue.submit_query("update_password", (hash_password(password), user_id))
+    return user_id
+
+
+_dummy = None
+
+
+def _dummy_hash():
+    global _dummy
+    if _dummy is None:
+        _dummy = hash_password("")
+    return _dummy
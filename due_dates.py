@@ -0,0 +1,303 @@
+import argparse
+import heapq
+import threading
+import time
+from datetime import datetime
+
+import library_store
+
+LOAN_DAYS = 14
+FINE_PER_DAY = 5.0  # charged for each day or part of a day a copy is late
+REMINDER_LEAD = 86400  # seconds before the due date that the "due soon" reminder fires
+STAGES = {"due soon": 1, "overdue": 2}  # loan_due.reminded once each reminder has gone out
+DAY = 86400
+TOP_K = 10
+
+
+def days_late(due_at, now):
+    """Whole or part days between due_at and now, or 0 if the copy is not yet due."""
+    return max(0, -(-(now - due_at) // DAY))
+
+
+def fine(due_at, now):
+    return days_late(due_at, now) * FINE_PER_DAY
+
+
+def open_loan(cursor, user_id, book_id, now=None):
+    """Records the due date of a copy just lent, inside the caller's transaction.
+
+    Returns (loan id, user id, book id, due_at) for ReminderScheduler.add once
+    the transaction has committed.
+    """
+    due_at = int(now or time.time()) + LOAN_DAYS * DAY
+    cursor.execute("INSERT INTO loan_due (user_id, book_id, due_at) VALUES (?, ?, ?)", (user_id, book_id, due_at))
+    return cursor.lastrowid, user_id, book_id, due_at
+
+
+def close_loan(cursor, user_id, book_id, now=None):
+    """Closes the earliest-due copy of a loan inside the caller's transaction and charges any fine.
+
+    Returns the loan id for ReminderScheduler.cancel, or None if the loan had
+    no due date.
+    """
+    now = int(now or time.time())
+    cursor.execute("SELECT id, due_at FROM loan_due WHERE user_id = ? AND book_id = ? ORDER BY due_at LIMIT 1",
+                   (user_id, book_id))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    loan_id, due_at = row
+    cursor.execute("DELETE FROM loan_due WHERE id = ?", (loan_id,))
+    charge = fine(due_at, now)
+    if charge:
+        # The last nightly run counted this copy as accruing; move its share over to settled
+        cursor.execute("UPDATE fines SET accruing = MAX(0, accruing - ? * ((computed_at - ? + ?) / ?)) "
+                       "WHERE user_id = ? AND computed_at > ?",
+                       (FINE_PER_DAY, due_at, DAY - 1, DAY, user_id, due_at))
+        cursor.execute("INSERT INTO fines (user_id, settled) VALUES (?, ?) "
+                       "ON CONFLICT (user_id) DO UPDATE SET settled = settled + excluded.settled", (user_id, charge))
+    return loan_id
+
+
+class ReminderScheduler:
+    """The due dates of every copy on loan, held in min-heaps.
+
+    One heap orders the loans by due date, so the k overdue ones can be read
+    off the top in O(k log k) without disturbing it. The other orders the
+    reminders still to send ("due soon" and "overdue"), which are popped as
+    they fire in O(k log n). Returned copies are dropped lazily: their entries
+    stay in the heaps until they surface and are skipped then. The heaps are
+    loaded with one ordered query on first use and kept current by
+    circulation; reload() picks up loans made by other processes. Sent
+    reminders are recorded in loan_due.reminded, so a later load, here or in
+    another process, does not schedule them again.
+    """
+
+    def __init__(self, lead=REMINDER_LEAD):
+        self.lead = lead
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._live = {}  # loan id -> (user id, book id, due_at)
+        self._due = []  # (due_at, loan id)
+        self._reminders = []  # (fire at, loan id, kind)
+        self.sent = 0
+
+    def _load(self):
+        now = int(time.time())
+        self._live.clear()
+        self._due = []
+        self._reminders = []
+        for loan_id, user_id, book_id, due_at, reminded in library_store.execute("loans_due"):
+            self._live[loan_id] = (user_id, book_id, due_at)
+            self._due.append((due_at, loan_id))
+            # A loan already overdue skips straight to its overdue reminder
+            if reminded < STAGES["due soon"] and due_at > now:
+                self._reminders.append((due_at - self.lead, loan_id, "due soon"))
+            if reminded < STAGES["overdue"]:
+                self._reminders.append((due_at, loan_id, "overdue"))
+        # Rows arrive in due order, which is already a heap; this only fixes ties
+        heapq.heapify(self._due)
+        heapq.heapify(self._reminders)
+        self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._load()
+
+    def reload(self):
+        """Re-reads every open loan from the database."""
+        with self._lock:
+            self._load()
+
+    def add(self, loan_id, user_id, book_id, due_at):
+        """Schedules a loan that has just been committed."""
+        with self._lock:
+            if not self._loaded or loan_id in self._live:
+                return  # the first load will read it, or already has
+            self._live[loan_id] = (user_id, book_id, due_at)
+            heapq.heappush(self._due, (due_at, loan_id))
+            heapq.heappush(self._reminders, (due_at - self.lead, loan_id, "due soon"))
+            heapq.heappush(self._reminders, (due_at, loan_id, "overdue"))
+
+    def cancel(self, loan_id):
+        """Forgets a loan whose copy has been returned."""
+        if loan_id is None:
+            return
+        with self._lock:
+            self._live.pop(loan_id, None)
+            # Stale entries are skipped as they surface; rebuild once they are most of the heap
+            if len(self._due) > 64 and len(self._due) > 2 * len(self._live):
+                self._due = [entry for entry in self._due if entry[1] in self._live]
+                heapq.heapify(self._due)
+                self._reminders = [entry for entry in self._reminders if entry[1] in self._live]
+                heapq.heapify(self._reminders)
+
+    def _overdue(self, now, limit):
+        # Walk the heap as a tree from its root, always expanding the earliest
+        # node seen; children are never earlier than their parent, so this
+        # visits the overdue entries in order and stops at the first that is not.
+        heap = self._due
+        found = []
+        frontier = [(heap[0], 0)] if heap else []
+        while frontier and (limit is None or len(found) < limit):
+            (due_at, loan_id), index = heapq.heappop(frontier)
+            if due_at >= now:
+                break
+            if loan_id in self._live:
+                user_id, book_id, _ = self._live[loan_id]
+                found.append((loan_id, user_id, book_id, due_at))
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+        return found
+
+    def overdue(self, now=None, limit=None):
+        """Returns (loan id, user id, book id, due_at, fine) for overdue copies, earliest due first."""
+        now = int(now or time.time())
+        with self._lock:
+            self._ensure_loaded()
+            loans = self._overdue(now, limit)
+        return [(*loan, fine(loan[3], now)) for loan in loans]
+
+    def fine_totals(self, now=None, limit=None):
+        """Returns (user id, overdue copies, accruing fine) per user, largest fine first."""
+        now = int(now or time.time())
+        with self._lock:
+            self._ensure_loaded()
+            loans = self._overdue(now, None)
+        totals = {}
+        for _, user_id, _, due_at in loans:
+            copies, owed = totals.get(user_id, (0, 0.0))
+            totals[user_id] = (copies + 1, owed + fine(due_at, now))
+        ranked = sorted(((user_id, copies, owed) for user_id, (copies, owed) in totals.items()),
+                        key=lambda row: row[2], reverse=True)
+        return ranked if limit is None else ranked[:limit]
+
+    def pop_reminders(self, now=None):
+        """Returns (kind, user id, book id, due_at) for every reminder that has come due, each only once.
+
+        Each is claimed in loan_due.reminded before it is returned; one that
+        another process has already claimed is left out.
+        """
+        now = int(now or time.time())
+        due = []
+        with self._lock:
+            self._ensure_loaded()
+            while self._reminders and self._reminders[0][0] <= now:
+                _, loan_id, kind = heapq.heappop(self._reminders)
+                loan = self._live.get(loan_id)
+                # "Due soon" is moot once the copy is overdue; the overdue reminder goes instead
+                if loan is not None and not (kind == "due soon" and loan[2] <= now):
+                    due.append((loan_id, kind, loan))
+        if not due:
+            return []
+        fired = []
+        conn = library_store.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for loan_id, kind, (user_id, book_id, due_at) in due:
+                claimed = conn.execute("UPDATE loan_due SET reminded = ? WHERE id = ? AND reminded < ?",
+                                       (STAGES[kind], loan_id, STAGES[kind]))
+                if claimed.rowcount:
+                    fired.append((kind, user_id, book_id, due_at))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        with self._lock:
+            self.sent += len(fired)
+        return fired
+
+    def next_reminder(self):
+        """Returns when the next reminder is due (a Unix time), or None if there is none."""
+        with self._lock:
+            self._ensure_loaded()
+            while self._reminders and self._reminders[0][1] not in self._live:
+                heapq.heappop(self._reminders)
+            return self._reminders[0][0] if self._reminders else None
+
+    def stats(self):
+        """Returns the number of open loans, heap entries and reminders sent."""
+        with self._lock:
+            return {
+                "loans": len(self._live),
+                "due_entries": len(self._due),
+                "reminder_entries": len(self._reminders),
+                "sent": self.sent,
+            }
+
+
+reminders = ReminderScheduler()
+
+
+def user_due_dates(user_id):
+    """Returns (book id, due_at) for each copy a user holds, earliest due first."""
+    return library_store.execute("user_due_dates", (user_id,)).fetchall()
+
+
+def user_fine(user_id, now=None):
+    """Returns what a user owes now: fines settled on late returns plus those accruing on overdue copies."""
+    now = int(now or time.time())
+    row = library_store.execute("user_fines", (user_id,)).fetchone()
+    settled = row[0] if row else 0.0
+    return settled + sum(fine(due_at, now) for _, due_at in user_due_dates(user_id))
+
+
+def recompute_fines(now=None):
+    """Recomputes the accruing fine of every member in one streaming pass over the overdue loans.
+
+    The overdue range of the due-date index is grouped by user and fed
+    straight into the upsert, so no list of members is ever built. Returns the
+    number of members with overdue copies.
+    """
+    now = int(now or time.time())
+    conn = library_store.connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("UPDATE fines SET accruing = 0, computed_at = ? WHERE accruing != 0", (now,))
+        overdue = conn.execute("SELECT user_id, SUM((? - due_at + ?) / ?) FROM loan_due WHERE due_at < ? GROUP BY user_id",
+                               (now, DAY - 1, DAY, now))
+        cursor = conn.executemany("INSERT INTO fines (user_id, accruing, computed_at) VALUES (?, ?, ?) "
+                                  "ON CONFLICT (user_id) DO UPDATE SET accruing = excluded.accruing, "
+                                  "computed_at = excluded.computed_at",
+                                  ((user_id, days * FINE_PER_DAY, now) for user_id, days in overdue))
+        members = cursor.rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return members
+
+
+def _when(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overdue loans, fines and due-date reminders.")
+    parser.add_argument("report", choices=("overdue", "fines", "remind", "nightly"))
+    parser.add_argument("--db", default=library_store.DB_PATH, help="database file")
+    parser.add_argument("--limit", type=int, default=TOP_K, help="rows to show")
+    args = parser.parse_args()
+
+    library_store.configure(args.db)
+    if args.report == "nightly":
+        started = time.perf_counter()
+        members = recompute_fines()
+        print(f"Fines recomputed for {members} members with overdue copies in {time.perf_counter() - started:.2f}s.")
+    elif args.report == "overdue":
+        print("| User | Book | Due              | Fine    |")
+        for _, user_id, book_id, due_at, owed in reminders.overdue(limit=args.limit):
+            print(f"| {user_id:<4} | {book_id:<4} | {_when(due_at)} | {owed:<7.2f} |")
+    elif args.report == "fines":
+        print("| User | Overdue | Fine    |")
+        for user_id, copies, owed in reminders.fine_totals(limit=args.limit):
+            print(f"| {user_id:<4} | {copies:<7} | {owed:<7.2f} |")
+    else:
+        for kind, user_id, book_id, due_at in reminders.pop_reminders():
+            print(f"User {user_id}: book {book_id} {kind}, due {_when(due_at)}")
+    library_store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import argparse
+import csv
+import json
+import os
+
+import library_store
+
+TABLES = ("book", "borrowed_books")
+# The ledger is exported whole, hot and archived, through the view that joins the two files
+SOURCES = {"book": "book", "borrowed_books": "ledger"}
+FORMATS = ("csv", "jsonl", "columnar")
+BATCH_SIZE = 5000  # rows per fetchmany call
+BUFFER_SIZE = 1 << 20  # bytes buffered per output file
+
+
+def _state_path(out):
+    return out + ".last_id"
+
+
+def read_last_id(out):
+    """Returns the last id a previous export of out got to, or 0."""
+    try:
+        with open(_state_path(out)) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def _save_last_id(out, last_id):
+    # Write-then-rename so a crash never leaves a half-written checkpoint
+    tmp = _state_path(out) + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(str(last_id))
+    os.replace(tmp, _state_path(out))
+
+
+def iter_batches(table, after_id=0, batch_size=BATCH_SIZE, include_deleted=False):
+    """Yields (column names, rows) batches of a table in id order, starting after after_id.
+
+    Deleted books are left out unless include_deleted is set. A ledger entry
+    that a roll-over has copied to the archive but not yet removed from the
+    hot ledger is yielded once.
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table: {table}")
+    live = f" AND {library_store.LIVE}" if table == "book" and not include_deleted else ""
+    cursor = library_store.connection().execute(f"SELECT * FROM {SOURCES[table]} WHERE id > ?{live} ORDER BY id",
+                                                (after_id,))
+    columns = [description[0] for description in cursor.description]
+    last_id = after_id
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        # Rows come in id order, so an entry in both files arrives as a repeat of the row before
+        unique = []
+        for row in rows:
+            if row[0] != last_id:
+                unique.append(row)
+                last_id = row[0]
+        if unique:
+            yield columns, unique
+
+
+class CsvWriter:
+    def __init__(self, out, append):
+        self.file = open(out, "a" if append else "w", newline="", encoding="utf-8", buffering=BUFFER_SIZE)
+        self.writer = csv.writer(self.file)
+        self.append = append
+
+    def write(self, columns, rows):
+        if not self.append:
+            self.writer.writerow(columns)
+            self.append = True
+        self.writer.writerows(rows)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlWriter:
+    def __init__(self, out, append):
+        self.file = open(out, "a" if append else "w", encoding="utf-8", buffering=BUFFER_SIZE)
+
+    def write(self, columns, rows):
+        for row in rows:
+            self.file.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+            self.file.write("\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ColumnarWriter:
+    """Writes each column to its own file in a directory, one JSON value per line.
+
+    Readers that only need a few columns (say book_id and date_time from the
+    ledger) open just those files. _columns.json lists the column order.
+    """
+
+    def __init__(self, out, append):
+        self.out = out
+        self.append = append
+        self.files = None
+        os.makedirs(out, exist_ok=True)
+
+    def _open(self, columns):
+        with open(os.path.join(self.out, "_columns.json"), "w") as f:
+            json.dump(columns, f)
+        mode = "a" if self.append else "w"
+        self.files = [open(os.path.join(self.out, f"{column}.jsonl"), mode, encoding="utf-8", buffering=BUFFER_SIZE)
+                      for column in columns]
+
+    def write(self, columns, rows):
+        if self.files is None:
+            self._open(columns)
+        for index, f in enumerate(self.files):
+            f.write("\n".join(json.dumps(row[index], ensure_ascii=False) for row in rows))
+            f.write("\n")
+
+    def flush(self):
+        for f in self.files or ():
+            f.flush()
+
+    def close(self):
+        for f in self.files or ():
+            f.close()
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonlWriter, "columnar": ColumnarWriter}
+
+
+def export_table(table, out, fmt="csv", resume=False, after_id=None, batch_size=BATCH_SIZE, include_deleted=False):
+    """Streams a table to out in constant memory and returns the number of rows written.
+
+    After every batch the last exported id is saved next to the output, so an
+    interrupted export can continue with resume=True instead of starting over.
+    """
+    if after_id is None:
+        after_id = read_last_id(out) if resume else 0
+    writer = WRITERS[fmt](out, append=after_id > 0)
+    written = 0
+    try:
+        for columns, rows in iter_batches(table, after_id, batch_size, include_deleted):
+            writer.write(columns, rows)
+            writer.flush()
+            written += len(rows)
+            _save_last_id(out, rows[-1][0])
+    finally:
+        writer.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the catalogue or the loan ledger.")
+    parser.add_argument("table", choices=TABLES)
+    parser.add_argument("out", help="output file (a directory for --format columnar)")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--db", default=library_store.DB_PATH, help="database file")
+    parser.add_argument("--resume", action="store_true", help="continue from the last id of a previous export")
+    parser.add_argument("--after-id", type=int, help="only export rows with a greater id")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per fetchmany call")
+    parser.add_argument("--include-deleted", action="store_true", help="also export deleted books")
+    args = parser.parse_args()
+
+    library_store.configure(args.db)
+    written = export_table(args.table, args.out, args.format, args.resume, args.after_id, args.batch_size,
+                           args.include_deleted)
+    print(f"Exported {written} rows from {args.table} to {args.out}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import argparse
+import threading
+import time
+from datetime import datetime
+
+import catalog_cache
+import inventory
+import library_store
+
+HOLD_DAYS = 3  # days a copy kept for a hold waits on the shelf before passing to the next in line
+DAY = 86400
+
+
+class _Queue:
+    """One book's waiting holds as a Fenwick tree over their tickets.
+
+    Tickets grow while the queue has holds in it, so a hold's slot is its
+    ticket minus the first one. Adding, removing and counting the holds ahead
+    of a ticket are all O(log n); the arrays double when a ticket falls off
+    the end.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.flags = bytearray(16)
+        self.tree = [0] * 17
+        self.waiting = 0
+
+    def _grow(self, slot):
+        size = len(self.flags)
+        while size <= slot:
+            size *= 2
+        self.flags.extend(bytes(size - len(self.flags)))
+        # Rebuild in O(n) rather than re-adding each hold
+        self.tree = [0] + list(self.flags)
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                self.tree[parent] += self.tree[i]
+
+    def _update(self, slot, delta):
+        i = slot + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def add(self, ticket):
+        if not self.waiting:
+            # Start afresh from this ticket; tickets restart once a queue has emptied
+            self.__init__(ticket)
+        slot = ticket - self.base
+        if slot < 0:
+            return  # older than anything waiting, so it was already served or cancelled
+        if slot >= len(self.flags):
+            self._grow(slot)
+        if not self.flags[slot]:
+            self.flags[slot] = 1
+            self.waiting += 1
+            self._update(slot, 1)
+
+    def remove(self, ticket):
+        slot = ticket - self.base
+        if 0 <= slot < len(self.flags) and self.flags[slot]:
+            self.flags[slot] = 0
+            self.waiting -= 1
+            self._update(slot, -1)
+
+    def ahead(self, ticket):
+        """Number of waiting holds with a lower ticket."""
+        i = min(ticket - self.base, len(self.flags))
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+
+class HoldQueues:
+    """Waiting holds per book, loaded one book at a time on first use and kept current by the hold commands.
+
+    reload() drops them, so holds placed by other processes are picked up on
+    the next lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}  # book id -> _Queue
+
+    def _queue(self, book_id):
+        queue = self._queues.get(book_id)
+        if queue is None:
+            tickets = [ticket for (ticket,) in library_store.execute("holds_waiting", (book_id,))]
+            queue = _Queue(tickets[0] if tickets else 1)
+            for ticket in tickets:
+                queue.add(ticket)
+            self._queues[book_id] = queue
+        return queue
+
+    def added(self, book_id, ticket):
+        with self._lock:
+            if book_id in self._queues:
+                self._queues[book_id].add(ticket)
+
+    def removed(self, book_id, ticket):
+        with self._lock:
+            if book_id in self._queues:
+                self._queues[book_id].remove(ticket)
+
+    def position(self, book_id, ticket):
+        """Returns a waiting hold's place in its book's queue, 1 being next in line."""
+        with self._lock:
+            return self._queue(book_id).ahead(ticket) + 1
+
+    def length(self, book_id):
+        """Returns the number of holds waiting for a book."""
+        with self._lock:
+            return self._queue(book_id).waiting
+
+    def reload(self):
+        with self._lock:
+            self._queues.clear()
+
+
+queues = HoldQueues()
+
+
+def place_hold_command(user_id, book_id):
+    """Joining a book's hold queue, as a (work, after) command.
+
+    work returns the hold's ticket, the existing one if the user is already
+    in the queue, or None if the book does not exist or has a copy on the
+    shelf to borrow instead.
+    """
+    placed = []
+
+    def work(cursor):
+        placed.clear()
+        cursor.execute("SELECT ticket FROM holds WHERE user_id = ? AND book_id = ?", (user_id, book_id))
+        row = cursor.fetchone()
+        if row is not None:
+            return row[0]
+        cursor.execute("SELECT available_copies FROM book WHERE id = ? AND deleted_at IS NULL", (book_id,))
+        row = cursor.fetchone()
+        if row is None or row[0] > 0:
+            return None
+        # The write lock is held, so the next ticket cannot be taken twice
+        cursor.execute("SELECT IFNULL(MAX(ticket), 0) + 1 FROM holds WHERE book_id = ?", (book_id,))
+        (ticket,) = cursor.fetchone()
+        cursor.execute("INSERT INTO holds (book_id, ticket, user_id, placed_at) VALUES (?, ?, ?, ?)",
+                       (book_id, ticket, user_id, int(time.time())))
+        placed.append(ticket)
+        return ticket
+
+    def after(ticket):
+        if placed:
+            queues.added(book_id, placed[0])
+
+    return work, after
+
+
+def assign_copies(cursor, book_id, copies, now=None):
+    """Sets returned copies aside for the first holds in the book's queue, inside the caller's transaction.
+
+    Returns (user id, ticket, ready until) for each hold served, at most
+    `copies` of them; the caller puts the rest back on the shelf. Each user
+    served gets a notice, see take_notices_command.
+    """
+    if copies <= 0:
+        return []
+    ready_until = int(now or time.time()) + HOLD_DAYS * DAY
+    cursor.execute("SELECT ticket, user_id FROM holds WHERE book_id = ? AND ready_until IS NULL "
+                   "ORDER BY ticket LIMIT ?", (book_id, copies))
+    served = cursor.fetchall()
+    cursor.executemany("UPDATE holds SET ready_until = ? WHERE book_id = ? AND ticket = ?",
+                       [(ready_until, book_id, ticket) for ticket, _ in served])
+    cursor.executemany("INSERT INTO hold_notices (user_id, book_id, ready_until) VALUES (?, ?, ?)",
+                       [(user_id, book_id, ready_until) for _, user_id in served])
+    return [(user_id, ticket, ready_until) for ticket, user_id in served]
+
+
+def claim(cursor, user_id, book_ids):
+    """Ends the user's holds on books they are borrowing, inside the caller's transaction.
+
+    Returns {book id: (ticket, was ready)}; a ready hold means a copy was
+    already set aside, so it must not be taken from available_copies again.
+    """
+    marks = ",".join("?" * len(book_ids))
+    cursor.execute(f"SELECT book_id, ticket, ready_until IS NOT NULL FROM holds "
+                   f"WHERE user_id = ? AND book_id IN ({marks})", [user_id, *book_ids])
+    found = {book_id: (ticket, bool(ready)) for book_id, ticket, ready in cursor.fetchall()}
+    cursor.executemany("DELETE FROM holds WHERE book_id = ? AND ticket = ?",
+                       [(book_id, ticket) for book_id, (ticket, _) in found.items()])
+    return found
+
+
+def ready_holds(cursor, user_id, book_ids):
+    """Returns the ids among book_ids for which a copy is set aside for the user."""
+    marks = ",".join("?" * len(book_ids))
+    cursor.execute(f"SELECT book_id FROM holds WHERE user_id = ? AND book_id IN ({marks}) "
+                   f"AND ready_until IS NOT NULL", [user_id, *book_ids])
+    return {book_id for (book_id,) in cursor.fetchall()}
+
+
+def served(book_id, assigned, shelved=None):
+    """Bookkeeping once holds served by assign_copies, or a copy put back on the shelf, have committed."""
+    for _, ticket, _ in assigned:
+        queues.removed(book_id, ticket)
+    if shelved is not None:
+        inventory.availability.shelved(book_id, shelved)
+        catalog_cache.catalogue.book_changed(book_id)
+
+
+def _release(cursor, book_id, ticket, user_id, ready):
+    """Ends a hold; returns the holds served with its copy and the slot put back on the shelf, if any."""
+    cursor.execute("DELETE FROM holds WHERE book_id = ? AND ticket = ?", (book_id, ticket))
+    if not ready:
+        return [], None
+    # The copy kept for this hold goes to the next in line, or back on the shelf
+    assigned = assign_copies(cursor, book_id, 1)
+    if assigned:
+        inventory.pass_held_copy(cursor, book_id, user_id, holder=assigned[0][0])
+        return assigned, None
+    cursor.execute("UPDATE book SET available_copies = available_copies + 1 WHERE id = ?", (book_id,))
+    return [], inventory.pass_held_copy(cursor, book_id, user_id)
+
+
+def cancel_hold_command(user_id, book_id):
+    """Leaving a book's hold queue, as a (work, after) command; work returns False if there was no hold."""
+    cancelled = []
+
+    def work(cursor):
+        cancelled.clear()
+        cursor.execute("SELECT ticket, ready_until IS NOT NULL FROM holds WHERE user_id = ? AND book_id = ?",
+                       (user_id, book_id))
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        ticket, ready = row
+        cancelled.append((ticket, *_release(cursor, book_id, ticket, user_id, ready)))
+        return True
+
+    def after(done):
+        if done:
+            ticket, assigned, shelved = cancelled[0]
+            queues.removed(book_id, ticket)
+            served(book_id, assigned, shelved)
+
+    return work, after
+
+
+def expire_holds(now=None):
+    """Passes on every copy whose hold was not collected in time. Returns the number of holds expired."""
+    now = int(now or time.time())
+    conn = library_store.connection()
+    cursor = conn.cursor()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        expired = cursor.execute("SELECT book_id, ticket, user_id FROM holds WHERE ready_until < ?", (now,)).fetchall()
+        released = [(book_id, *_release(cursor, book_id, ticket, user_id, True)) for book_id, ticket, user_id in expired]
+        cursor.execute("DELETE FROM hold_notices WHERE ready_until < ?", (now,))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    for book_id, assigned, shelved in released:
+        served(book_id, assigned, shelved)
+    return len(expired)
+
+
+def take_notices_command(user_id):
+    """Collecting the user's hold notices, as a (work, after) command.
+
+    work returns (book id, title, ready until) for each copy still kept for
+    the user and removes all of the user's notices, so each is shown once.
+    """
+    def work(cursor):
+        cursor.execute("SELECT hold_notices.book_id, book.title, hold_notices.ready_until FROM hold_notices "
+                       "JOIN holds ON holds.user_id = hold_notices.user_id AND holds.book_id = hold_notices.book_id "
+                       "JOIN book ON book.id = hold_notices.book_id "
+                       "WHERE hold_notices.user_id = ? AND holds.ready_until = hold_notices.ready_until "
+                       "ORDER BY hold_notices.id", (user_id,))
+        found = cursor.fetchall()
+        cursor.execute("DELETE FROM hold_notices WHERE user_id = ?", (user_id,))
+        return found
+
+    return work, None
+
+
+def notice_text(title, ready_until):
+    """The message telling a user a copy is kept for them."""
+    return f"A copy of '{title}' is kept for you until {datetime.fromtimestamp(ready_until):%Y-%m-%d %H:%M}."
+
+
+def position(user_id, book_id):
+    """Returns (place in queue, holds waiting) for the user's hold on a book.
+
+    The place is 0 when a copy is already set aside for the user, and None
+    when they hold nothing on the book.
+    """
+    row = library_store.execute("user_hold", (user_id, book_id)).fetchone()
+    if row is None:
+        return None, queues.length(book_id)
+    ticket, ready_until = row
+    if ready_until is not None:
+        return 0, queues.length(book_id)
+    return queues.position(book_id, ticket), queues.length(book_id)
+
+
+def user_holds(user_id):
+    """Returns (book id, ticket, ready until or None) for each of a user's holds."""
+    return library_store.execute("user_holds", (user_id,)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or expire book holds.")
+    parser.add_argument("action", choices=("list", "expire"))
+    parser.add_argument("--db", default=library_store.DB_PATH, help="database file")
+    parser.add_argument("--user", type=int, help="user id for the list")
+    args = parser.parse_args()
+    if args.action == "list" and args.user is None:
+        parser.error("list needs --user")
+
+    library_store.configure(args.db)
+    if args.action == "expire":
+        print(f"Expired {expire_holds()} uncollected holds.")
+    else:
+        print("| Book | Place | Waiting | Ready until      |")
+        for book_id, ticket, ready_until in user_holds(args.user):
+            place, waiting = position(args.user, book_id)
+            until = datetime.fromtimestamp(ready_until).strftime("%Y-%m-%d %H:%M") if ready_until else ""
+            print(f"| {book_id:<4} | {place:<5} | {waiting:<7} | {until:<16} |")
+    library_store.close()
+
+
+if __name__ == "__main__":
+    main()
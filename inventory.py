@@ -0,0 +1,208 @@
+import argparse
+import threading
+import time
+
+import catalog_cache
+import library_store
+
+
+def _lowest_bit(bits):
+    return (bits & -bits).bit_length() - 1
+
+
+def _popcount(bits):
+    return bin(bits).count("1")
+
+
+class Availability:
+    """Which copies of each book are on the shelf, as one bit per copy slot.
+
+    A book's copies are numbered from 0 and its bitmap is a single integer,
+    so a title with a handful of copies costs a machine word or two and the
+    first free copy is its lowest set bit. The bitmaps are built on first use
+    from one query over the shelf index, read in book order, and kept current
+    by circulation once each transaction commits. Bits can run behind other
+    processes; take_copy checks each pick against the table, and reload()
+    rebuilds them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._free = {}  # book id -> bitmap of slots on the shelf
+
+    def _load(self):
+        free = {}
+        current, bits = None, 0
+        for book_id, slot in library_store.execute("shelf_copies"):
+            if book_id != current:
+                if bits:
+                    free[current] = bits
+                current, bits = book_id, 0
+            bits |= 1 << slot
+        if bits:
+            free[current] = bits
+        self._free = free
+        self._loaded = True
+
+    def _bits(self, book_id):
+        if not self._loaded:
+            self._load()
+        return self._free.get(book_id, 0)
+
+    def reload(self):
+        """Rebuilds every bitmap from the copy table."""
+        with self._lock:
+            self._load()
+
+    def pick(self, book_id):
+        """Returns the slot of a copy on the shelf, or None if the bitmap has none."""
+        with self._lock:
+            bits = self._bits(book_id)
+            return _lowest_bit(bits) if bits else None
+
+    def taken(self, book_id, slot):
+        with self._lock:
+            if self._loaded:
+                bits = self._free.get(book_id, 0) & ~(1 << slot)
+                if bits:
+                    self._free[book_id] = bits
+                else:
+                    self._free.pop(book_id, None)
+
+    def shelved(self, book_id, slot):
+        with self._lock:
+            if self._loaded:
+                self._free[book_id] = self._free.get(book_id, 0) | (1 << slot)
+
+    def on_shelf(self, book_id):
+        """Returns the number of copies of a book on the shelf."""
+        with self._lock:
+            return _popcount(self._bits(book_id))
+
+    def counts(self):
+        """Returns {book id: copies on the shelf} for every book with one."""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            return {book_id: _popcount(bits) for book_id, bits in self._free.items()}
+
+    def stats(self):
+        """Returns the number of books and copies on the shelf."""
+        counts = self.counts()
+        return {"books": len(counts), "copies": sum(counts.values())}
+
+
+availability = Availability()
+
+
+def take_copy(cursor, book_id, user_id):
+    """Marks a copy from the shelf as lent to the user, inside the caller's transaction.
+
+    The bitmap's pick is confirmed by the guarded update; if another process
+    or an earlier command in the same transaction got there first, the shelf
+    index is asked instead. Returns the slot, or None if no copy is on the
+    shelf.
+    """
+    slot = availability.pick(book_id)
+    if slot is not None:
+        cursor.execute("UPDATE copy SET status = 'loan', user_id = ? WHERE book_id = ? AND slot = ? AND status = 'shelf'",
+                       (user_id, book_id, slot))
+        if cursor.rowcount:
+            return slot
+    cursor.execute("SELECT slot FROM copy WHERE book_id = ? AND status = 'shelf' ORDER BY slot LIMIT 1", (book_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute("UPDATE copy SET status = 'loan', user_id = ? WHERE book_id = ? AND slot = ?",
+                   (user_id, book_id, row[0]))
+    return row[0]
+
+
+def _move(cursor, book_id, user_id, status, holder):
+    cursor.execute("SELECT slot FROM copy WHERE user_id = ? AND book_id = ? AND status = ? ORDER BY slot LIMIT 1",
+                   (user_id, book_id, status))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if holder is None:
+        cursor.execute("UPDATE copy SET status = 'shelf', user_id = NULL WHERE book_id = ? AND slot = ?", (book_id, row[0]))
+    else:
+        cursor.execute("UPDATE copy SET status = 'held', user_id = ? WHERE book_id = ? AND slot = ?",
+                       (holder, book_id, row[0]))
+    return row[0]
+
+
+def take_held_copy(cursor, book_id, user_id):
+    """Marks the copy kept for the user's hold as lent to them. Returns its slot, or None."""
+    cursor.execute("SELECT slot FROM copy WHERE user_id = ? AND book_id = ? AND status = 'held' ORDER BY slot LIMIT 1",
+                   (user_id, book_id))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute("UPDATE copy SET status = 'loan' WHERE book_id = ? AND slot = ?", (book_id, row[0]))
+    return row[0]
+
+
+def return_copy(cursor, book_id, user_id, holder=None):
+    """Takes back one of the user's copies, onto the shelf or kept for `holder`. Returns its slot, or None."""
+    return _move(cursor, book_id, user_id, "loan", holder)
+
+
+def pass_held_copy(cursor, book_id, user_id, holder=None):
+    """Moves the copy kept for the user's hold to `holder`, or back to the shelf. Returns its slot, or None."""
+    return _move(cursor, book_id, user_id, "held", holder)
+
+
+def reconcile(repair=False):
+    """Checks every book's available_copies against the copy table in one streaming pass.
+
+    Returns (book id, available_copies, copies on the shelf) for each book
+    that disagrees. The comparison is a single query, so it sees one snapshot
+    of both tables; the bitmaps are not consulted, since books added by other
+    processes or in bulk never reach them. With repair, the check and the fix
+    run in one write transaction and available_copies is set to match the
+    copy rows, which are the record of where each copy is. The bitmaps are
+    rebuilt afterwards either way.
+    """
+    if not repair:
+        mismatched = library_store.execute("shelf_mismatches").fetchall()
+    else:
+        conn = library_store.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            mismatched = conn.execute(library_store.QUERIES["shelf_mismatches"]).fetchall()
+            conn.executemany("UPDATE book SET available_copies = ? WHERE id = ?",
+                             [(on_shelf, book_id) for book_id, _, on_shelf in mismatched])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if mismatched:
+            catalog_cache.catalogue.catalogue_changed()
+    availability.reload()
+    return mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the per-copy inventory against available_copies.")
+    parser.add_argument("--db", default=library_store.DB_PATH, help="database file")
+    parser.add_argument("--repair", action="store_true", help="set available_copies from the copy table")
+    parser.add_argument("--limit", type=int, default=10, help="mismatches to show")
+    args = parser.parse_args()
+
+    library_store.configure(args.db)
+    started = time.perf_counter()
+    mismatched = reconcile(args.repair)
+    elapsed = time.perf_counter() - started
+    stats = availability.stats()
+    print(f"Checked {stats['copies']} copies on the shelf across {stats['books']} books in {elapsed:.2f}s.")
+    for book_id, available, on_shelf in mismatched[:args.limit]:
+        print(f"  book {book_id}: available_copies {available}, {on_shelf} on the shelf")
+    if mismatched:
+        print(f"{len(mismatched)} books {'repaired' if args.repair else 'disagree'}.")
+    library_store.close()
+
+
+if __name__ == "__main__":
+    main()
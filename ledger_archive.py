@@ -0,0 +1,118 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import library_store
+import tombstones
+
+ARCHIVE_AFTER_DAYS = 365  # closed ledger entries older than this move to the archive
+BATCH_SIZE = 5_000  # entries moved per pair of transactions
+BATCH_PAUSE = 0.05  # seconds between batches, so other writers get the lock
+
+# Hot ledger entries before the cutoff that no open loan still needs. Returns
+# close the oldest copy first, so of a (user, book) with n copies out the open
+# borrows are its newest n; every other entry is closed history.
+MOVABLE = '''
+SELECT id FROM main.borrowed_books AS entry
+WHERE id > ? AND id <= ? AND date_time < ?
+  AND NOT (borrow_return = 'B' AND IFNULL((
+      SELECT copies FROM open_loans WHERE open_loans.user_id = entry.user_id AND open_loans.book_id = entry.book_id
+  ), 0) > (
+      SELECT COUNT(*) FROM main.borrowed_books AS later
+      WHERE later.user_id = entry.user_id AND later.book_id = entry.book_id AND later.borrow_return = 'B'
+        AND later.id > entry.id
+  ))
+ORDER BY id LIMIT ?
+'''
+
+# Each file commits on its own, so a batch is copied in one transaction and
+# removed from the hot ledger in the next; removing only what the archive
+# already holds makes the second step safe to repeat.
+REMOVE_COPIED = '''
+DELETE FROM main.borrowed_books
+WHERE id BETWEEN ? AND ? AND id IN (SELECT id FROM archive.borrowed_books WHERE id BETWEEN ? AND ?)
+'''
+
+
+def _write(conn, statements):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for sql, params in statements:
+            conn.execute(sql, params)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _finish_batch(conn):
+    """Removes the batch last copied to the archive from the hot ledger, if it is still there."""
+    first, last = conn.execute("SELECT batch_from, batch_to FROM archive.archive_state").fetchone()
+    if first is not None:
+        _write(conn, [(REMOVE_COPIED, (first, last, first, last))])
+
+
+def roll_over(days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, pause=BATCH_PAUSE, now=None):
+    """Moves closed ledger entries older than `days` days to the archive. Returns the number moved.
+
+    The horizon is raised first, so readers never take a partly moved window
+    for hot-only. Entries are then moved batch_size at a time in id order,
+    each batch in short transactions of its own; an interrupted run is
+    finished by the next one.
+    """
+    cutoff = ((now or datetime.now()) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    conn = library_store.connection()
+    _finish_batch(conn)
+    _write(conn, [("UPDATE archive.archive_state SET horizon = MAX(IFNULL(horizon, ?), ?)", (cutoff, cutoff))])
+    (end_id,) = conn.execute("SELECT MAX(id) FROM main.borrowed_books WHERE date_time < ?", (cutoff,)).fetchone()
+    moved, last_id = 0, 0
+    while end_id is not None:
+        ids = [entry_id for (entry_id,) in conn.execute(MOVABLE, (last_id, end_id, cutoff, batch_size))]
+        if not ids:
+            break
+        marks = ",".join("?" * len(ids))
+        _write(conn, [
+            ("INSERT OR IGNORE INTO archive.borrowed_books (id, user_id, book_id, borrow_return, date_time) "
+             f"SELECT id, user_id, book_id, borrow_return, date_time FROM main.borrowed_books WHERE id IN ({marks})",
+             ids),
+            ("UPDATE archive.archive_state SET batch_from = ?, batch_to = ?", (ids[0], ids[-1])),
+        ])
+        _finish_batch(conn)
+        moved += len(ids)
+        if len(ids) < batch_size:
+            break
+        last_id = ids[-1]
+        time.sleep(pause)
+    return moved
+
+
+def sizes():
+    """Returns the number of entries in the hot ledger and in the archive."""
+    conn = library_store.connection()
+    (hot,) = conn.execute("SELECT COUNT(*) FROM main.borrowed_books").fetchone()
+    (archived,) = conn.execute("SELECT COUNT(*) FROM archive.borrowed_books").fetchone()
+    return hot, archived
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move closed loan history out of the live database.")
+    parser.add_argument("--db", default=library_store.DB_PATH, help="database file")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="archive closed entries older than this")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="entries moved per transaction")
+    args = parser.parse_args()
+
+    library_store.configure(args.db)
+    started = time.perf_counter()
+    moved = roll_over(args.older_than_days, args.batch_size)
+    elapsed = time.perf_counter() - started
+    freed = tombstones.reclaim()
+    hot, archived = sizes()
+    print(f"Archived {moved} ledger entries to {library_store.archive_path(args.db)} in {elapsed:.2f}s; "
+          f"freed {freed} pages.")
+    print(f"Hot ledger: {hot} entries; archive: {archived} entries.")
+    library_store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+import argparse
+import asyncio
+import json
+import secrets
+import sqlite3
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import book_search
+import catalog_cache
+import catalog_view
+import circulation
+import credentials
+import holds
+import library_store
+import session_cache
+import write_queue
+
+HOST = "127.0.0.1"
+PORT = 8080
+READERS = 4  # threads for catalogue reads and password checks
+MAX_BODY = 1 << 20  # bytes
+PAGE_LIMIT = 500  # most books one catalogue request may ask for
+BOOK_FIELDS = ("id", "title", "author", "price", "available_copies", "category", "publisher")
+
+STATUS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    401: "Unauthorized",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    """Ends a request with the given status and a JSON error body."""
+
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.body = {"error": message, **extra}
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        url = urlsplit(target)
+        self.method = method.upper()
+        self.path = [part for part in url.path.split("/") if part]
+        self.query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "Request body must be JSON.")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Request body must be a JSON object.")
+        return data
+
+
+async def read_request(reader):
+    """Reads one HTTP/1.1 request, or returns None when the client has closed the connection."""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line.")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY:
+        raise HTTPError(413, "Request body is too large.")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method, target, headers, body)
+
+
+def _integer(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"'{name}' must be a whole number.")
+
+
+def _identifiers(data):
+    """Returns the book IDs or titles named by {"book": ...} or {"books": [...]}."""
+    books = data.get("books", [data["book"]] if "book" in data else [])
+    if not isinstance(books, list) or not books:
+        raise HTTPError(400, "Name a 'book' or a list of 'books' by ID or title.")
+    return [str(book) for book in books]
+
+
+def _run(work, *args):
+    try:
+        return work(*args)
+    finally:
+        # Never leave a half-done transaction on this thread's connection
+        library_store.rollback()
+
+
+def _lookup(identifiers):
+    return circulation.lookup_books(library_store.connection(), identifiers)
+
+
+def _live_book(book_id):
+    return library_store.execute("book_by_id", (book_id,)).fetchone()
+
+
+class LibraryServer:
+    """Serves the library operations as JSON over HTTP/1.1.
+
+    Writes go through write_queue, whose single writer thread group-commits
+    them, so clients never contend for SQLite's write lock; reads and password
+    checks run on a pool of reader threads. Identical catalogue reads that arrive while one is already
+    in flight wait for that one instead of querying again.
+    """
+
+    def __init__(self, readers=READERS):
+        self.readers = ThreadPoolExecutor(readers, thread_name_prefix="reader")
+        self.tokens = {}  # bearer token -> user id
+        self._inflight = {}  # catalogue query -> future shared by identical requests
+        self.requests = 0
+        self.coalesced = 0
+        self.routes = {
+            ("POST", "/register"): self.register,
+            ("POST", "/login"): self.login,
+            ("POST", "/logout"): self.logout,
+            ("GET", "/books"): self.books,
+            ("POST", "/books"): self.add_book,
+            ("DELETE", "/books"): self.delete_book,
+            ("POST", "/borrow"): self.borrow,
+            ("POST", "/return"): self.give_back,
+            ("DELETE", "/holds"): self.cancel_hold,
+            ("GET", "/stats"): self.stats,
+        }
+
+    async def read(self, work, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.readers, _run, work, *args)
+
+    async def write(self, future):
+        """Waits for a write_queue future without blocking the event loop."""
+        return await asyncio.wrap_future(future)
+
+    def user(self, request):
+        """Returns the id of the user whose bearer token came with the request."""
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        user_id = self.tokens.get(token) if scheme.lower() == "bearer" else None
+        if user_id is None:
+            raise HTTPError(401, "Log in first.")
+        return user_id
+
+    async def register(self, request):
+        data = request.json()
+        username, password = data.get("username"), data.get("password")
+        if not username or not password:
+            raise HTTPError(400, "Username and password are required.")
+        # Hash on a reader so the writer only spends time on the insert
+        hashed = await self.read(credentials.hash_password, password)
+        try:
+            _, user_id = await self.write(write_queue.submit_query("register_user", (username, hashed)))
+        except sqlite3.IntegrityError:
+            raise HTTPError(409, "Username already exists.")
+        return 201, {"user_id": user_id}
+
+    async def login(self, request):
+        data = request.json()
+        user_id = await self.read(credentials.authenticate, data.get("username", ""), data.get("password", ""))
+        if not user_id:
+            raise HTTPError(401, "Invalid username or password.")
+        token = secrets.token_urlsafe(24)
+        self.tokens[token] = user_id
+        notices = await self.write(write_queue.submit_command(holds.take_notices_command(user_id)))
+        return 200, {"token": token, "user_id": user_id,
+                     "notices": [{"book": book_id, "title": title, "ready_until": ready_until}
+                                 for book_id, title, ready_until in notices]}
+
+    async def logout(self, request):
+        user_id = self.user(request)
+        del self.tokens[request.headers["authorization"].partition(" ")[2]]
+        if user_id not in self.tokens.values():
+            session_cache.sessions.invalidate(user_id)
+        return 200, {}
+
+    async def books(self, request):
+        """GET /books?after=<id>&limit=<n> pages the catalogue by id; ?q=<text> searches it."""
+        limit = min(PAGE_LIMIT, _integer(request.query.get("limit", catalog_view.PAGE_SIZE), "limit"))
+        # SQLite reads a negative LIMIT as no limit at all
+        if limit < 1:
+            raise HTTPError(400, "'limit' must be at least 1.")
+        text = request.query.get("q")
+        if text:
+            key, work = ("search", text, limit), (book_search.search_books, text, limit)
+        else:
+            after = _integer(request.query.get("after", 0), "after")
+            key, work = ("page", after, limit), (catalog_view.fetch_after, after, limit)
+
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.read(*work))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # A client hanging up must not cancel the query for the others waiting on it
+        rows = await asyncio.shield(future)
+        return 200, {"books": [dict(zip(BOOK_FIELDS, row)) for row in rows]}
+
+    async def add_book(self, request):
+        self.user(request)
+        data = request.json()
+        try:
+            fields = library_store.validate_book(*(data.get(name) for name in BOOK_FIELDS[1:]))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        except TypeError:
+            raise HTTPError(400, "Price and Available Copies must be numbers.")
+        _, book_id = await self.write(write_queue.submit_query("add_book", fields))
+        return 201, {"id": book_id}
+
+    async def delete_book(self, request):
+        self.user(request)
+        if len(request.path) != 2:
+            raise HTTPError(404, "Use DELETE /books/<id>.")
+        book_id = _integer(request.path[1], "id")
+        deleted, _ = await self.write(write_queue.submit_query("delete_book", (book_id,)))
+        if not deleted:
+            if await self.read(_live_book, book_id):
+                raise HTTPError(409, "Copies of this book are out on loan or kept for a hold.")
+            raise HTTPError(404, "Book not found.")
+        return 200, {"deleted": book_id}
+
+    async def _checkout(self, request, action):
+        user_id = self.user(request)
+        identifiers = _identifiers(request.json())
+        # Resolve on a reader; the writer only runs the guarded transaction, which re-checks every copy
+        books = await self.read(_lookup, identifiers)
+        missing = [identifier for identifier in identifiers if identifier not in books]
+        if missing:
+            raise HTTPError(404, "Book not found.", missing=missing)
+        book_ids = [books[identifier][0] for identifier in identifiers]
+        if action == "borrow":
+            await self.read(session_cache.check_loan_limit, user_id, len(book_ids))
+            refused = await self.write(write_queue.submit_command(circulation.borrow_books_command(user_id, book_ids)))
+            reason = "Not enough copies available."
+        else:
+            refused = await self.write(write_queue.submit_command(circulation.return_books_command(user_id, book_ids)))
+            reason = "Not on loan to this user."
+        if refused:
+            raise HTTPError(409, reason, refused=refused)
+        return 200, {"books": [{"id": book_id, "title": books[identifier][1]}
+                               for identifier, book_id in zip(identifiers, book_ids)]}
+
+    async def cancel_hold(self, request):
+        user_id = self.user(request)
+        if len(request.path) != 2:
+            raise HTTPError(404, "Use DELETE /holds/<book id>.")
+        book_id = _integer(request.path[1], "book id")
+        if not await self.write(write_queue.submit_command(holds.cancel_hold_command(user_id, book_id))):
+            raise HTTPError(404, "No hold on that book.")
+        return 200, {"cancelled": book_id}
+
+    async def borrow(self, request):
+        return await self._checkout(request, "borrow")
+
+    async def give_back(self, request):
+        return await self._checkout(request, "return")
+
+    async def stats(self, request):
+        return 200, {
+            "requests": self.requests,
+            "coalesced_reads": self.coalesced,
+            "logged_in": len(self.tokens),
+            "circulation": circulation.stats(),
+            "sessions": session_cache.sessions.stats(),
+            "catalogue_cache": catalog_cache.catalogue.stats(),
+            "writes": write_queue.stats(),
+        }
+
+    async def dispatch(self, request):
+        self.requests += 1
+        route = "/" + (request.path[0] if request.path else "")
+        handler = self.routes.get((request.method, route))
+        if handler is None:
+            if any(path == route for _, path in self.routes):
+                return 405, {"error": "Method not allowed."}
+            return 404, {"error": "No such endpoint."}
+        try:
+            return await handler(request)
+        except HTTPError as e:
+            return e.status, e.body
+        except session_cache.LoanLimitReached as e:
+            return 409, {"error": str(e)}
+        except circulation.DatabaseBusyError as e:
+            return 503, {"error": str(e)}
+        except Exception:
+            traceback.print_exc()
+            return 500, {"error": "Internal server error."}
+
+    async def handle(self, reader, writer):
+        """Serves requests on one keep-alive connection until the client closes it."""
+        try:
+            while True:
+                keep_alive = True
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    status, body = await self.dispatch(request)
+                    keep_alive = request.headers.get("connection", "").lower() != "close"
+                except HTTPError as e:
+                    status, body, keep_alive = e.status, e.body, False
+                payload = json.dumps(body).encode()
+                head = (f"HTTP/1.1 {status} {STATUS[status]}\r\n"
+                        f"Content-Type: application/json\r\n"
+                        f"Content-Length: {len(payload)}\r\n")
+                if not keep_alive:
+                    head += "Connection: close\r\n"
+                writer.write(head.encode("latin-1") + b"\r\n" + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        self.readers.shutdown()
+        write_queue.close()
+
+
+async def serve(host=HOST, port=PORT, readers=READERS):
+    app = LibraryServer(readers)
+    server = await asyncio.start_server(app.handle, host, port)
+    print(f"Serving the library on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        app.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the library operations as a JSON API.")
+    parser.add_argument("--db", default=library_store.DB_PATH, help="database file")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--readers", type=int, default=READERS, help="reader threads")
+    parser.add_argument("--commit-window", type=float, default=write_queue.WINDOW * 1000,
+                        help="milliseconds to gather writes into one commit")
+    parser.add_argument("--commit-batch", type=int, default=write_queue.BATCH_SIZE, help="most writes per commit")
+    parser.add_argument("--loan-limit", type=int, default=session_cache.LOAN_LIMIT,
+                        help="copies a user may hold at once (default: no limit)")
+    args = parser.parse_args()
+    if args.readers < 1:
+        parser.error("--readers must be at least 1")
+    if args.loan_limit is not None and args.loan_limit < 1:
+        parser.error("--loan-limit must be at least 1")
+
+    # One connection per reader thread, plus the writer's and the main thread's
+    library_store.configure(args.db, pool_size=args.readers + 2)
+    write_queue.configure(args.commit_window / 1000, args.commit_batch)
+    session_cache.configure(args.loan_limit)
+    try:
+        asyncio.run(serve(args.host, args.port, args.readers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        library_store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import os
+import sqlite3
+import threading
+
+import migrations
+
+DB_PATH = 'OmDayalLibrary1.db'
+POOL_SIZE = 8
+POOL_TIMEOUT = 30  # seconds to wait for a free connection
+BUSY_TIMEOUT = 5  # seconds SQLite waits on a locked database
+
+# Applied to every new connection
+PRAGMAS = (
+    "PRAGMA auto_vacuum = INCREMENTAL",  # only takes effect on a new file, see tombstones.py for existing ones
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",  # safe with WAL, skips the fsync on every commit
+    "PRAGMA cache_size = -16000",  # 16 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",  # map up to 256 MB of the file
+    "PRAGMA temp_store = MEMORY",
+)
+# Applied to the archived ledger attached to every connection, see ledger_archive.py
+ARCHIVE_PRAGMAS = (
+    "PRAGMA archive.journal_mode = WAL",
+    "PRAGMA archive.synchronous = NORMAL",
+)
+
+
+# Deleted books stay in `book` as tombstones until compacted. Every read of the
+# catalogue carries this condition, which is what lets SQLite use the partial
+# indexes that leave tombstones out.
+LIVE = "deleted_at IS NULL"
+# A book may only be deleted once every copy is back on the shelf; otherwise
+# the copies out could never be returned and the tombstone never purged.
+ALL_COPIES_IN = "NOT EXISTS (SELECT 1 FROM copy WHERE copy.book_id = book.id AND copy.status != 'shelf')"
+BOOK_COLUMNS = "id, title, author, price, available_copies, category, publisher"
+
+
+def _first_match(columns, keys):
+    """Builds a lookup returning the first book matching the keys in order.
+
+    Each key is its own indexed probe stopped at one row, combined with UNION
+    ALL, so no OR has to be planned across the four columns.
+    """
+    probes = " UNION ALL ".join(f"SELECT * FROM (SELECT {rank} AS rank, {columns} FROM book "
+                                f"WHERE {key} = ? AND {LIVE} LIMIT 1)" for rank, key in enumerate(keys))
+    return f"SELECT {columns} FROM ({probes}) ORDER BY rank LIMIT 1"
+
+
+# Every query the front ends issue. Keeping the text in one place means each
+# connection's statement cache prepares it once and reuses it afterwards.
+QUERIES = {
+    # users
+    "register_user": "INSERT INTO users (username, password) VALUES (?, ?)",
+    "user_by_name": "SELECT id, password FROM users WHERE username = ?",
+    "update_password": "UPDATE users SET password = ? WHERE id = ?",
+    "user_profile": "SELECT id, username FROM users WHERE id = ?",
+    "user_open_loans": "SELECT book_id, copies FROM open_loans WHERE user_id = ?",
+
+    # catalogue
+    "all_books": f"SELECT {BOOK_COLUMNS} FROM book WHERE {LIVE}",
+    "books_page_after": f"SELECT {BOOK_COLUMNS} FROM book WHERE id > ? AND {LIVE} ORDER BY id LIMIT ?",
+    "books_page_before": f"SELECT {BOOK_COLUMNS} FROM book WHERE id < ? AND {LIVE} ORDER BY id DESC LIMIT ?",
+    "add_book": "INSERT INTO book (title, author, price, available_copies, category, publisher) VALUES (?, ?, ?, ?, ?, ?)",
+    # Deleting leaves a tombstone; tombstones.py purges them later
+    "delete_book": "UPDATE book SET deleted_at = CAST(strftime('%s', 'now') AS INTEGER) "
+                   f"WHERE id = ? AND {LIVE} AND {ALL_COPIES_IN}",
+    # Only the first match, the id before the title, so one title shared by several books deletes just one
+    "delete_book_by_id_or_title": "UPDATE book SET deleted_at = CAST(strftime('%s', 'now') AS INTEGER) "
+                                  f"WHERE id = ({_first_match('id', ('id', 'title'))}) AND {ALL_COPIES_IN}",
+
+    # lookups used by borrow_book in test3.py
+    "borrow_by_id": f"SELECT id, title, available_copies, price FROM book WHERE id = ? AND {LIVE}",
+    "borrow_by_title": f"SELECT id, title, available_copies, price FROM book WHERE title = ? AND {LIVE}",
+    "borrow_by_category": "SELECT id, title, available_copies, price FROM book "
+                          f"WHERE category = ? AND available_copies > 0 AND {LIVE} LIMIT 1",
+    "borrow_by_publisher": "SELECT id, title, available_copies, price FROM book "
+                           f"WHERE publisher = ? AND available_copies > 0 AND {LIVE} LIMIT 1",
+
+    # lookups used by return_book and delete_book in test3.py
+    "book_by_id": f"SELECT id, title FROM book WHERE id = ? AND {LIVE}",
+    "book_by_title": f"SELECT id, title FROM book WHERE title = ? AND {LIVE}",
+    "book_by_category": f"SELECT id, title FROM book WHERE category = ? AND {LIVE}",
+    "book_by_publisher": f"SELECT id, title FROM book WHERE publisher = ? AND {LIVE}",
+
+    # lookups used by the Tk front ends
+    "borrow_lookup": _first_match("id, title, available_copies, category, publisher",
+                                  ("id", "title", "category", "publisher")),
+    "return_lookup": _first_match("id, title, category, publisher", ("id", "title", "category", "publisher")),
+    "delete_lookup": _first_match("id, title", ("id", "title")),
+
+    # full-text search, see book_search.py
+    "search_books": "SELECT book.id, book.title, book.author, book.price, book.available_copies, book.category, "
+                    "book.publisher FROM book_fts JOIN book ON book.id = book_fts.rowid "
+                    f"WHERE book_fts MATCH ? AND book.{LIVE} ORDER BY bm25(book_fts, 10.0, 5.0, 2.0, 2.0) LIMIT ?",
+    "search_vocab_prefix": "SELECT term FROM book_fts_vocab WHERE term >= ? AND term < ? LIMIT 1",
+    "search_vocab_near": "SELECT term FROM book_fts_vocab WHERE term >= ? AND term < ? AND length(term) BETWEEN ? AND ?",
+
+    # circulation reports, see circulation_stats.py
+    "most_borrowed": "SELECT book.id, book.title, book.author, borrow_count.count FROM borrow_count "
+                     "JOIN book ON book.id = borrow_count.book_id ORDER BY borrow_count.count DESC LIMIT ?",
+    "category_demand": "SELECT category, count FROM category_borrow_count ORDER BY count DESC LIMIT ?",
+    "publisher_demand": "SELECT publisher, count FROM publisher_borrow_count ORDER BY count DESC LIMIT ?",
+    "daily_circulation": "SELECT day, borrows, returns FROM daily_circulation WHERE day >= ? ORDER BY day",
+    # history reads both partitions of the ledger, see ledger_archive.py
+    "user_history": "SELECT book_id, borrow_return, date_time FROM ledger WHERE user_id = ? "
+                    "ORDER BY date_time DESC LIMIT ?",
+    "book_history": "SELECT user_id, borrow_return, date_time FROM ledger WHERE book_id = ? "
+                    "ORDER BY date_time DESC LIMIT ?",
+    # recent activity after the archive horizon is all in the hot ledger
+    "recent_activity": "SELECT user_id, book_id, borrow_return, date_time FROM main.borrowed_books "
+                       "WHERE date_time >= ? ORDER BY date_time DESC LIMIT ?",
+    "ledger_since": "SELECT user_id, book_id, borrow_return, date_time FROM ledger "
+                    "WHERE date_time >= ? ORDER BY date_time DESC LIMIT ?",
+    "ledger_horizon": "SELECT horizon FROM archive.archive_state",
+
+    # due dates and fines, see due_dates.py
+    "loans_due": "SELECT id, user_id, book_id, due_at, reminded FROM loan_due ORDER BY due_at",
+    "user_due_dates": "SELECT book_id, due_at FROM loan_due WHERE user_id = ? ORDER BY due_at",
+    "user_fines": "SELECT settled FROM fines WHERE user_id = ?",
+
+    # hold queues, see holds.py
+    "holds_waiting": "SELECT ticket FROM holds WHERE book_id = ? AND ready_until IS NULL ORDER BY ticket",
+    "user_hold": "SELECT ticket, ready_until FROM holds WHERE user_id = ? AND book_id = ?",
+    "user_holds": "SELECT book_id, ticket, ready_until FROM holds WHERE user_id = ? ORDER BY book_id",
+
+    # per-copy inventory, see inventory.py
+    "shelf_copies": "SELECT book_id, slot FROM copy WHERE status = 'shelf' ORDER BY book_id",
+    # books whose available_copies disagrees with the copies on the shelf, see inventory.py
+    "shelf_mismatches": "SELECT book.id, book.available_copies, IFNULL(shelf.copies, 0) FROM book "
+                        "LEFT JOIN (SELECT book_id, COUNT(*) AS copies FROM copy WHERE status = 'shelf' "
+                        "GROUP BY book_id) AS shelf ON shelf.book_id = book.id "
+                        "WHERE book.available_copies != IFNULL(shelf.copies, 0)",
+    "book_copies": "SELECT slot, barcode, status, user_id FROM copy WHERE book_id = ? ORDER BY slot",
+}
+
+
+def archive_path(path):
+    """Returns the file that holds the archived ledger of the database at path."""
+    root, ext = os.path.splitext(path)
+    return f"{root}_archive{ext or '.db'}"
+
+
+def validate_book(title, author, price, available_copies, category, publisher):
+    """Checks and converts the fields of a new book. Raises ValueError when one is invalid."""
+    price = float(price)
+    available_copies = int(available_copies)
+    if not title or not author or not category or not publisher:
+        raise ValueError("All fields except Price and Available Copies must be filled!")
+    if price < 0:
+        raise ValueError("Price cannot be negative.")
+    # The copy trigger numbers new copies from copy_slots, which stops at MAX_COPIES
+    if not 0 <= available_copies <= migrations.MAX_COPIES:
+        raise ValueError(f"Available Copies must be between 0 and {migrations.MAX_COPIES}.")
+    return title, author, price, available_copies, category, publisher
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within POOL_TIMEOUT seconds."""
+
+
+class ConnectionPool:
+    """A bounded set of SQLite connections, each owned by one thread at a time."""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._cond = threading.Condition()
+        self._by_thread = {}  # thread ident -> connection
+        self._idle = []
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                               cached_statements=max(128, 2 * len(QUERIES)))
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path(self.path),))
+        for pragma in PRAGMAS + ARCHIVE_PRAGMAS:
+            conn.execute(pragma)
+        if not self._schema_ready:
+            migrations.migrate(conn)
+            migrations.prepare_archive(conn)
+            self._schema_ready = True
+        conn.execute(migrations.LEDGER_VIEW)
+        return conn
+
+    def _reap(self):
+        """Takes back the connections of threads that have exited."""
+        alive = {thread.ident for thread in threading.enumerate()}
+        for ident in [ident for ident in self._by_thread if ident not in alive]:
+            conn = self._by_thread.pop(ident)
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.append(conn)
+
+    def connection(self):
+        """Returns the calling thread's connection, taking one from the pool if needed."""
+        ident = threading.get_ident()
+        with self._cond:
+            conn = self._by_thread.get(ident)
+            if conn is not None:
+                return conn
+            self._reap()
+            waited = 0.0
+            while not self._idle and len(self._by_thread) >= self.size:
+                if waited >= POOL_TIMEOUT:
+                    raise PoolTimeout(f"All {self.size} database connections are in use.")
+                self._cond.wait(0.05)
+                waited += 0.05
+                self._reap()
+            conn = self._idle.pop() if self._idle else self._connect()
+            self._by_thread[ident] = conn
+            return conn
+
+    def release(self):
+        """Hands the calling thread's connection back to the pool."""
+        with self._cond:
+            conn = self._by_thread.pop(threading.get_ident(), None)
+            if conn is not None:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def close(self):
+        """Closes every connection in the pool."""
+        with self._cond:
+            for conn in list(self._by_thread.values()) + self._idle:
+                conn.close()
+            self._by_thread.clear()
+            self._idle.clear()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(path=DB_PATH, pool_size=POOL_SIZE):
+    """Points the store at another database file, closing the current pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(path, pool_size)
+    return _pool
+
+
+def pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
+
+
+def connection():
+    """Returns the calling thread's connection."""
+    return pool().connection()
+
+
+def open_database():
+    """Opens the calling thread's connection, checks the file and returns its schema version.
+
+    Front ends call this on a worker once their window is up, so the first
+    paint never waits on the disk; it raises sqlite3.DatabaseError for a file
+    that is damaged or was written by a newer version of the library.
+    """
+    conn = connection()
+    version = migrations.current_version(conn)
+    if version > migrations.LATEST_VERSION:
+        raise sqlite3.DatabaseError(f"The database has schema version {version}; "
+                                    f"this program only knows up to {migrations.LATEST_VERSION}.")
+    (result,) = conn.execute("PRAGMA quick_check(1)").fetchone()
+    if result != "ok":
+        raise sqlite3.DatabaseError(f"The database failed its integrity check: {result}")
+    return version
+
+
+def release():
+    """Returns the calling thread's connection to the pool."""
+    pool().release()
+
+
+def execute(name, params=()):
+    """Runs a named query on the calling thread's connection and returns a fresh cursor."""
+    return connection().execute(QUERIES[name], params)
+
+
+def commit():
+    """Commits the calling thread's transaction."""
+    connection().commit()
+
+
+def rollback():
+    """Discards the calling thread's uncommitted work, if any."""
+    conn = connection()
+    if conn.in_transaction:
+        conn.rollback()
+
+
+def close():
+    """Closes all pooled connections."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
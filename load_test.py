@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+
+import library_server
+
+CLIENTS = 50
+DURATION = 10  # seconds
+READ_SHARE = 0.8  # share of operations that are catalogue reads
+HOT_PAGES = 5  # catalogue pages most readers ask for, so coalescing has something to share
+
+
+class Client:
+    """One keep-alive HTTP/1.1 connection to the library server."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.token = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, body=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(payload)}\r\n"
+        if self.token:
+            head += f"Authorization: Bearer {self.token}\r\n"
+        self.writer.write(head.encode("latin-1") + b"\r\n" + payload)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length)) if length else {}
+
+    def close(self):
+        self.writer.close()
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def _client(index, host, port, deadline, book_ids, read_share, latency, statuses):
+    client = Client(host, port)
+    await client.connect()
+    username, password = f"loadtest{index}", "password"
+    await client.request("POST", "/register", {"username": username, "password": password})
+    _, body = await client.request("POST", "/login", {"username": username, "password": password})
+    client.token = body.get("token")
+    rng = random.Random(index)
+
+    async def timed(name, method, path, body=None):
+        started = time.perf_counter()
+        status, _ = await client.request(method, path, body)
+        latency[name].append(time.perf_counter() - started)
+        statuses[status] += 1
+        return status
+
+    try:
+        while time.perf_counter() < deadline:
+            if rng.random() < read_share:
+                page = rng.randrange(HOT_PAGES) if rng.random() < 0.8 else rng.randrange(len(book_ids) // 100 + 1)
+                await timed("read_page", "GET", f"/books?after={book_ids[min(page * 100, len(book_ids) - 1)] - 1}")
+            else:
+                book = str(rng.choice(book_ids))
+                if await timed("borrow", "POST", "/borrow", {"book": book}) == 200:
+                    await timed("return", "POST", "/return", {"book": book})
+    finally:
+        client.close()
+
+
+async def run(host, port, clients=CLIENTS, duration=DURATION, read_share=READ_SHARE):
+    """Drives the server with `clients` concurrent connections for `duration` seconds and returns a report."""
+    probe = Client(host, port)
+    await probe.connect()
+    book_ids, after = [], 0
+    while True:
+        _, body = await probe.request("GET", f"/books?after={after}&limit={library_server.PAGE_LIMIT}")
+        if not body["books"]:
+            break
+        book_ids.extend(book["id"] for book in body["books"])
+        after = book_ids[-1]
+        if len(book_ids) >= 20_000:
+            break
+
+    latency = defaultdict(list)
+    statuses = Counter()
+    started = time.perf_counter()
+    await asyncio.gather(*(_client(i, host, port, started + duration, book_ids, read_share, latency, statuses)
+                           for i in range(clients)))
+    elapsed = time.perf_counter() - started
+    _, server = await probe.request("GET", "/stats")
+    probe.close()
+
+    return {
+        "clients": clients,
+        "seconds": round(elapsed, 1),
+        "requests_per_second": round(sum(statuses.values()) / elapsed, 1),
+        "statuses": dict(statuses),
+        "operations": {name: {
+            "count": len(samples),
+            "p50_ms": round(_percentile(samples, 0.50) * 1000, 3),
+            "p99_ms": round(_percentile(samples, 0.99) * 1000, 3),
+        } for name, samples in latency.items()},
+        "server": server,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test a running library server from localhost.")
+    parser.add_argument("--host", default=library_server.HOST)
+    parser.add_argument("--port", type=int, default=library_server.PORT)
+    parser.add_argument("--clients", type=int, default=CLIENTS, help="concurrent connections")
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds to run")
+    parser.add_argument("--read-share", type=float, default=READ_SHARE, help="share of requests that are reads")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.host, args.port, args.clients, args.duration, args.read_share))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,673 @@
+import argparse
+import sqlite3
+import time
+
+BATCH_SIZE = 5_000  # rows an online rebuild copies per transaction
+BATCH_PAUSE = 0.01  # seconds between batches, so other writers get the lock
+
+# The tables as they ship in OmDayalLibrary1.db
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS book (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        author TEXT NOT NULL,
+        price REAL NOT NULL,
+        available_copies INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        publisher TEXT NOT NULL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_title ON book(title)",
+    "CREATE INDEX IF NOT EXISTS idx_category ON book(category)",
+    "CREATE INDEX IF NOT EXISTS idx_publisher ON book(publisher)",
+    '''
+    CREATE TABLE IF NOT EXISTS borrowed_books (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        book_id INTEGER,
+        borrow_return TEXT,
+        date_time TEXT,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (book_id) REFERENCES book(id)
+    )
+    ''',
+)
+
+# Loans that are still out, one row per (user, book) with the number of copies held.
+# It is kept in step with borrowed_books so returns never have to scan the ledger.
+OPEN_LOANS_SCHEMA = '''
+CREATE TABLE open_loans (
+    user_id INTEGER NOT NULL,
+    book_id INTEGER NOT NULL,
+    copies INTEGER NOT NULL CHECK (copies > 0),
+    PRIMARY KEY (user_id, book_id),
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (book_id) REFERENCES book(id)
+) WITHOUT ROWID
+'''
+
+OPEN_LOANS_BACKFILL = '''
+INSERT INTO open_loans (user_id, book_id, copies)
+SELECT user_id, book_id, SUM(CASE borrow_return WHEN 'B' THEN 1 ELSE -1 END)
+FROM borrowed_books
+GROUP BY user_id, book_id
+HAVING SUM(CASE borrow_return WHEN 'B' THEN 1 ELSE -1 END) > 0
+'''
+
+# Covering indexes for the ledger. By user they serve a user's history and the
+# open-loans rebuild (grouped by user and book); by book they serve a book's
+# history and the statistics rebuild. Neither query touches the table itself.
+LEDGER_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_borrowed_user ON borrowed_books (user_id, book_id, borrow_return, date_time)",
+    "CREATE INDEX IF NOT EXISTS idx_borrowed_book ON borrowed_books (book_id, date_time, user_id, borrow_return)",
+)
+
+# Full-text index over the searchable book columns. It reads its text from
+# `book` (external content) and is kept in sync by triggers; the update trigger
+# only fires for indexed columns so borrow/return never touch the index.
+SEARCH_SCHEMA = (
+    '''
+    CREATE VIRTUAL TABLE book_fts USING fts5(
+        title, author, category, publisher,
+        content='book', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    ''',
+    "CREATE VIRTUAL TABLE book_fts_vocab USING fts5vocab(book_fts, 'row')",
+    '''
+    CREATE TRIGGER book_fts_insert AFTER INSERT ON book BEGIN
+        INSERT INTO book_fts (rowid, title, author, category, publisher)
+        VALUES (new.id, new.title, new.author, new.category, new.publisher);
+    END
+    ''',
+    '''
+    CREATE TRIGGER book_fts_delete AFTER DELETE ON book BEGIN
+        INSERT INTO book_fts (book_fts, rowid, title, author, category, publisher)
+        VALUES ('delete', old.id, old.title, old.author, old.category, old.publisher);
+    END
+    ''',
+    '''
+    CREATE TRIGGER book_fts_update AFTER UPDATE OF title, author, category, publisher ON book BEGIN
+        INSERT INTO book_fts (book_fts, rowid, title, author, category, publisher)
+        VALUES ('delete', old.id, old.title, old.author, old.category, old.publisher);
+        INSERT INTO book_fts (rowid, title, author, category, publisher)
+        VALUES (new.id, new.title, new.author, new.category, new.publisher);
+    END
+    ''',
+    "INSERT INTO book_fts (book_fts) VALUES ('rebuild')",
+)
+
+# Borrow counters per book, category and publisher plus daily totals, kept up
+# to date by a trigger on the ledger so reports never have to scan it.
+# borrow_count ships in OmDayalLibrary1.db without a key, so it is emptied and
+# keyed here; STATS_REBUILD then refills it from the ledger.
+STATS_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS borrow_count (
+        book_id INTEGER,
+        count INTEGER,
+        FOREIGN KEY (book_id) REFERENCES book(id)
+    )
+    ''',
+    "DELETE FROM borrow_count",
+    "CREATE UNIQUE INDEX idx_borrow_count_book ON borrow_count(book_id)",
+    "CREATE INDEX idx_borrow_count_count ON borrow_count(count)",
+    '''
+    CREATE TABLE category_borrow_count (
+        category TEXT PRIMARY KEY,
+        count INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    "CREATE INDEX idx_category_borrow_count_count ON category_borrow_count(count)",
+    '''
+    CREATE TABLE publisher_borrow_count (
+        publisher TEXT PRIMARY KEY,
+        count INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    "CREATE INDEX idx_publisher_borrow_count_count ON publisher_borrow_count(count)",
+    '''
+    CREATE TABLE daily_circulation (
+        day TEXT PRIMARY KEY,
+        borrows INTEGER NOT NULL,
+        returns INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TRIGGER borrow_stats_insert AFTER INSERT ON borrowed_books BEGIN
+        INSERT INTO daily_circulation (day, borrows, returns)
+        VALUES (substr(new.date_time, 1, 10), new.borrow_return = 'B', new.borrow_return = 'R')
+        ON CONFLICT (day) DO UPDATE SET borrows = borrows + excluded.borrows, returns = returns + excluded.returns;
+        INSERT INTO borrow_count (book_id, count)
+        SELECT new.book_id, 1 WHERE new.borrow_return = 'B'
+        ON CONFLICT (book_id) DO UPDATE SET count = count + 1;
+        INSERT INTO category_borrow_count (category, count)
+        SELECT category, 1 FROM book WHERE id = new.book_id AND category IS NOT NULL AND new.borrow_return = 'B'
+        ON CONFLICT (category) DO UPDATE SET count = count + 1;
+        INSERT INTO publisher_borrow_count (publisher, count)
+        SELECT publisher, 1 FROM book WHERE id = new.book_id AND publisher IS NOT NULL AND new.borrow_return = 'B'
+        ON CONFLICT (publisher) DO UPDATE SET count = count + 1;
+    END
+    ''',
+)
+
+# Recomputes every counter with a single scan of the ledger: the ledger is
+# folded into per (book, day, kind) totals once, and each counter is built from
+# that much smaller table.
+STATS_REBUILD = (
+    "DELETE FROM borrow_count",
+    "DELETE FROM category_borrow_count",
+    "DELETE FROM publisher_borrow_count",
+    "DELETE FROM daily_circulation",
+    '''
+    CREATE TEMP TABLE ledger_totals AS
+    SELECT book_id, substr(date_time, 1, 10) AS day, borrow_return, COUNT(*) AS n
+    FROM borrowed_books
+    GROUP BY book_id, day, borrow_return
+    ''',
+    '''
+    INSERT INTO borrow_count (book_id, count)
+    SELECT book_id, SUM(n) FROM ledger_totals WHERE borrow_return = 'B' GROUP BY book_id
+    ''',
+    '''
+    INSERT INTO category_borrow_count (category, count)
+    SELECT book.category, SUM(n) FROM ledger_totals JOIN book ON book.id = ledger_totals.book_id
+    WHERE borrow_return = 'B' AND book.category IS NOT NULL GROUP BY book.category
+    ''',
+    '''
+    INSERT INTO publisher_borrow_count (publisher, count)
+    SELECT book.publisher, SUM(n) FROM ledger_totals JOIN book ON book.id = ledger_totals.book_id
+    WHERE borrow_return = 'B' AND book.publisher IS NOT NULL GROUP BY book.publisher
+    ''',
+    '''
+    INSERT INTO daily_circulation (day, borrows, returns)
+    SELECT day, SUM(CASE borrow_return WHEN 'B' THEN n ELSE 0 END), SUM(CASE borrow_return WHEN 'R' THEN n ELSE 0 END)
+    FROM ledger_totals WHERE day IS NOT NULL GROUP BY day
+    ''',
+    "DROP TABLE temp.ledger_totals",
+)
+# The same rebuild over both partitions of the ledger, once entries have been archived
+LEDGER_STATS_REBUILD = tuple(statement.replace("FROM borrowed_books", "FROM ledger") for statement in STATS_REBUILD)
+
+# Due dates, one row per copy on loan, as Unix timestamps so they sort and
+# compare as integers. idx_loan_due_at serves the overdue list and the nightly
+# fines pass; idx_loan_due_user finds the copy a return closes.
+DUE_DATES_SCHEMA = (
+    '''
+    CREATE TABLE loan_due (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        book_id INTEGER NOT NULL,
+        due_at INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (book_id) REFERENCES book(id)
+    )
+    ''',
+    "CREATE INDEX idx_loan_due_at ON loan_due (due_at, user_id)",
+    "CREATE INDEX idx_loan_due_user ON loan_due (user_id, book_id, due_at)",
+    '''
+    CREATE TABLE fines (
+        user_id INTEGER PRIMARY KEY,
+        settled REAL NOT NULL DEFAULT 0,
+        accruing REAL NOT NULL DEFAULT 0,
+        computed_at INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    ''',
+)
+BACKFILL_LOAN_DAYS = 14  # loan period given to copies already out when due dates were introduced
+
+# Gives each copy still on loan a due date. Those loans were made when there
+# was no loan period and no fines, so the period starts when due dates are
+# introduced rather than at the borrow; otherwise every old loan would be
+# overdue, and fined, from the start. The open copies of a (user, book) are
+# its latest borrows, since returns close the oldest first. date_time is
+# local time, hence the 'utc' modifier.
+DUE_DATES_BACKFILL = '''
+INSERT INTO loan_due (user_id, book_id, due_at)
+SELECT user_id, book_id, MAX(borrowed_at, CAST(strftime('%s', 'now') AS INTEGER)) + ? * 86400
+FROM (
+    SELECT ledger.user_id, ledger.book_id, open_loans.copies,
+           COALESCE(CAST(strftime('%s', ledger.date_time, 'utc') AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER))
+               AS borrowed_at,
+           ROW_NUMBER() OVER (PARTITION BY ledger.user_id, ledger.book_id ORDER BY ledger.date_time DESC, ledger.id DESC)
+               AS newest
+    FROM borrowed_books AS ledger JOIN open_loans USING (user_id, book_id)
+    WHERE ledger.borrow_return = 'B'
+)
+WHERE newest <= copies
+'''
+
+# Hold queues for books with no copy on the shelf. Each book's queue is its
+# rows in ticket order; ready_until is set once a returned copy has been kept
+# for the hold. Users hold a book at most once.
+HOLDS_SCHEMA = (
+    '''
+    CREATE TABLE holds (
+        book_id INTEGER NOT NULL,
+        ticket INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        placed_at INTEGER NOT NULL,
+        ready_until INTEGER,
+        PRIMARY KEY (book_id, ticket),
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (book_id) REFERENCES book(id)
+    ) WITHOUT ROWID
+    ''',
+    "CREATE UNIQUE INDEX idx_holds_user ON holds (user_id, book_id)",
+    "CREATE INDEX idx_holds_ready ON holds (ready_until) WHERE ready_until IS NOT NULL",
+)
+
+# One row per physical copy. A book's copies are numbered by slot from 0, and
+# each is on the shelf, out on loan, or kept for a hold (with the user it is
+# lent to or kept for). New books get their copies from a trigger; triggers
+# cannot use a recursive CTE, so the slots come from copy_slots.
+MAX_COPIES = 4096  # copies a book can be added with at once
+COPY_SCHEMA = (
+    '''
+    CREATE TABLE copy (
+        id INTEGER PRIMARY KEY,
+        book_id INTEGER NOT NULL,
+        slot INTEGER NOT NULL,
+        barcode TEXT NOT NULL UNIQUE,
+        status TEXT NOT NULL DEFAULT 'shelf' CHECK (status IN ('shelf', 'loan', 'held')),
+        user_id INTEGER,
+        FOREIGN KEY (book_id) REFERENCES book(id),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    ''',
+    "CREATE UNIQUE INDEX idx_copy_book ON copy (book_id, slot)",
+    "CREATE INDEX idx_copy_shelf ON copy (book_id, slot) WHERE status = 'shelf'",
+    "CREATE INDEX idx_copy_user ON copy (user_id, book_id, status) WHERE user_id IS NOT NULL",
+    "CREATE TABLE copy_slots (slot INTEGER PRIMARY KEY)",
+    f'''
+    INSERT INTO copy_slots (slot)
+    WITH RECURSIVE n(slot) AS (SELECT 0 UNION ALL SELECT slot + 1 FROM n WHERE slot < {MAX_COPIES - 1})
+    SELECT slot FROM n
+    ''',
+    '''
+    CREATE TRIGGER copy_insert AFTER INSERT ON book BEGIN
+        INSERT INTO copy (book_id, slot, barcode)
+        SELECT new.id, slot, printf('%07d-%04d', new.id, slot) FROM copy_slots WHERE slot < new.available_copies;
+    END
+    ''',
+    '''
+    CREATE TRIGGER copy_delete AFTER DELETE ON book BEGIN
+        DELETE FROM copy WHERE book_id = old.id;
+    END
+    ''',
+)
+
+# Numbers the copies of every book: those on the shelf first, then one per
+# copy on loan, then one per copy kept for a ready hold.
+COPY_BACKFILL = (
+    "DELETE FROM copy",
+    '''
+    INSERT INTO copy (book_id, slot, barcode)
+    SELECT book.id, slot, printf('%07d-%04d', book.id, slot)
+    FROM book JOIN copy_slots ON copy_slots.slot < book.available_copies
+    ''',
+    '''
+    INSERT INTO copy (book_id, slot, barcode, status, user_id)
+    SELECT book_id, slot, printf('%07d-%04d', book_id, slot), 'loan', user_id
+    FROM (
+        SELECT open_loans.book_id, open_loans.user_id,
+               MAX(book.available_copies, 0) - 1
+                   + ROW_NUMBER() OVER (PARTITION BY open_loans.book_id ORDER BY open_loans.user_id, copy_slots.slot)
+                   AS slot
+        FROM open_loans
+        JOIN copy_slots ON copy_slots.slot < open_loans.copies
+        JOIN book ON book.id = open_loans.book_id
+    )
+    ''',
+    '''
+    INSERT INTO copy (book_id, slot, barcode, status, user_id)
+    SELECT book_id, slot, printf('%07d-%04d', book_id, slot), 'held', user_id
+    FROM (
+        SELECT holds.book_id, holds.user_id,
+               (SELECT IFNULL(MAX(slot), -1) FROM copy WHERE copy.book_id = holds.book_id)
+                   + ROW_NUMBER() OVER (PARTITION BY holds.book_id ORDER BY holds.ticket) AS slot
+        FROM holds WHERE ready_until IS NOT NULL
+    )
+    ''',
+)
+
+# Deleted books are kept as tombstones with the time of deletion. The lookup
+# indexes are rebuilt as partial indexes over live books only, so reads never
+# touch a tombstone; idx_book_deleted is the compaction job's way to them.
+SOFT_DELETE_SCHEMA = (
+    "ALTER TABLE book ADD COLUMN deleted_at INTEGER",
+    "DROP INDEX IF EXISTS idx_title",
+    "DROP INDEX IF EXISTS idx_category",
+    "DROP INDEX IF EXISTS idx_publisher",
+    "CREATE INDEX idx_title ON book(title) WHERE deleted_at IS NULL",
+    "CREATE INDEX idx_category ON book(category) WHERE deleted_at IS NULL",
+    "CREATE INDEX idx_publisher ON book(publisher) WHERE deleted_at IS NULL",
+    "CREATE INDEX idx_book_deleted ON book(deleted_at) WHERE deleted_at IS NOT NULL",
+)
+
+# The hot ledger by time, for recent activity and for finding what to archive
+LEDGER_TIME_INDEX = "CREATE INDEX idx_borrowed_time ON borrowed_books (date_time)"
+
+# A row for each copy set aside for a hold, written in the transaction that
+# sets it aside and removed once its user has been told (see holds.py), or
+# once the copy is no longer kept.
+HOLD_NOTICES_SCHEMA = (
+    '''
+    CREATE TABLE hold_notices (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        book_id INTEGER NOT NULL,
+        ready_until INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (book_id) REFERENCES book(id)
+    )
+    ''',
+    "CREATE INDEX idx_hold_notices_user ON hold_notices (user_id)",
+    "CREATE INDEX idx_hold_notices_ready ON hold_notices (ready_until)",
+)
+
+# The last reminder sent for each copy on loan: 0 none, 1 "due soon", 2
+# "overdue", so a reminder goes out once however many processes send them.
+REMINDER_STAGES = "ALTER TABLE loan_due ADD COLUMN reminded INTEGER NOT NULL DEFAULT 0"
+
+# Closed ledger entries past the archive horizon live in a second file, attached
+# to every connection as `archive` (see ledger_archive.py). Rows keep the id
+# they had in the hot ledger. archive_state has a single row: the horizon, the
+# cutoff of the latest roll-over, before which entries may be in either file;
+# and the id range of the batch last copied, so an interrupted roll-over can
+# finish removing it from the hot ledger.
+ARCHIVE_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS archive.borrowed_books (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        book_id INTEGER,
+        borrow_return TEXT,
+        date_time TEXT
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS archive.idx_borrowed_user ON borrowed_books (user_id, book_id, borrow_return, date_time)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_borrowed_book ON borrowed_books (book_id, date_time, user_id, borrow_return)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_borrowed_time ON borrowed_books (date_time)",
+    '''
+    CREATE TABLE IF NOT EXISTS archive.archive_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        horizon TEXT,
+        batch_from INTEGER,
+        batch_to INTEGER
+    )
+    ''',
+    "INSERT OR IGNORE INTO archive.archive_state (id) VALUES (1)",
+)
+
+# The whole ledger, hot and archived. A view kept in one file cannot name
+# tables in another, so each connection creates it as a temporary view.
+LEDGER_VIEW = '''
+CREATE TEMP VIEW IF NOT EXISTS ledger AS
+SELECT id, user_id, book_id, borrow_return, date_time FROM main.borrowed_books
+UNION ALL
+SELECT id, user_id, book_id, borrow_return, date_time FROM archive.borrowed_books
+'''
+
+
+def _exists(conn, kind, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?", (kind, name)).fetchone() is not None
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def rebuild_table(conn, table, create_sql, columns, select, batch_size=BATCH_SIZE, finish=()):
+    """Rebuilds `table` under a new definition while the library stays in use.
+
+    create_sql creates the new layout under the name given as {name};
+    `columns` are its columns and `select` the expressions that fill them from
+    a row of the old table. The rows present at the start are copied in
+    batches of batch_size, each in a short transaction of its own, while
+    triggers mirror every insert, update and delete made in the meantime. The copied position is recorded, so an
+    interrupted rebuild carries on where it stopped. Finally the tables are
+    swapped in one transaction, which recreates the old table's indexes and
+    triggers and runs the `finish` statements.
+    """
+    shadow = f"{table}_rebuild"
+    copy = f"INSERT OR REPLACE INTO {shadow} ({', '.join(columns)}) SELECT {select} FROM {table}"
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS rebuild_progress "
+                     "(name TEXT PRIMARY KEY, last_id INTEGER NOT NULL, end_id INTEGER NOT NULL)")
+        if not _exists(conn, "table", shadow):
+            conn.execute(create_sql.format(name=shadow))
+            conn.execute(f"INSERT OR REPLACE INTO rebuild_progress (name, last_id, end_id) "
+                         f"SELECT ?, 0, IFNULL(MAX(id), 0) FROM {table}", (shadow,))
+            conn.execute(f"CREATE TRIGGER {shadow}_insert AFTER INSERT ON {table} BEGIN {copy} WHERE id = new.id; END")
+            conn.execute(f"CREATE TRIGGER {shadow}_update AFTER UPDATE ON {table} BEGIN {copy} WHERE id = new.id; END")
+            conn.execute(f"CREATE TRIGGER {shadow}_delete AFTER DELETE ON {table} BEGIN "
+                         f"DELETE FROM {shadow} WHERE id = old.id; END")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            last_id, end_id = conn.execute("SELECT last_id, end_id FROM rebuild_progress WHERE name = ?",
+                                           (shadow,)).fetchone()
+            # Rows added after the rebuild began are already mirrored by the insert trigger
+            (end,) = conn.execute(f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > ? AND id <= ? "
+                                  f"ORDER BY id LIMIT ?)", (last_id, end_id, batch_size)).fetchone()
+            if end is not None:
+                conn.execute(f"{copy} WHERE id > ? AND id <= ?", (last_id, end))
+                conn.execute("UPDATE rebuild_progress SET last_id = ? WHERE name = ?", (end, shadow))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if end is None:
+            break
+        time.sleep(BATCH_PAUSE)
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # The old table's indexes and triggers are dropped with it; recreate all but the mirror triggers
+        keep = [sql for (sql,) in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL "
+            "AND name NOT LIKE ?", (table, shadow + "%"))]
+        sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        # Other tables' triggers name the table, not the shadow, so the rename must not rewrite them
+        conn.execute("PRAGMA legacy_alter_table = ON")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {shadow} RENAME TO {table}")
+        for sql in keep:
+            conn.execute(sql)
+        if sequence is not None:
+            conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequence[0], table))
+        conn.execute("DELETE FROM rebuild_progress WHERE name = ?", (shadow,))
+        for statement in finish:
+            conn.execute(statement)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA legacy_alter_table = OFF")
+
+
+def _base_tables(conn):
+    for ddl in SCHEMA:
+        conn.execute(ddl)
+
+
+def _open_loans(conn):
+    if not _exists(conn, "table", "open_loans"):
+        conn.execute(OPEN_LOANS_SCHEMA)
+        conn.execute(OPEN_LOANS_BACKFILL)
+
+
+def _search_index(conn):
+    if not _exists(conn, "table", "book_fts"):
+        for ddl in SEARCH_SCHEMA:
+            conn.execute(ddl)
+
+
+def _statistics(conn):
+    if not _exists(conn, "trigger", "borrow_stats_insert"):
+        for statement in STATS_SCHEMA + STATS_REBUILD:
+            conn.execute(statement)
+
+
+def _ledger_indexes(conn):
+    if not _exists(conn, "index", "idx_borrowed_book"):
+        for ddl in LEDGER_INDEXES:
+            conn.execute(ddl)
+        conn.execute("ANALYZE borrowed_books")
+
+
+def _due_dates(conn):
+    for ddl in DUE_DATES_SCHEMA:
+        conn.execute(ddl)
+    conn.execute(DUE_DATES_BACKFILL, (BACKFILL_LOAN_DAYS,))
+
+
+def _holds(conn):
+    for ddl in HOLDS_SCHEMA:
+        conn.execute(ddl)
+
+
+def _copies(conn):
+    for statement in COPY_SCHEMA + COPY_BACKFILL:
+        conn.execute(statement)
+
+
+def _soft_delete(conn):
+    for statement in SOFT_DELETE_SCHEMA:
+        conn.execute(statement)
+
+
+def _ledger_time_index(conn):
+    conn.execute(LEDGER_TIME_INDEX)
+
+
+def _hold_notices(conn):
+    for ddl in HOLD_NOTICES_SCHEMA:
+        conn.execute(ddl)
+
+
+def _reminder_stages(conn):
+    conn.execute(REMINDER_STAGES)
+
+
+def prepare_archive(conn):
+    """Creates the archive's tables in the file attached as `archive`, unless they are there already."""
+    if conn.execute("SELECT 1 FROM archive.sqlite_master WHERE name = 'archive_state'").fetchone() is not None:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for ddl in ARCHIVE_SCHEMA:
+            conn.execute(ddl)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _book_not_null(conn, version):
+    # Databases created by the first versions of the scripts have no NOT NULL on book
+    nullable = [row[1] for row in conn.execute("PRAGMA table_info(book)") if not row[3] and not row[5]]
+    if not nullable:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        return
+    columns = ("id", "title", "author", "price", "available_copies", "category", "publisher")
+    select = ", ".join(f"COALESCE({name}, {0 if name in ('price', 'available_copies') else repr('')})"
+                       if name in nullable else name for name in columns)
+    create = SCHEMA[1].replace("IF NOT EXISTS book", "{name}")
+    rebuild_table(conn, "book", create, columns, select, finish=[f"PRAGMA user_version = {version}"])
+
+
+# (version, description, function, online). Each migration runs once, in order,
+# in a transaction that also records its number in PRAGMA user_version. Online
+# migrations run their own transactions and record the number themselves. The
+# early ones check for what they create, since databases from before
+# versioning may have it already.
+MIGRATIONS = (
+    (1, "base tables and book indexes", _base_tables, False),
+    (2, "open loans", _open_loans, False),
+    (3, "full-text search index", _search_index, False),
+    (4, "circulation statistics", _statistics, False),
+    (5, "covering indexes on the ledger", _ledger_indexes, False),
+    (6, "NOT NULL book columns", _book_not_null, True),
+    (7, "due dates and fines", _due_dates, False),
+    (8, "hold queues", _holds, False),
+    (9, "copy-level inventory", _copies, False),
+    (10, "soft delete for books", _soft_delete, False),
+    (11, "time index on the ledger", _ledger_time_index, False),
+    (12, "hold notices", _hold_notices, False),
+    (13, "reminder stages", _reminder_stages, False),
+)
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(conn):
+    """Applies every pending migration and returns their (version, description) pairs.
+
+    When the database is already current this reads user_version and runs no
+    DDL at all. Each step re-checks the version once it holds the write lock,
+    so two processes starting together never apply one twice.
+    """
+    if current_version(conn) >= LATEST_VERSION:
+        return []
+    applied = []
+    for version, description, apply, online in MIGRATIONS:
+        if current_version(conn) >= version:
+            continue
+        if online:
+            apply(conn, version)
+        else:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if current_version(conn) < version:
+                    apply(conn)
+                    conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        applied.append((version, description))
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or apply the database schema migrations.")
+    parser.add_argument("action", nargs="?", choices=("status", "migrate"), default="status")
+    parser.add_argument("--db", default="OmDayalLibrary1.db", help="database file")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=5)
+    version = current_version(conn)
+    if args.action == "status":
+        print(f"Schema version {version} of {LATEST_VERSION}.")
+        for number, description, _, _ in MIGRATIONS:
+            if number > version:
+                print(f"  pending {number}: {description}")
+    else:
+        for number, description in migrate(conn):
+            print(f"Applied {number}: {description}")
+        print(f"Schema version {current_version(conn)}.")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import ast
+import os
+import sys
+
+import library_store
+
+# Queries that read the whole table on purpose; the nightly fines pass clears every member's fine
+FULL_SCANS = {"all_books", "shelf_mismatches", "due_dates.recompute_fines#1"}
+
+# Modules whose transactions run SQL written out inline rather than by name
+INLINE_MODULES = ("circulation.py", "holds.py", "inventory.py", "due_dates.py")
+
+
+def plan(conn, sql):
+    """Returns the EXPLAIN QUERY PLAN detail lines for sql, with every parameter bound to NULL."""
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, (None,) * sql.count("?"))]
+
+
+def is_table_scan(detail, tables):
+    """True for a plan step that walks one of `tables` row by row rather than through an index.
+
+    A table in an attached file, such as the archived ledger, counts under its own name.
+    """
+    words = detail.split()
+    return len(words) > 1 and words[0] == "SCAN" and words[1].split(".")[-1] in tables and "USING" not in detail \
+        and "VIRTUAL TABLE" not in detail
+
+
+def _sql_text(node):
+    """The SQL of a string or f-string argument, with each interpolated IN list as one '?'."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        return "".join(part.value if isinstance(part, ast.Constant) else "?" for part in node.values)
+    return None
+
+
+def _functions(tree):
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef):
+            yield node.name, node
+        elif isinstance(node, ast.ClassDef):
+            for method in node.body:
+                if isinstance(method, ast.FunctionDef):
+                    yield f"{node.name}.{method.name}", method
+
+
+def inline_queries(modules=INLINE_MODULES):
+    """Returns the statements passed to execute or executemany in modules.
+
+    Each is named after its module and top-level function or method and its
+    place there, e.g. "circulation.borrow_command#2", so names survive edits
+    elsewhere in the file.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    queries = {}
+    for module in modules:
+        with open(os.path.join(here, module), encoding="utf-8") as f:
+            tree = ast.parse(f.read(), module)
+        for function, node in _functions(tree):
+            calls = sorted((call for call in ast.walk(node) if isinstance(call, ast.Call)
+                            and isinstance(call.func, ast.Attribute)
+                            and call.func.attr in ("execute", "executemany") and call.args),
+                           key=lambda call: (call.lineno, call.col_offset))
+            statements = [sql for sql in map(_sql_text, (call.args[0] for call in calls))
+                          if sql and sql.split()[0].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE")]
+            for number, sql in enumerate(statements, 1):
+                queries[f"{module[:-3]}.{function}#{number}"] = sql
+    return queries
+
+
+def all_queries():
+    """The named queries and the inline ones together."""
+    return {**library_store.QUERIES, **inline_queries()}
+
+
+def audit(conn, queries=None):
+    """Returns (name, plan step) for every query, named or inline, whose plan scans a table."""
+    queries = all_queries() if queries is None else queries
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    problems = []
+    for name, sql in queries.items():
+        if name in FULL_SCANS:
+            continue
+        for detail in plan(conn, sql):
+            if is_table_scan(detail, tables):
+                problems.append((name, detail))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if a named query would scan a table instead of using an index.")
+    parser.add_argument("--db", default=library_store.DB_PATH, help="database file")
+    parser.add_argument("--verbose", action="store_true", help="print every query's plan")
+    args = parser.parse_args()
+
+    library_store.configure(args.db)
+    conn = library_store.connection()
+    queries = all_queries()
+    if args.verbose:
+        for name, sql in queries.items():
+            print(name)
+            for detail in plan(conn, sql):
+                print("   ", detail)
+    problems = audit(conn, queries)
+    for name, detail in problems:
+        print(f"{name}: {detail}")
+    library_store.close()
+    if problems:
+        sys.exit(1)
+    print(f"All {len(queries) - len(FULL_SCANS)} queries use an index.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+
+import library_store
+
+MAX_SESSIONS = 1024
+TTL = 300  # seconds before a session is re-read from the database
+LOAN_LIMIT = None  # copies a user may hold at once; None leaves it unlimited, as it always was
+
+
+class LoanLimitReached(Exception):
+    """Raised when a user already holds LOAN_LIMIT copies."""
+
+
+def configure(loan_limit=LOAN_LIMIT):
+    """Sets how many copies a user may hold at once, or None for no limit.
+
+    Users already holding more keep their loans and can return them; they just
+    cannot borrow again until they are back under the limit.
+    """
+    global LOAN_LIMIT
+    LOAN_LIMIT = loan_limit
+
+
+class Session:
+    """What the desk needs to know about a logged-in user."""
+
+    def __init__(self, user_id, username, loans):
+        self.user_id = user_id
+        self.username = username
+        self.loans = loans  # book id -> copies held
+        self.expires = time.monotonic() + TTL
+
+    @property
+    def loan_count(self):
+        return sum(self.loans.values())
+
+    @property
+    def remaining(self):
+        if LOAN_LIMIT is None:
+            return None
+        return LOAN_LIMIT - self.loan_count
+
+    def holds(self, book_id):
+        return self.loans.get(book_id, 0) > 0
+
+
+class SessionCache:
+    """User sessions keyed by user id, with LRU eviction and TTL expiry."""
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        """Returns the user's session, loading it on a miss. Returns None for an unknown user."""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None and session.expires > time.monotonic():
+                self._sessions.move_to_end(user_id)
+                self.hits += 1
+                return session
+            self.misses += 1
+
+        session = self._load(user_id)
+        if session is not None:
+            with self._lock:
+                self._sessions[user_id] = session
+                self._sessions.move_to_end(user_id)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evictions += 1
+        return session
+
+    def _load(self, user_id):
+        profile = library_store.execute("user_profile", (user_id,)).fetchone()
+        if profile is None:
+            return None
+        loans = dict(library_store.execute("user_open_loans", (user_id,)))
+        return Session(profile[0], profile[1], loans)
+
+    def loan_changed(self, user_id, book_id, delta):
+        """Applies a committed borrow (+1) or return (-1) to a cached session."""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return
+            copies = session.loans.get(book_id, 0) + delta
+            if copies < 0:
+                # The cache was out of step with the database; drop it and reload next time
+                del self._sessions[user_id]
+            elif copies == 0:
+                session.loans.pop(book_id, None)
+            else:
+                session.loans[book_id] = copies
+
+    def invalidate(self, user_id):
+        """Forgets a user's session, e.g. on logout."""
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self):
+        """Returns hit/miss/eviction counters and the current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "sessions": len(self._sessions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+sessions = SessionCache()
+
+
+def check_loan_limit(user_id, copies=1):
+    """Raises LoanLimitReached if the user cannot take out `copies` more copies.
+
+    This only turns a request away early from the cached session; the borrow
+    commands count again under the write lock.
+    """
+    if LOAN_LIMIT is None:
+        return
+    session = sessions.get(user_id)
+    if session is not None and session.remaining < copies:
+        raise LoanLimitReached(f"You already have {session.loan_count} books on loan (limit {LOAN_LIMIT}).")
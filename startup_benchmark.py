@@ -0,0 +1,113 @@
+import argparse
+import importlib.util
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+ENTRY_POINTS = ("GUI.py", "Updated Here.py")
+RUNS = 5
+READY_TIMEOUT = 60  # seconds to wait for the background database open
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+def probe(path, db):
+    """Starts one entry point in this process and returns its startup timings in milliseconds.
+
+    import_ms covers loading the module and everything it imports;
+    first_paint_ms runs from there until the main screen is visible, and
+    database_ms until the background open and check of the database is done.
+    open_task_p50_ms and ui_lag_max_ms come from the app's TaskRunner
+    latency report.
+    """
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location("entry_point", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    imported = time.perf_counter()
+
+    module.library_store.configure(db)
+    try:
+        root = module.tk.Tk()
+    except module.tk.TclError as e:
+        return {"error": f"no display: {e}"}
+    app = module.LibraryApp(root)
+    root.wait_visibility()
+    root.update_idletasks()
+    painted = time.perf_counter()
+
+    while not app.database_ready and time.perf_counter() - painted < READY_TIMEOUT:
+        root.update()
+        time.sleep(0.001)
+    ready = time.perf_counter()
+
+    # The first visit builds a screen; later ones only raise the cached frame
+    switch = time.perf_counter()
+    app.library_screen()
+    root.update_idletasks()
+    first_switch = time.perf_counter() - switch
+    app.main_screen()
+    root.update_idletasks()
+    switch = time.perf_counter()
+    app.library_screen()
+    root.update_idletasks()
+    cached_switch = time.perf_counter() - switch
+
+    latency = app.tasks.latency_report()
+    app.tasks.shutdown()
+    root.destroy()
+    module.write_queue.close()
+    module.library_store.close()
+    return {
+        "import_ms": _ms(imported - started),
+        "first_paint_ms": _ms(painted - imported),
+        "database_ms": _ms(ready - painted) if app.database_ready else None,
+        "first_switch_ms": _ms(first_switch),
+        "cached_switch_ms": _ms(cached_switch),
+        "open_task_p50_ms": latency.get("open_database", {}).get("p50_ms"),
+        "ui_lag_max_ms": latency.get("ui_lag", {}).get("max_ms"),
+    }
+
+
+def measure(path, db, runs=RUNS):
+    """Starts `path` in `runs` fresh interpreters and returns the median of each timing."""
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, __file__, "--probe", path, "--db", db],
+                                capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "probe failed"}
+        timings = json.loads(result.stdout)
+        if "error" in timings:
+            return timings
+        timings["process_ms"] = _ms(elapsed)
+        samples.append(timings)
+    report = {"runs": runs}
+    for name in samples[0]:
+        values = [sample[name] for sample in samples if sample[name] is not None]
+        report[name] = round(statistics.median(values), 2) if values else None
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time how quickly the GUI entry points import and first paint.")
+    parser.add_argument("--db", default="OmDayalLibrary1.db", help="database file")
+    parser.add_argument("--runs", type=int, default=RUNS, help="fresh starts per entry point")
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        print(json.dumps(probe(args.probe, args.db)))
+        return
+    report = {path: measure(path, args.db, args.runs) for path in ENTRY_POINTS}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
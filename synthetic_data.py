@@ -0,0 +1,167 @@
+import argparse
+import heapq
+import itertools
+import os
+import random
+import time
+from array import array
+from datetime import datetime, timedelta
+
+import credentials
+import library_store
+import migrations
+
+# Ledger rows per preset; books and users scale with it
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+CATEGORIES = 40
+PUBLISHERS = 2_000
+BATCH_SIZE = 50_000
+HISTORY_DAYS = 730
+HISTORY_END = datetime(2026, 1, 1)  # fixed so the same seed always gives the same file
+STILL_OUT = 0.05  # share of loans that are never returned
+
+
+def zipf_weights(n, skew=1.1):
+    """Cumulative weights giving item i a share proportional to 1 / (i + 1) ** skew."""
+    return list(itertools.accumulate(1 / (i + 1) ** skew for i in range(n)))
+
+
+def scale(size):
+    """Returns (books, users, ledger rows) for a preset name or a plain row count."""
+    rows = SIZES.get(str(size).lower()) or int(size)
+    return max(1_000, rows // 10), max(200, rows // 20), rows
+
+
+def _words(rng, count):
+    syllables = ["ka", "lo", "mi", "ra", "ten", "vo", "shi", "an", "dur", "el", "po", "qu", "sa", "tor", "ni", "be"]
+    return ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize() for _ in range(count)]
+
+
+def _batched(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(path, size="10k", seed=42):
+    """Builds a library database at path with skewed popularity and a long loan history.
+
+    Book popularity, categories and publishers follow Zipf-like distributions.
+    The ledger is written in time order: every loan is a 'B' row followed by an
+    'R' row a few days to weeks later, except for a small share still out.
+    Derived tables (open loans, counters, search index) are rebuilt at the end.
+    """
+    rng = random.Random(seed)
+    books, users, ledger_rows = scale(size)
+    for old in (path, library_store.archive_path(path)):
+        if os.path.exists(old):
+            os.remove(old)
+
+    library_store.configure(path)
+    conn = library_store.connection()
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("BEGIN")
+
+    # Per-row triggers would dominate the load; derived tables are rebuilt at the end
+    saved_triggers = [sql for (sql,) in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger'")]
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+
+    words = _words(rng, 5_000)
+    word_weights = zipf_weights(len(words), 0.9)
+    categories = _words(rng, CATEGORIES)
+    category_weights = zipf_weights(CATEGORIES, 1.0)
+    publishers = [name + " Press" for name in _words(rng, PUBLISHERS)]
+    publisher_weights = zipf_weights(PUBLISHERS, 1.2)
+    authors = [f"{first} {last}" for first, last in zip(_words(rng, books // 5 + 1), _words(rng, books // 5 + 1))]
+
+    copies = array("i", (rng.randint(1, 8) for _ in range(books)))
+    book_rows = ((
+        " ".join(rng.choices(words, cum_weights=word_weights, k=rng.randint(1, 5))),
+        rng.choice(authors),
+        round(rng.uniform(50, 2_000), 2),
+        copies[i],
+        rng.choices(categories, cum_weights=category_weights)[0],
+        rng.choices(publishers, cum_weights=publisher_weights)[0],
+    ) for i in range(books))
+    for batch in _batched(book_rows):
+        conn.executemany(library_store.QUERIES["add_book"], batch)
+
+    password = credentials.hash_password("password")
+    for batch in _batched((f"user{i}", password) for i in range(1, users + 1)):
+        conn.executemany(library_store.QUERIES["register_user"], batch)
+
+    conn.executemany("INSERT INTO borrowed_books (user_id, book_id, borrow_return, date_time) VALUES (?, ?, ?, ?)",
+                     _ledger(rng, books, users, ledger_rows, copies))
+
+    # available_copies must agree with the loans left open
+    conn.execute("DELETE FROM open_loans")
+    conn.execute(migrations.OPEN_LOANS_BACKFILL)
+    conn.execute("UPDATE book SET available_copies = available_copies - "
+                 "(SELECT SUM(copies) FROM open_loans WHERE open_loans.book_id = book.id) "
+                 "WHERE id IN (SELECT book_id FROM open_loans)")
+    conn.execute("DELETE FROM loan_due")
+    conn.execute(migrations.DUE_DATES_BACKFILL, (migrations.BACKFILL_LOAN_DAYS,))
+    for statement in migrations.COPY_BACKFILL:
+        conn.execute(statement)
+    for sql in saved_triggers:
+        conn.execute(sql)
+    for statement in migrations.STATS_REBUILD:
+        conn.execute(statement)
+    conn.execute("INSERT INTO book_fts (book_fts) VALUES ('rebuild')")
+    conn.commit()
+    conn.execute("PRAGMA synchronous = NORMAL")
+    library_store.close()
+    return {"books": books, "users": users, "ledger_rows": ledger_rows}
+
+
+def _ledger(rng, books, users, ledger_rows, copies):
+    """Yields ledger rows in time order, never lending more copies of a book than exist."""
+    book_weights = zipf_weights(books, 1.05)
+    user_weights = zipf_weights(users, 0.8)
+    available = array("i", copies)
+    start = HISTORY_END - timedelta(days=HISTORY_DAYS)
+    step = timedelta(days=HISTORY_DAYS) / max(1, ledger_rows // 2)
+    due = []  # (return time, user id, book id)
+    now = start
+    written = 0
+    while written < ledger_rows:
+        now += step
+        while due and due[0][0] <= now and written < ledger_rows:
+            returned_at, user_id, book_id = heapq.heappop(due)
+            available[book_id - 1] += 1
+            yield user_id, book_id, 'R', returned_at.strftime("%Y-%m-%d %H:%M:%S")
+            written += 1
+        if written >= ledger_rows:
+            break
+        book_id = rng.choices(range(1, books + 1), cum_weights=book_weights)[0]
+        if available[book_id - 1] == 0:
+            continue
+        user_id = rng.choices(range(1, users + 1), cum_weights=user_weights)[0]
+        available[book_id - 1] -= 1
+        yield user_id, book_id, 'B', now.strftime("%Y-%m-%d %H:%M:%S")
+        written += 1
+        if rng.random() > STILL_OUT:
+            heapq.heappush(due, (now + timedelta(days=rng.uniform(3, 45)), user_id, book_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic library database.")
+    parser.add_argument("path", help="database file to create (overwritten)")
+    parser.add_argument("--size", default="10k", help="10k, 1m, 10m or a ledger row count")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = generate(args.path, args.size, args.seed)
+    print(f"Generated {counts['books']} books, {counts['users']} users and {counts['ledger_rows']} ledger rows "
+          f"in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import queue
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import messagebox
+
+import library_store
+
+WORKERS = 4
+POLL_MS = 25  # how often the Tk thread drains finished tasks
+SAMPLES = 500  # latency samples kept per operation
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class TaskRunner:
+    """Runs database work on a thread pool and hands the results back on the Tk thread.
+
+    Worker threads never touch widgets: they put (callback, result) pairs on a
+    queue which the Tk thread drains every POLL_MS milliseconds with root.after.
+    """
+
+    def __init__(self, root, workers=WORKERS, poll_ms=POLL_MS, on_busy=None):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.on_busy = on_busy  # called with True/False when work starts/finishes
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="library-db")
+        self._done = queue.Queue()
+        self._latency = defaultdict(lambda: deque(maxlen=SAMPLES))  # operation -> seconds
+        self._ui_lag = deque(maxlen=SAMPLES)  # how late each poll ran, in seconds
+        self._next_poll = time.perf_counter() + poll_ms / 1000
+        self._after_id = root.after(poll_ms, self._poll)
+
+    def submit(self, name, work, *args, on_done=None, on_error=None):
+        """Runs work(*args) on a worker; on_done(result) or on_error(exc) runs later on the Tk thread."""
+        started = time.perf_counter()
+        self.pending += 1
+        if self.pending == 1 and self.on_busy:
+            self.on_busy(True)
+
+        def job():
+            try:
+                result = work(*args)
+            except Exception as e:
+                self._done.put((name, started, on_error, e, True))
+            else:
+                self._done.put((name, started, on_done, result, False))
+            finally:
+                # Never leave a half-done transaction on this worker's connection
+                library_store.rollback()
+
+        self._executor.submit(job)
+
+    def _poll(self):
+        now = time.perf_counter()
+        self._ui_lag.append(max(0.0, now - self._next_poll))
+        while True:
+            try:
+                name, started, callback, value, failed = self._done.get_nowait()
+            except queue.Empty:
+                break
+            self._latency[name].append(time.perf_counter() - started)
+            self.pending -= 1
+            if self.pending == 0 and self.on_busy:
+                self.on_busy(False)
+            if callback:
+                callback(value)
+            elif failed:
+                self.report_error(value)
+        self._next_poll = time.perf_counter() + self.poll_ms / 1000
+        self._after_id = self.root.after(self.poll_ms, self._poll)
+
+    def report_error(self, error):
+        """Default error handler for tasks submitted without on_error."""
+        messagebox.showerror("Error", str(error))
+
+    def latency_report(self):
+        """Returns p50/p95/max latency in milliseconds per operation, plus Tk event-loop lag."""
+        report = {}
+        series = dict(self._latency)
+        series["ui_lag"] = self._ui_lag
+        for name, samples in series.items():
+            if not samples:
+                continue
+            report[name] = {
+                "count": len(samples),
+                "p50_ms": round(_percentile(samples, 0.50) * 1000, 2),
+                "p95_ms": round(_percentile(samples, 0.95) * 1000, 2),
+                "max_ms": round(max(samples) * 1000, 2),
+            }
+        return report
+
+    def shutdown(self):
+        """Stops polling and waits for running tasks to finish."""
+        self.root.after_cancel(self._after_id)
+        self._executor.shutdown(wait=True)
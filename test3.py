@@ -1,48 +1,13 @@
 import sqlite3
-from datetime import datetime
-import hashlib
-
-# Connect to the SQLite database
-conn = sqlite3.connect('OmDayalLibrary1.db')
-cursor = conn.cursor()
-
-# Create necessary tables if they don't exist
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL
-)
-''')
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS book (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    title TEXT,
-    author TEXT,
-    price REAL,
-    available_copies INTEGER,
-    category TEXT,
-    publisher TEXT
-)
-''')
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS borrowed_books (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    book_id INTEGER,
-    borrow_return TEXT,
-    date_time TEXT,
-    FOREIGN KEY (user_id) REFERENCES users(id),
-    FOREIGN KEY (book_id) REFERENCES book(id)
-)
-''')
-conn.commit()
-
-def hash_password(password):
-    """Hashes a password using SHA-256."""
-    return hashlib.sha256(password.encode()).hexdigest()
+
+import book_search
+import catalog_cache
+import circulation
+import credentials
+import holds
+import library_store
+import session_cache
+import write_queue
 
 def register():
     """Register a new user."""
@@ -54,11 +19,8 @@ def register():
         print("Passwords do not match!")
         return False
     
-    hashed_password = hash_password(password)
-
     try:
-        cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_password))
-        conn.commit()
+        credentials.register(username, password)
         print("Registration successful!")
         return True
     except sqlite3.IntegrityError:
@@ -69,121 +31,225 @@ def login():
     """Login an existing user."""
     username = input("Enter your username: ")
     password = input("Enter your password: ")
-    hashed_password = hash_password(password)
-
-    cursor.execute("SELECT id FROM users WHERE username = ? AND password = ?", (username, hashed_password))
-    user = cursor.fetchone()
-    if user:
+    user_id = credentials.authenticate(username, password)
+    if user_id:
         print("Login successful!")
-        return user[0]  # Return user ID
+        for _, title, ready_until in write_queue.run(holds.take_notices_command(user_id)):
+            print(holds.notice_text(title, ready_until))
+        return user_id
     else:
         print("Invalid username or password.")
         return None
 
+def suggest_book(identifier):
+    """Lists the closest matches for an identifier that found nothing and returns the chosen book id."""
+    books = book_search.search_books(identifier)
+    if not books:
+        return None
+    print("No exact match. Did you mean:")
+    for number, book in enumerate(books, 1):
+        print(f"{number}. {book[1]} by {book[2]} (ID {book[0]})")
+    choice = input("Enter a number, or press Enter to cancel: ")
+    if choice.isdigit() and 1 <= int(choice) <= len(books):
+        return books[int(choice) - 1][0]
+    return None
+
 def borrow_book(user_id, identifier, search_by):
     """Borrow a book."""
+    try:
+        session_cache.check_loan_limit(user_id)
+    except session_cache.LoanLimitReached as e:
+        print(e)
+        return
     # Fetch book details based on the search type
     if search_by == "title":
-        cursor.execute("SELECT id, title, available_copies, price FROM book WHERE title = ?", (identifier,))
+        cursor = catalog_cache.execute("borrow_by_title", (identifier,))
     elif search_by == "category":
-        cursor.execute("SELECT id, title, available_copies, price FROM book WHERE category = ? AND available_copies > 0 LIMIT 1", (identifier,))
+        cursor = catalog_cache.execute("borrow_by_category", (identifier,))
     elif search_by == "publisher":
-        cursor.execute("SELECT id, title, available_copies, price FROM book WHERE publisher = ? AND available_copies > 0 LIMIT 1", (identifier,))
+        cursor = catalog_cache.execute("borrow_by_publisher", (identifier,))
     else:
-        cursor.execute("SELECT id, title, available_copies, price FROM book WHERE id = ?", (identifier,))
+        cursor = catalog_cache.execute("borrow_by_id", (identifier,))
     
     result = cursor.fetchone()
-    if result and result[2] > 0:
+    if result is None:
+        book_id = suggest_book(identifier)
+        if book_id is not None:
+            return borrow_book(user_id, book_id, "id")
+    else:
         book_id, title, available_copies, price = result
-        # Update available_copies (decrease by 1)
-        cursor.execute("UPDATE book SET available_copies = available_copies - 1 WHERE id = ?", (book_id,))
-        # Insert into borrowed_books table with 'B' for borrow
-        borrow_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute("INSERT INTO borrowed_books (user_id, book_id, borrow_return, date_time) VALUES (?, ?, ?, ?)", 
-                       (user_id, book_id, 'B', borrow_date))
-        conn.commit()
-        print(f"Book borrowed successfully! You borrowed '{title}'. Cost: Rs. {price}.")
+        # Decrease available_copies (or take the copy kept for a hold) and record the loan in one transaction
+        try:
+            borrowed = write_queue.run(circulation.borrow_command(user_id, book_id))
+        except (circulation.DatabaseBusyError, session_cache.LoanLimitReached) as e:
+            print(e)
+            return
+        if borrowed:
+            print(f"Book borrowed successfully! You borrowed '{title}'. Cost: Rs. {price}.")
+            return
+        if input(f"No copy of '{title}' is on the shelf. Place a hold? (y/n): ").strip().lower() == "y":
+            place_hold(user_id, book_id)
+            return
+    print("Book is not available or does not exist.")
+
+def place_hold(user_id, book_id):
+    """Join a book's hold queue."""
+    try:
+        ticket = write_queue.run(holds.place_hold_command(user_id, book_id))
+    except circulation.DatabaseBusyError as e:
+        print(e)
+        return
+    if ticket is None:
+        print("A copy is back on the shelf, so you can borrow it now.")
+        return
+    place, waiting = holds.position(user_id, book_id)
+    if place == 0:
+        print("A copy is already being kept for you.")
+    else:
+        print(f"Hold placed. You are number {place} of {waiting} in the queue.")
+
+def cancel_hold(user_id, identifier):
+    """Leave a book's hold queue."""
+    books = circulation.lookup_books(library_store.connection(), [identifier])
+    if not books:
+        print("Book not found.")
+        return
+    book_id, title = books[identifier]
+    try:
+        cancelled = write_queue.run(holds.cancel_hold_command(user_id, book_id))
+    except circulation.DatabaseBusyError as e:
+        print(e)
+        return
+    if cancelled:
+        print(f"Your hold on '{title}' is cancelled.")
     else:
-        print("Book is not available or does not exist.")
+        print(f"You have no hold on '{title}'.")
 
 def return_book(user_id, identifier, search_by):
     """Return a book."""
     # Fetch book details based on the search type
     if search_by == "title":
-        cursor.execute("SELECT id, title FROM book WHERE title = ?", (identifier,))
+        cursor = catalog_cache.execute("book_by_title", (identifier,))
     elif search_by == "category":
-        cursor.execute("SELECT id, title FROM book WHERE category = ?", (identifier,))
+        cursor = catalog_cache.execute("book_by_category", (identifier,))
     elif search_by == "publisher":
-        cursor.execute("SELECT id, title FROM book WHERE publisher = ?", (identifier,))
+        cursor = catalog_cache.execute("book_by_publisher", (identifier,))
     else:
-        cursor.execute("SELECT id, title FROM book WHERE id = ?", (identifier,))
+        cursor = catalog_cache.execute("book_by_id", (identifier,))
     
     book_result = cursor.fetchone()
     if book_result:
         book_id, title = book_result
-        # Check if the user has borrowed this book
-        cursor.execute("SELECT id FROM borrowed_books WHERE user_id = ? AND book_id = ? AND borrow_return = 'B'", (user_id, book_id))
-        borrow_record = cursor.fetchone()
-        if borrow_record:
-            # Update available_copies (increase by 1)
-            cursor.execute("UPDATE book SET available_copies = available_copies + 1 WHERE id = ?", (book_id,))
-            # Update borrow_return to 'R' and set the return date
-            return_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cursor.execute("INSERT INTO borrowed_books (user_id, book_id, borrow_return, date_time) VALUES (?, ?, ?, ?)", 
-                           (user_id, book_id, 'R', return_date))
-            conn.commit()
+        # Close the user's open loan and increase available_copies in one transaction
+        try:
+            returned = write_queue.run(circulation.return_command(user_id, book_id))
+        except circulation.DatabaseBusyError as e:
+            print(e)
+            return
+        if returned:
             print(f"Book returned successfully! You returned '{title}'.")
         else:
             print("No record of this book being borrowed by you.")
     else:
+        book_id = suggest_book(identifier)
+        if book_id is not None:
+            return return_book(user_id, book_id, "id")
         print("Book does not exist.")
 
+def scan_books():
+    """Reads book IDs or titles, one per line, until an empty line."""
+    print("Scan or type book IDs or titles, one per line. Press Enter on an empty line to finish.")
+    identifiers = []
+    while True:
+        identifier = input("> ").strip()
+        if not identifier:
+            return identifiers
+        identifiers.append(identifier)
+
+def checkout_basket(user_id, action):
+    """Borrow or return several books at once; either all of them go through or none do."""
+    identifiers = scan_books()
+    if not identifiers:
+        return
+    conn = library_store.connection()
+    books = circulation.lookup_books(conn, identifiers)
+    missing = [identifier for identifier in identifiers if identifier not in books]
+    if missing:
+        print("Not found: " + ", ".join(missing) + ". Nothing was " + ("borrowed." if action == "borrow" else "returned."))
+        return
+    book_ids = [books[identifier][0] for identifier in identifiers]
+    titles = {book_id: title for book_id, title in books.values()}
+    try:
+        if action == "borrow":
+            session_cache.check_loan_limit(user_id, len(book_ids))
+            refused = write_queue.run(circulation.borrow_books_command(user_id, book_ids))
+        else:
+            refused = write_queue.run(circulation.return_books_command(user_id, book_ids))
+    except (circulation.DatabaseBusyError, session_cache.LoanLimitReached) as e:
+        print(e)
+        return
+    if refused:
+        names = ", ".join(f"'{titles[book_id]}'" for book_id in refused)
+        if action == "borrow":
+            print(f"Not enough copies available of {names}. Nothing was borrowed.")
+        else:
+            print(f"No record of {names} being borrowed by you. Nothing was returned.")
+    else:
+        print(f"{len(book_ids)} books {'borrowed' if action == 'borrow' else 'returned'} successfully: "
+              + ", ".join(f"'{titles[book_id]}'" for book_id in book_ids))
+
 def display_books():
     """Display all books."""
-    cursor.execute("SELECT * FROM book")
-    books = cursor.fetchall()
+    cursor = library_store.execute("all_books")
     print("Available Books:")
     print("| ID | Title                               | Author                  | Price | Available Copies | Category  | Publisher |")
     print("-" * 100)
-    for book in books:
+    # Print rows as the cursor yields them rather than loading the whole table first
+    for book in cursor:
         print(f"| {book[0]:<2} | {book[1]:<35} | {book[2]:<22} | {book[3]:<5} | {book[4]:<16} | {book[5]:<9} | {book[6]:<9} |")
 
 def add_book():
     """Add a new book to the library."""
     title = input("Enter the title of the book: ")
     author = input("Enter the author's name: ")
-    price = float(input("Enter the price of the book: "))
-    available_copies = int(input("Enter the number of available copies: "))
+    price = input("Enter the price of the book: ")
+    available_copies = input("Enter the number of available copies: ")
     category = input("Enter the book category: ")
     publisher = input("Enter the publisher's name: ")
 
-    cursor.execute(
-        "INSERT INTO book (title, author, price, available_copies, category, publisher) VALUES (?, ?, ?, ?, ?, ?)",
-        (title, author, price, available_copies, category, publisher)
-    )
-    conn.commit()
+    try:
+        book = library_store.validate_book(title, author, price, available_copies, category, publisher)
+    except ValueError as e:
+        print(e)
+        return
+    write_queue.execute("add_book", book)
     print(f"Book '{title}' added successfully!")
 
 def delete_book(identifier, search_by):
     """Delete a book from the library."""
     # Fetch book details based on the search type
     if search_by == "title":
-        cursor.execute("SELECT id, title FROM book WHERE title = ?", (identifier,))
+        cursor = catalog_cache.execute("book_by_title", (identifier,))
     elif search_by == "category":
-        cursor.execute("SELECT id, title FROM book WHERE category = ?", (identifier,))
+        cursor = catalog_cache.execute("book_by_category", (identifier,))
     elif search_by == "publisher":
-        cursor.execute("SELECT id, title FROM book WHERE publisher = ?", (identifier,))
+        cursor = catalog_cache.execute("book_by_publisher", (identifier,))
     else:
-        cursor.execute("SELECT id, title FROM book WHERE id = ?", (identifier,))
+        cursor = catalog_cache.execute("book_by_id", (identifier,))
 
     book_result = cursor.fetchone()
     if book_result:
         book_id, title = book_result
-        # Delete the book from the database
-        cursor.execute("DELETE FROM book WHERE id = ?", (book_id,))
-        conn.commit()
-        print(f"Book '{title}' deleted successfully!")
+        # Delete the book from the database, unless copies of it are still out
+        deleted, _ = write_queue.execute("delete_book", (book_id,))
+        if deleted:
+            print(f"Book '{title}' deleted successfully!")
+        else:
+            print(f"Book '{title}' has copies out on loan or kept for a hold, so it cannot be deleted yet.")
     else:
+        book_id = suggest_book(identifier)
+        if book_id is not None:
+            return delete_book(book_id, "id")
         print("Book not found.")
 
 def main():
@@ -210,7 +276,10 @@ def main():
         print("3. Return a Book")
         print("4. Add a Book")
         print("5. Delete a Book")
-        print("6. Logout")
+        print("6. Borrow Several Books")
+        print("7. Return Several Books")
+        print("8. Cancel a Hold")
+        print("9. Logout")
         choice = input("Enter your choice: ")
         if choice == "1":
             display_books()
@@ -235,7 +304,15 @@ def main():
             search_by = ["id", "title", "category", "publisher"][int(method) - 1]
             delete_book(identifier, search_by)
         elif choice == "6":
+            checkout_basket(user_id, "borrow")
+        elif choice == "7":
+            checkout_basket(user_id, "return")
+        elif choice == "8":
+            identifier = input("Enter the book ID or title: ")
+            cancel_hold(user_id, identifier)
+        elif choice == "9":
             print("Logging out...")
+            session_cache.sessions.invalidate(user_id)
             user_id = None
         else:
             print("Invalid choice. Please try again.")
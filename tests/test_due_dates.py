@@ -0,0 +1,28 @@
+import time
+
+import due_dates
+import library_store
+
+
+def _loans(tmp_path, due):
+    library_store.configure(str(tmp_path / "library.db"))
+    library_store.open_database()
+    conn = library_store.connection()
+    conn.executemany("INSERT INTO loan_due (user_id, book_id, due_at) VALUES (1, ?, ?)", enumerate(due, 1))
+    conn.commit()
+
+
+def test_reminders_are_sent_once_across_loads(tmp_path):
+    now = int(time.time())
+    # Book 1 is due within the lead, book 2 was already overdue when first loaded
+    _loans(tmp_path, [now + 3600, now - 3600])
+    try:
+        first = due_dates.ReminderScheduler()
+        assert sorted(first.pop_reminders(now)) == [("due soon", 1, 1, now + 3600), ("overdue", 1, 2, now - 3600)]
+        # A fresh process loads the same loans and sends nothing again
+        assert due_dates.ReminderScheduler().pop_reminders(now) == []
+        later = now + 7200
+        assert due_dates.ReminderScheduler().pop_reminders(later) == [("overdue", 1, 1, now + 3600)]
+        assert first.pop_reminders(later) == []
+    finally:
+        library_store.close()
@@ -0,0 +1,34 @@
+import sqlite3
+
+import inventory
+import library_store
+
+
+def test_reconcile_reads_the_copy_table(tmp_path):
+    path = str(tmp_path / "library.db")
+    library_store.configure(path)
+    library_store.open_database()
+    conn = library_store.connection()
+    conn.execute("INSERT INTO book (title, author, price, available_copies, category, publisher) "
+                 "VALUES ('Dune', 'Herbert', 1, 2, 'Fiction', 'Press')")
+    conn.commit()
+    try:
+        inventory.availability.reload()
+        # Another process adds a book; this process's bitmaps never hear of it
+        other = sqlite3.connect(path)
+        other.execute("INSERT INTO book (title, author, price, available_copies, category, publisher) "
+                      "VALUES ('Emma', 'Austen', 1, 3, 'Fiction', 'Press')")
+        other.commit()
+        other.close()
+        assert inventory.reconcile() == []
+        assert inventory.reconcile(repair=True) == []
+        assert conn.execute("SELECT available_copies FROM book ORDER BY id").fetchall() == [(2,), (3,)]
+
+        conn.execute("UPDATE book SET available_copies = 5 WHERE id = 1")
+        conn.commit()
+        assert inventory.reconcile() == [(1, 5, 2)]
+        assert inventory.reconcile(repair=True) == [(1, 5, 2)]
+        assert inventory.reconcile() == []
+        assert inventory.availability.on_shelf(2) == 3
+    finally:
+        library_store.close()
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+import circulation
+import library_server
+import library_store
+import session_cache
+import write_queue
+
+
+def _books(tmp_path, count):
+    library_store.configure(str(tmp_path / "library.db"))
+    library_store.open_database()
+    conn = library_store.connection()
+    conn.executemany("INSERT INTO book (title, author, price, available_copies, category, publisher) "
+                     "VALUES (?, 'Author', 1, 1, 'Fiction', 'Press')", [(f"Book {i}",) for i in range(count)])
+    conn.commit()
+
+
+def _get(app, target):
+    return asyncio.run(app.dispatch(library_server.Request("GET", target, {}, b"")))
+
+
+def test_books_limit_must_be_positive(tmp_path):
+    _books(tmp_path, 5)
+    app = library_server.LibraryServer(readers=1)
+    try:
+        for target in ("/books?limit=-1", "/books?limit=0", "/books?q=Book&limit=-1"):
+            status, body = _get(app, target)
+            assert status == 400, target
+        status, body = _get(app, "/books?limit=2")
+        assert status == 200 and len(body["books"]) == 2
+        status, body = _get(app, "/books?q=Book&limit=3")
+        assert status == 200 and len(body["books"]) == 3
+    finally:
+        app.close()
+        library_store.close()
+
+
+def test_book_with_copies_out_cannot_be_deleted(tmp_path):
+    _books(tmp_path, 1)
+    conn = library_store.connection()
+    conn.execute("INSERT INTO users (username, password) VALUES ('reader', 'x')")
+    conn.commit()
+    app = library_server.LibraryServer(readers=1)
+    app.tokens["token"] = 1
+    try:
+        def delete():
+            request = library_server.Request("DELETE", "/books/1", {"authorization": "Bearer token"}, b"")
+            return asyncio.run(app.dispatch(request))[0]
+
+        assert write_queue.run(circulation.borrow_command(1, 1))
+        assert delete() == 409
+        assert write_queue.run(circulation.return_command(1, 1))
+        assert delete() == 200
+        assert delete() == 404
+    finally:
+        app.close()
+        library_store.close()
+
+
+def test_loan_limit_lets_existing_loans_be_returned(tmp_path):
+    _books(tmp_path, 4)
+    conn = library_store.connection()
+    conn.execute("INSERT INTO users (username, password) VALUES ('reader', 'x')")
+    conn.commit()
+    try:
+        # No limit unless one is configured, so loans made before it stay valid
+        for book_id in (1, 2, 3):
+            assert write_queue.run(circulation.borrow_command(1, book_id))
+        session_cache.configure(2)
+        with pytest.raises(session_cache.LoanLimitReached):
+            write_queue.run(circulation.borrow_command(1, 4))
+        assert write_queue.run(circulation.return_command(1, 1))
+        assert write_queue.run(circulation.return_command(1, 2))
+        assert write_queue.run(circulation.borrow_command(1, 4))
+    finally:
+        session_cache.configure()
+        write_queue.close()
+        library_store.close()
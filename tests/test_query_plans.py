@@ -0,0 +1,28 @@
+import library_store
+import query_plans
+
+
+def test_every_query_uses_an_index(tmp_path):
+    library_store.configure(str(tmp_path / "library.db"))
+    try:
+        library_store.open_database()
+        assert query_plans.audit(library_store.connection()) == []
+    finally:
+        library_store.close()
+
+
+def test_inline_queries_are_audited():
+    queries = query_plans.inline_queries()
+    for module in query_plans.INLINE_MODULES:
+        assert any(name.startswith(module[:-3] + ".") for name in queries)
+    assert "UNION ALL" in queries["circulation.lookup_books#1"]
+
+
+def test_audit_reports_a_table_scan(tmp_path):
+    library_store.configure(str(tmp_path / "library.db"))
+    try:
+        library_store.open_database()
+        problems = query_plans.audit(library_store.connection(), {"by_price": "SELECT id FROM book WHERE price = ?"})
+        assert [name for name, _ in problems] == ["by_price"]
+    finally:
+        library_store.close()
@@ -0,0 +1,125 @@
+import argparse
+import time
+
+import catalog_cache
+import library_store
+
+RETENTION_DAYS = 30  # how long a deleted book is kept before it may be purged
+BATCH_SIZE = 500  # tombstones purged per transaction
+BATCH_PAUSE = 0.05  # seconds between batches, so other writers get the lock
+VACUUM_PAGES = 256  # free pages returned to the file system per incremental_vacuum step
+
+# Tombstones that nothing refers to any more: no copy out on loan or kept for
+# a hold, no hold queue, and no ledger rows, hot or archived. Each NOT EXISTS
+# is one probe of an index led by book_id.
+PURGEABLE = '''
+SELECT id FROM book
+WHERE deleted_at IS NOT NULL AND deleted_at < ?
+  AND NOT EXISTS (SELECT 1 FROM copy WHERE copy.book_id = book.id AND copy.status != 'shelf')
+  AND NOT EXISTS (SELECT 1 FROM holds WHERE holds.book_id = book.id)
+  AND NOT EXISTS (SELECT 1 FROM main.borrowed_books WHERE borrowed_books.book_id = book.id)
+  AND NOT EXISTS (SELECT 1 FROM archive.borrowed_books WHERE borrowed_books.book_id = book.id)
+LIMIT ?
+'''
+
+
+def purge(retention_days=RETENTION_DAYS, batch_size=BATCH_SIZE, pause=BATCH_PAUSE, now=None):
+    """Deletes old tombstones for good, batch_size at a time. Returns the number purged.
+
+    Each batch is its own short write transaction, so borrows and returns
+    carry on in between. A tombstone whose history is still in the ledger
+    is kept, so borrowed_books never points at a missing book.
+    """
+    cutoff = int(now or time.time()) - retention_days * 86400
+    conn = library_store.connection()
+    purged = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [book_id for (book_id,) in conn.execute(PURGEABLE, (cutoff, batch_size))]
+            if ids:
+                marks = ",".join("?" * len(ids))
+                # The book's own triggers take its copies and search entry with it
+                conn.execute(f"DELETE FROM borrow_count WHERE book_id IN ({marks})", ids)
+                conn.execute(f"DELETE FROM book WHERE id IN ({marks})", ids)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        purged += len(ids)
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+    if purged:
+        catalog_cache.catalogue.catalogue_changed()
+    return purged
+
+
+def auto_vacuum_mode(conn):
+    """Returns 'none', 'full' or 'incremental'."""
+    (mode,) = conn.execute("PRAGMA auto_vacuum").fetchone()
+    return ("none", "full", "incremental")[mode]
+
+
+def enable_incremental_vacuum():
+    """Switches an existing file to incremental auto-vacuum.
+
+    New files get it from library_store.PRAGMAS; an older file only changes
+    mode through one full VACUUM, which rewrites the file under an exclusive
+    lock. Run this once, while the library is closed.
+    """
+    conn = library_store.connection()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return auto_vacuum_mode(conn)
+
+
+def reclaim(pages=VACUUM_PAGES, pause=BATCH_PAUSE):
+    """Hands free pages back to the file system in small steps. Returns the number of pages freed.
+
+    Each incremental_vacuum step is a short write of its own, so the file
+    shrinks without ever holding a long exclusive lock. Does nothing unless
+    the file is in incremental auto-vacuum mode.
+    """
+    conn = library_store.connection()
+    if auto_vacuum_mode(conn) != "incremental":
+        return 0
+    freed = 0
+    while True:
+        (free,) = conn.execute("PRAGMA freelist_count").fetchone()
+        if not free:
+            break
+        # Each step of the statement frees one page; executescript runs it to the end
+        conn.executescript(f"PRAGMA incremental_vacuum({min(pages, free)})")
+        (left,) = conn.execute("PRAGMA freelist_count").fetchone()
+        if left >= free:
+            break
+        freed += free - left
+        time.sleep(pause)
+    return freed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Purge old book tombstones and give their space back.")
+    parser.add_argument("--db", default=library_store.DB_PATH, help="database file")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS, help="keep tombstones this long")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="tombstones purged per transaction")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="switch an existing file to incremental auto-vacuum (one full VACUUM)")
+    args = parser.parse_args()
+
+    library_store.configure(args.db)
+    conn = library_store.connection()
+    if args.enable_incremental_vacuum:
+        print(f"auto_vacuum is now {enable_incremental_vacuum()}.")
+    started = time.perf_counter()
+    purged = purge(args.retention_days, args.batch_size)
+    freed = reclaim()
+    print(f"Purged {purged} tombstones and freed {freed} pages in {time.perf_counter() - started:.2f}s.")
+    if auto_vacuum_mode(conn) != "incremental":
+        print("auto_vacuum is off for this file; run with --enable-incremental-vacuum once to reclaim space.")
+    library_store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import catalog_cache
+import circulation
+import library_store
+
+WINDOW = 0.002  # seconds a busy writer lingers to gather more commands into a group
+BATCH_SIZE = 64  # most commands committed together
+SAMPLES = 1000  # batch sizes and commit latencies kept for the stats
+
+
+class WriteQueue:
+    """Runs every mutation on one writer thread and commits them in groups.
+
+    Commands that queued up while the previous group was committing, plus any
+    that arrive within `window` seconds after, up to `batch_size`, share a
+    single transaction and so a single fsync. As with PostgreSQL's
+    commit_delay/commit_siblings, the window is only waited out when other
+    commands are already queued; a lone caller is committed straight away. Each
+    command runs under its own savepoint, so one that fails is undone on its
+    own and the rest of the group still commits. Callers get a Future that is
+    resolved only after the commit.
+    """
+
+    def __init__(self, window=WINDOW, batch_size=BATCH_SIZE):
+        self.window = window
+        self.batch_size = batch_size
+        self._commands = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._batch_sizes = deque(maxlen=SAMPLES)
+        self._commit_seconds = deque(maxlen=SAMPLES)
+        self.commands = 0
+        self.batches = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name="writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, work, after=None):
+        """Queues work(cursor) for the next group commit and returns a Future for its result.
+
+        after(result), if given, runs on the writer once the group has committed.
+        """
+        future = Future()
+        self._commands.put((work, after, future))
+        return future
+
+    def _collect(self):
+        command = self._commands.get()
+        if command is None:
+            return None
+        batch = [command]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and len(batch) > 1:
+                    command = self._commands.get(timeout=remaining)
+                else:
+                    command = self._commands.get_nowait()
+            except queue.Empty:
+                break
+            if command is None:
+                self._commands.put(None)  # stop once this group is committed
+                break
+            batch.append(command)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            try:
+                self._commit(batch)
+            finally:
+                library_store.rollback()
+
+    def _commit(self, batch):
+        def work(cursor):
+            results = []
+            for command, _, _ in batch:
+                cursor.execute("SAVEPOINT command")
+                try:
+                    results.append((True, command(cursor)))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO command")
+                    results.append((False, e))
+                cursor.execute("RELEASE command")
+            return results
+
+        started = time.perf_counter()
+        try:
+            results = circulation.run_immediate(library_store.connection(), work)
+        except Exception as e:
+            with self._lock:
+                self.failed += len(batch)
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self.commands += len(batch)
+            self.batches += 1
+            self._batch_sizes.append(len(batch))
+            self._commit_seconds.append(elapsed)
+        for (_, after, future), (ok, value) in zip(batch, results):
+            if ok and after is not None:
+                try:
+                    after(value)
+                except Exception as e:
+                    ok, value = False, e
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def stats(self):
+        """Returns command and batch counts, batch size and commit latency (ms) figures."""
+        with self._lock:
+            sizes = sorted(self._batch_sizes)
+            seconds = sorted(self._commit_seconds)
+            report = {"commands": self.commands, "batches": self.batches, "failed": self.failed}
+        if sizes:
+            report["batch_size"] = {
+                "mean": round(sum(sizes) / len(sizes), 2),
+                "p50": sizes[len(sizes) // 2],
+                "max": sizes[-1],
+            }
+            report["commit_ms"] = {
+                "p50": round(seconds[len(seconds) // 2] * 1000, 3),
+                "p95": round(seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))] * 1000, 3),
+                "max": round(seconds[-1] * 1000, 3),
+            }
+        return report
+
+    def close(self):
+        """Commits what is already queued, then stops the writer thread."""
+        self._commands.put(None)
+        self._thread.join()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def configure(window=WINDOW, batch_size=BATCH_SIZE):
+    """Replaces the process-wide queue with one using the given group-commit settings."""
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            _queue.close()
+        _queue = WriteQueue(window, batch_size)
+    return _queue
+
+
+def writes():
+    """Returns the process-wide write queue, starting it on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = WriteQueue()
+        return _queue
+
+
+def submit_command(command):
+    """Queues a circulation (work, after) command and returns a Future for its result."""
+    work, after = command
+    return writes().submit(work, after)
+
+
+def submit_query(name, params=()):
+    """Queues a named query and returns a Future for its (rowcount, lastrowid)."""
+    def work(cursor):
+        cursor.execute(library_store.QUERIES[name], params)
+        return cursor.rowcount, cursor.lastrowid
+
+    def after(result):
+        if result[0]:
+            catalog_cache.catalogue.catalogue_changed()
+
+    return writes().submit(work, after if name in catalog_cache.CATALOGUE_WRITES else None)
+
+
+def run(command):
+    """Runs a circulation command through the writer and waits for its result."""
+    return submit_command(command).result()
+
+
+def execute(name, params=()):
+    """Runs a named query through the writer and waits for its (rowcount, lastrowid)."""
+    return submit_query(name, params).result()
+
+
+def stats():
+    return writes().stats()
+
+
+def close():
+    """Stops the process-wide writer after committing what is queued."""
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            _queue.close()
+            _queue = None